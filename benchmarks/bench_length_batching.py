@@ -0,0 +1,62 @@
+"""Padding ratio of random, length-grouped and token-budget training batches.
+
+Run from repository root:
+    python -m benchmarks.bench_length_batching bert --batch 128
+"""
+import random
+
+from length_sampler import LengthGroupedBatchSampler
+
+
+def padding_ratio(batches, lengths) -> float:
+    """Returns fraction of padding tokens when batches are padded to longest.
+    """
+    tokens = padded = 0
+    for batch in batches:
+        tokens += sum(lengths[i] for i in batch)
+        padded += len(batch) * max(lengths[i] for i in batch)
+    return 1 - tokens / padded
+
+
+def random_batches(num_samples, batch_size, seed=0):
+    indices = list(range(num_samples))
+    random.Random(seed).shuffle(indices)
+    return [indices[i:i + batch_size]
+            for i in range(0, num_samples, batch_size)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from transformers import AutoTokenizer
+
+    from sentence_classifier import PRETRAINED
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='Huggingface pretrained model '
+                        'or path to saved model on disk')
+    parser.add_argument('--batch', type=int, default=128,
+                        help='training batch size')
+    parser.add_argument('--max_tokens', type=int,
+                        help='token budget per batch (batch * mean padded '
+                        'length of random batches if not set)')
+    args = parser.parse_args()
+    tokeniser = AutoTokenizer.from_pretrained(
+        PRETRAINED.get(args.model, args.model), use_fast=True)
+    print(f'{"dataset":>8} {"random":>8} {"grouped":>8} {"budget":>8} '
+          f'{"batches":>16}')
+    for name, dataset in DATASETS.items():
+        text = dataset.load()['train']['text']
+        lengths = [len(ids) for ids in tokeniser(text)['input_ids']]
+        shuffled = random_batches(len(lengths), args.batch)
+        max_tokens = args.max_tokens or int(
+            sum(len(b) * max(lengths[i] for i in b) for b in shuffled)
+            / len(shuffled))
+        grouped = LengthGroupedBatchSampler(lengths, args.batch)
+        budget = LengthGroupedBatchSampler(lengths, args.batch, max_tokens)
+        print(f'{name:>8} {padding_ratio(shuffled, lengths):>8.3f} '
+              f'{padding_ratio(grouped, lengths):>8.3f} '
+              f'{padding_ratio(budget, lengths):>8.3f} '
+              f'{len(shuffled):>7} -> {len(budget):>6}')
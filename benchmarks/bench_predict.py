@@ -0,0 +1,57 @@
+"""Compares SentenceClassifier.predict with the Trainer.predict path.
+
+Run from repository root with a model saved by train.py:
+    python -m benchmarks.bench_predict models/bert-base-uncased_bank_10epochs \
+        bank --samples 100000
+"""
+import time
+
+from datasets import Dataset
+import numpy as np
+from transformers import Trainer
+
+from tokenise_data import tokenise_data
+
+
+def trainer_predict(model, texts, batch_size):
+    """Classifies texts as previously required: via Dataset, tokenise_data
+    (with dummy labels) and Trainer.predict."""
+    data = Dataset.from_dict({'text': texts, 'label': [0] * len(texts)})
+    data = tokenise_data(model.tokeniser, data)
+    model.args.per_device_eval_batch_size = batch_size
+    trainer = Trainer(model=model._load_model(), args=model.args,
+                      tokenizer=model.tokeniser)
+    logits = trainer.predict(data).predictions
+    return np.argmax(logits, axis=1)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='path to saved model')
+    parser.add_argument('dataset', type=str,
+                        help=f'dataset to use {list(DATASETS)}')
+    parser.add_argument('--samples', type=int, default=100000,
+                        help='number of sentences (test split is repeated)')
+    parser.add_argument('--batch', type=int, default=256, help='batch size')
+    args = parser.parse_args()
+    model = SentenceClassifier.create(args.model, DATASETS[args.dataset].load())
+    test = model.data['test']['text']
+    texts = (test * (args.samples // len(test) + 1))[:args.samples]
+    start = time.perf_counter()
+    expected = trainer_predict(model, texts, args.batch)
+    baseline = time.perf_counter() - start
+    start = time.perf_counter()
+    labels, _ = model.predict(texts, batch_size=args.batch)
+    elapsed = time.perf_counter() - start
+    agree = np.mean(labels[:, 0] == np.array(model.classes)[expected])
+    print(f'Trainer.predict: {baseline:.1f}s '
+          f'({args.samples / baseline:.0f} sentences/s)')
+    print(f'predict:         {elapsed:.1f}s '
+          f'({args.samples / elapsed:.0f} sentences/s), '
+          f'speed-up {baseline / elapsed:.2f}x, agreement {agree:.4f}')
@@ -0,0 +1,79 @@
+"""Startup time of train.py subcommands against targets.
+
+Each command is run in a fresh interpreter and the median wall time is
+compared with its target. 'help' and 'parse errors' must not import torch,
+transformers or datasets. 'eval imports' measures the imports of an
+evaluation-only run before any data is loaded, which must not import the
+training modules (Trainer subclasses and distillation).
+
+Run from repository root:
+    python -m benchmarks.bench_startup --repeats 5
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+
+# (command arguments, target seconds)
+COMMANDS = {
+    'help': (['train.py', '--help'], 0.5),
+    'subcommand help': (['train.py', 'eval', '--help'], 0.5),
+    'parse error': (['train.py', 'eval', 'model', 'unknown'], 0.5),
+    'eval imports': (['-c', 'import sentence_classifier, train; '
+                      'train.DATASETS["bank"]'], 6.0)
+}
+HEAVY = ['torch', 'transformers', 'datasets']
+TRAINING = ['length_sampler', 'distil']
+
+
+def wall_time(args, repeats=3) -> tuple:
+    """Returns (median wall time in seconds, exit code) of running Python
+    with args."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        code = subprocess.run([sys.executable] + args,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL).returncode
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), code
+
+
+def imported(code: str, modules: list) -> list:
+    """Returns modules imported by running code in a fresh interpreter."""
+    check = (f'{code}\nimport sys\n'
+             f'print(" ".join(m for m in {modules!r} if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', check],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True).stdout
+    return output.split()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='runs per command (median is reported)')
+    args = parser.parse_args()
+    failed = False
+    print(f'{"command":>16} {"seconds":>8} {"target":>7}')
+    for name, (command, target) in COMMANDS.items():
+        seconds, code = wall_time(command, args.repeats)
+        # argparse exits with 2 on parse errors
+        error = code not in (0, 2)
+        failed |= error or seconds > target
+        print(f'{name:>16} {seconds:>8.2f} {target:>7.1f}'
+              f'{f"  FAIL (exit code {code})" if error else ""}'
+              f'{"  FAIL" if not error and seconds > target else ""}')
+    parse_only = ('import train; train.build_parser().parse_args('
+                  '["eval", "model", "bank"])')
+    for name, code, modules in [
+            ('parse', parse_only, HEAVY),
+            ('eval imports', COMMANDS['eval imports'][0][1], TRAINING)]:
+        unexpected = imported(code, modules)
+        failed |= bool(unexpected)
+        print(f'{name} imports {unexpected or "none"} of {modules}')
+    sys.exit(1 if failed else 0)
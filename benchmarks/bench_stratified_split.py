@@ -0,0 +1,78 @@
+"""Benchmark of stratified validation split on synthetic CSV files.
+
+Run from repository root:
+    python -m benchmarks.bench_stratified_split --rows 1000000
+"""
+from collections import Counter
+import csv
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from polyai_dataset.stratified_split import (
+    read_column, read_split, validation_mask
+)
+
+
+def write_synthetic_csv(filepath, rows, num_classes=77, seed=0):
+    """Writes CSV with 'text' and 'category' columns and skewed classes."""
+    rng = random.Random(seed)
+    classes = [f'intent_{i}' for i in range(num_classes)]
+    weights = [1 + i % 7 for i in range(num_classes)]
+    with open(filepath, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['text', 'category'])
+        for i, label in enumerate(rng.choices(classes, weights, k=rows)):
+            writer.writerow([f'how do I do thing number {i}?', label])
+
+
+def quadratic_split(filepath):
+    """Validation split as previously done in Banking77 and Hwu64Sub."""
+    with open(filepath) as fp:
+        all_train = [x for x in csv.DictReader(fp)]
+    val_split = []
+    labels = [x['category'] for x in all_train]
+    for label, count in Counter(labels).items():
+        n = count // 5
+        val_split.extend([i for i, c in enumerate(labels) if c == label][:n])
+    train_split = [i for i in range(len(all_train)) if i not in val_split]
+    return ([all_train[i] for i in train_split],
+            [all_train[i] for i in val_split])
+
+
+def streaming_split(filepath, strategy='first'):
+    """Validation split with `validation_mask`, consuming both splits."""
+    mask = validation_mask(read_column(filepath), strategy=strategy, seed=0)
+    train = sum(1 for _ in read_split(filepath, mask, 0))
+    val = sum(1 for _ in read_split(filepath, mask, 1))
+    return train, val
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='numbers of synthetic CSV rows')
+    parser.add_argument('--quadratic_max', type=int, default=20000,
+                        help='largest size to run previous quadratic split on')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f'{"rows":>10} {"quadratic":>10} {"first":>10} {"random":>10}')
+        for rows in args.rows:
+            filepath = Path(tmp_dir).joinpath(f'train_{rows}.csv')
+            write_synthetic_csv(filepath, rows)
+            quadratic = (f'{timed(quadratic_split, filepath):.2f}s'
+                         if rows <= args.quadratic_max else '-')
+            first = timed(streaming_split, filepath, 'first')
+            rand = timed(streaming_split, filepath, 'random')
+            print(f'{rows:>10} {quadratic:>10} {first:>9.2f}s {rand:>9.2f}s')
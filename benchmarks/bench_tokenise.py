@@ -0,0 +1,67 @@
+"""Tokenisation time in-process versus process pools of increasing size.
+
+Shows the crossover point used by `tokenise_data.tokenisation_plan`. Uses the
+offline tiny tokeniser of run_benchmarks unless a model is given.
+
+Run from repository root:
+    python -m benchmarks.bench_tokenise --sizes 10000 100000 1000000
+    python -m benchmarks.bench_tokenise --model bert
+"""
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.run_benchmarks import WORDS, write_tiny_model
+
+
+def synthetic_dataset(rows, seed=0):
+    from datasets import Dataset
+
+    rng = random.Random(seed)
+    text = [' '.join(rng.choice(WORDS)
+                     for _ in range(int(rng.lognormvariate(2.2, 0.5)) + 1))
+            for _ in range(rows)]
+    return Dataset.from_dict({'text': text, 'label': [0] * rows})
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from transformers import AutoTokenizer
+
+    from sentence_classifier import PRETRAINED
+    from tokenise_data import tokenisation_plan, tokenise_data
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model', type=str,
+                        help='Huggingface tokeniser (offline tiny tokeniser '
+                        'if not set)')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='numbers of sentences')
+    parser.add_argument('--slow', action='store_true',
+                        help='use Python tokeniser instead of fast tokeniser')
+    args = parser.parse_args()
+    cpus = os.cpu_count() or 1
+    procs = sorted({1, 2, max(1, cpus // 2), cpus})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.model:
+            name = PRETRAINED.get(args.model, args.model)
+        else:
+            write_tiny_model(tmp_dir)
+            name = tmp_dir
+        tokeniser = AutoTokenizer.from_pretrained(name, use_fast=not args.slow)
+        print(f'{"rows":>8} ' + ' '.join(f'{f"{n} proc":>9}' for n in procs)
+              + f' {"auto":>9} {"plan":>12}')
+        for rows in args.sizes:
+            data = synthetic_dataset(rows)
+            times = []
+            for num_proc in procs + [None]:
+                start = time.perf_counter()
+                tokenise_data(tokeniser, data, num_proc=num_proc)
+                times.append(time.perf_counter() - start)
+            plan = tokenisation_plan(tokeniser, rows)
+            print(f'{rows:>8} ' + ' '.join(f'{t:>8.2f}s' for t in times)
+                  + f' {plan["num_proc"] or 1:>7} procs')
@@ -0,0 +1,77 @@
+"""Attention FLOPs saved versus accuracy lost by truncation policies.
+
+The test split is truncated with the length limit each policy derives from
+the training split, and evaluated with `SentenceClassifier.eval` (results
+saved with '-trunc<policy>' suffix). FLOPs of self-attention are counted over
+evaluation batches padded to their longest sample.
+
+Run from repository root with a model saved by train.py:
+    python -m benchmarks.bench_truncation \
+        models/bert-base-uncased_bank_10epochs bank --policies model p99 32
+"""
+from tokenise_data import (attention_flops, token_lengths, truncate_data,
+                           truncation_length)
+
+
+def compare_policies(classifier, policies, batch_size: int=None) -> list:
+    """Evaluates test split of classifier truncated by each policy.
+
+    Args:
+        classifier: SentenceClassifier with trained model
+        policies: truncation policies (see `tokenise_data.truncation_length`),
+        differences are relative to the first
+        batch_size: evaluation batch size (from classifier.args if None)
+
+    Returns:
+        [{'policy', 'max_length', 'accuracy', 'attention_flops',
+          'flops_drop', 'accuracy_delta'}]
+    """
+    batch_size = batch_size or classifier.args.eval_batch_size
+    config = classifier._inference_model().config
+    train_lengths = token_lengths(classifier.data['train'])
+    rows = []
+    for policy in policies:
+        max_length = truncation_length(classifier.tokeniser, train_lengths,
+                                       policy)
+        test = truncate_data(classifier.tokeniser, classifier.data['test'],
+                             max_length)
+        metrics = classifier.eval(test, suffix=f'-trunc{policy}')
+        rows.append({'policy': policy, 'max_length': max_length,
+                     'accuracy': metrics['eval_accuracy'],
+                     'attention_flops': attention_flops(
+                         token_lengths(test), config.hidden_size,
+                         config.num_hidden_layers, batch_size)})
+    for row in rows:
+        row['flops_drop'] = 1 - (row['attention_flops']
+                                 / rows[0]['attention_flops'])
+        row['accuracy_delta'] = row['accuracy'] - rows[0]['accuracy']
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='path to saved model')
+    parser.add_argument('dataset', type=str,
+                        help=f'dataset to use {list(DATASETS)}')
+    parser.add_argument('--policies', type=str, nargs='+',
+                        default=['model', 'p99', 'p95', 'p90'],
+                        help='truncation policies, compared with the first')
+    parser.add_argument('--batch', type=int, default=128,
+                        help='evaluation batch size')
+    args = parser.parse_args()
+    model = SentenceClassifier.create(args.model,
+                                      DATASETS[args.dataset].load())
+    model.args.output_dir = args.model
+    print(f'{"policy":>8} {"length":>6} {"accuracy":>8} {"delta":>7} '
+          f'{"GFLOPs":>8} {"drop":>6}')
+    for row in compare_policies(model, args.policies, args.batch):
+        print(f'{row["policy"]:>8} {row["max_length"]:>6} '
+              f'{row["accuracy"]:>8.3f} {row["accuracy_delta"]:>+7.3f} '
+              f'{row["attention_flops"] / 1e9:>8.1f} '
+              f'{row["flops_drop"]:>6.1%}')
@@ -0,0 +1,91 @@
+"""Load generator for serve.py reporting latency percentiles and throughput.
+
+Run from repository root while serve.py is running:
+    python -m benchmarks.load_test --concurrency 1 8 32 --requests 2000
+"""
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.request
+
+SENTENCES = [
+    'I lost my card, what should I do?',
+    'how long does a transfer to another country take',
+    'set an alarm for seven tomorrow morning',
+    'what is the weather like in Berlin',
+    'Why was I charged twice for the same purchase in the shop yesterday?',
+    'play some jazz',
+    'can you tell me my account balance please',
+    'book a table for two at an italian restaurant tonight at eight',
+]
+
+
+def percentile(values, p):
+    """Returns p-th percentile of values (nearest rank)."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * len(values))))]
+
+
+def run(url, concurrency, requests, seed=0):
+    """Sends requests from concurrent threads.
+
+    Returns:
+        (list of latencies in seconds, elapsed seconds, number of errors)
+    """
+    latencies, errors = [], []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            body = json.dumps({'text': rng.choice(SENTENCES)}).encode()
+            request = urllib.request.Request(
+                url, data=body, headers={'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+            except OSError as e:
+                errors.append(e)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start, len(errors)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000/predict',
+                        help='prediction endpoint of serve.py')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 8, 32], help='numbers of concurrent clients')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='requests per concurrency level')
+    args = parser.parse_args()
+    print(f'{"clients":>8} {"p50 ms":>8} {"p99 ms":>8} {"mean ms":>8} '
+          f'{"req/s":>8} {"errors":>7}')
+    for concurrency in args.concurrency:
+        latencies, elapsed, errors = run(args.url, concurrency, args.requests)
+        if not latencies:
+            print(f'{concurrency:>8} all {errors} requests failed')
+            continue
+        ms = [1000 * x for x in latencies]
+        print(f'{concurrency:>8} {percentile(ms, 50):>8.1f} '
+              f'{percentile(ms, 99):>8.1f} {statistics.mean(ms):>8.1f} '
+              f'{len(latencies) / elapsed:>8.1f} {errors:>7}')
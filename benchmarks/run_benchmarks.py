@@ -0,0 +1,287 @@
+"""Benchmark suite for load, tokenise, train and eval stages.
+
+Runs offline on CPU with a tiny randomly initialised BERT model and synthetic
+datasets in Banking77 layout. Each size is run twice, each time in a fresh
+process: a timing pass records wall time and peak resident set size of every
+stage, and a memory pass records peak traced Python memory (tracemalloc slows
+down the code it traces, so it is kept out of the timings). Results are saved
+as JSON and can be compared with a stored baseline, in which case the script
+exits with status 1 on regressions. Baselines are only compared if recorded
+with the same Python, machine and library versions (the stored baseline uses
+the versions of requirements.txt).
+
+Run from repository root:
+    python -m benchmarks.run_benchmarks --sizes 10000 100000 1000000 \
+        --output bench.json --baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --output benchmarks/baseline.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import csv
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+
+WORDS = [f'w{i}' for i in range(500)]
+STAGES = ['load', 'tokenise', 'train', 'eval']  # load and tokenise always run
+
+
+def write_synthetic_dataset(data_dir, rows, num_classes=77, seed=0):
+    """Writes train.csv, test.csv (rows // 4) and categories.json."""
+    rng = random.Random(seed)
+    classes = [f'intent_{i}' for i in range(num_classes)]
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    with open(data_dir.joinpath('categories.json'), 'w') as fp:
+        json.dump(classes, fp)
+    for split, n in [('train', rows), ('test', rows // 4)]:
+        with open(data_dir.joinpath(f'{split}.csv'), 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['text', 'category'])
+            for i in range(n):
+                # Class IDs cycle so every split contains every class
+                length = int(rng.lognormvariate(2.2, 0.5)) + 1
+                text = ' '.join(rng.choice(WORDS) for _ in range(length))
+                writer.writerow([text, classes[i % num_classes]])
+
+
+def write_tiny_model(model_dir, num_labels=77):
+    """Saves a randomly initialised 2-layer BERT model and its tokeniser."""
+    from transformers import (
+        BertConfig, BertForSequenceClassification, BertTokenizerFast
+    )
+
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + WORDS
+    vocab_file = model_dir.joinpath('vocab.txt')
+    vocab_file.write_text('\n'.join(vocab) + '\n')
+    BertTokenizerFast(str(vocab_file)).save_pretrained(str(model_dir))
+    config = BertConfig(vocab_size=len(vocab), hidden_size=32,
+                        num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=128,
+                        num_labels=num_labels)
+    BertForSequenceClassification(config).save_pretrained(str(model_dir))
+
+
+def reset_peak_rss():
+    """Resets peak resident set size of this process to its current size
+    (Linux 4.0 or later, otherwise the peak stays the process lifetime
+    peak)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        pass
+
+
+def rss_mb() -> dict:
+    """Returns current ('rss') and peak ('peak') resident set size of this
+    process in MB, peak since `reset_peak_rss`."""
+    sizes = {}
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key = 'rss' if line.startswith('VmRSS') else 'peak'
+                    sizes[key] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if 'peak' not in sizes:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        sizes = {'rss': sizes.get('rss', peak), 'peak': peak}
+    return sizes
+
+
+@contextmanager
+def measure(results, stage, rows, trace_memory=False):
+    """Records wall time, rows/s, peak resident set size and its increase
+    over the size at the start of a stage, or only its peak traced Python
+    memory if trace_memory."""
+    if trace_memory:
+        tracemalloc.start()
+        yield
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[stage] = {'peak_python_mb': peak / 2**20}
+        return
+    reset_peak_rss()
+    start_rss = rss_mb()['rss']
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    peak = rss_mb()['peak']
+    results[stage] = {'seconds': seconds, 'rows_per_second': rows / seconds,
+                      'peak_rss_mb': peak, 'rss_increase_mb': peak - start_rss}
+
+
+def run(size, work_dir, train_rows=None, stages=STAGES,
+        trace_memory=False) -> dict:
+    """Runs benchmark stages on a synthetic dataset of given size.
+
+    Returns:
+        {stage: {'seconds', 'rows_per_second', 'peak_rss_mb',
+                 'rss_increase_mb'}}, or {stage: {'peak_python_mb'}} if
+        trace_memory (see `measure`)
+    """
+    from transformers.trainer_utils import EvaluationStrategy
+
+    from polyai_dataset.banking77 import Banking77
+    from sentence_classifier import SentenceClassifier
+
+    work_dir = Path(work_dir)
+    data_dir = work_dir.joinpath(f'data_{size}')
+    model_dir = work_dir.joinpath('model')
+    write_synthetic_dataset(data_dir, size)
+    if not model_dir.exists():
+        write_tiny_model(model_dir)
+    results = {}
+    with measure(results, 'load', size, trace_memory):
+        dataset = Banking77.load(str(data_dir),
+                                 cache_dir=str(work_dir.joinpath('cache')))
+    with measure(results, 'tokenise', sum(len(s) for s in dataset.values()),
+                 trace_memory):
+        classifier = SentenceClassifier.create(str(model_dir), dataset)
+    classifier.args.output_dir = str(work_dir.joinpath(f'out_{size}'))
+    if 'train' in stages:
+        train = classifier.data['train']
+        if train_rows and len(train) > train_rows:
+            train = train.select(range(train_rows))
+        classifier.args.num_train_epochs = 1
+        classifier.args.per_device_train_batch_size = 32
+        classifier.args.evaluation_strategy = EvaluationStrategy.NO
+        classifier.args.load_best_model_at_end = False
+        classifier.args.save_steps = 10**9
+        with measure(results, 'train', len(train), trace_memory):
+            classifier.train(train_dataset=train)
+    if 'eval' in stages:
+        test = classifier.data['test']
+        with measure(results, 'eval', len(test), trace_memory):
+            classifier.eval(test)
+    return results
+
+
+def run_passes(size, work_dir, train_rows=None, stages=STAGES) -> dict:
+    """Runs timing and memory passes of a size in separate processes.
+
+    Each pass starts from an empty work folder, so that neither reuses caches
+    or memory of the other.
+
+    Returns:
+        {stage: {'seconds', 'rows_per_second', 'peak_rss_mb',
+                 'rss_increase_mb', 'peak_python_mb'}}
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for trace_memory in [False, True]:
+        pass_dir = Path(work_dir).joinpath(
+            f'{"memory" if trace_memory else "timing"}_{size}')
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            stages_results = pool.submit(run, size, str(pass_dir), train_rows,
+                                         stages, trace_memory).result()
+        for stage, metrics in stages_results.items():
+            results.setdefault(stage, {}).update(metrics)
+    return results
+
+
+def environment() -> dict:
+    """Returns Python, machine and library versions results depend on."""
+    import datasets
+    import torch
+    import transformers
+
+    return {'python': platform.python_version(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'torch': torch.__version__,
+            'transformers': transformers.__version__,
+            'datasets': datasets.__version__}
+
+
+def environment_differences(current, baseline) -> list:
+    """Returns descriptions of environment entries differing from baseline.
+    """
+    return [f'{key}: {current.get(key)} vs {baseline.get(key)} baseline'
+            for key in sorted(set(current) | set(baseline))
+            if current.get(key) != baseline.get(key)]
+
+
+def compare(results, baseline, threshold) -> list:
+    """Returns descriptions of stages slower than baseline by threshold."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            reference = baseline.get(size, {}).get(stage)
+            if not reference:
+                continue
+            ratio = metrics['seconds'] / reference['seconds']
+            if ratio > 1 + threshold:
+                regressions.append(
+                    f'{stage} ({size} rows): {metrics["seconds"]:.2f}s vs '
+                    f'{reference["seconds"]:.2f}s baseline ({ratio:.2f}x)')
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='numbers of synthetic training rows')
+    parser.add_argument('--stages', nargs='+', default=STAGES,
+                        choices=STAGES, help='stages to run')
+    parser.add_argument('--train_rows', type=int, default=10000,
+                        help='maximum training rows for the train stage')
+    parser.add_argument('--output', type=str, default='bench_results.json',
+                        help='JSON file to save results')
+    parser.add_argument('--baseline', type=str,
+                        help='JSON file of baseline results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative slowdown against baseline')
+    parser.add_argument('--ignore_environment', action='store_true',
+                        help='compare with a baseline recorded with other '
+                        'Python, machine or library versions')
+    args = parser.parse_args()
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', '')
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            results[str(size)] = run_passes(size, work_dir, args.train_rows,
+                                            args.stages)
+            for stage, metrics in results[str(size)].items():
+                print(f'{size:>8} {stage:>9} {metrics["seconds"]:>9.2f}s '
+                      f'{metrics["rows_per_second"]:>11.0f} rows/s '
+                      f'{metrics["peak_rss_mb"]:>8.1f} MB RSS '
+                      f'(+{metrics["rss_increase_mb"]:.1f}) '
+                      f'{metrics["peak_python_mb"]:>8.1f} MB Python')
+    current = environment()
+    with open(args.output, 'w') as fp:
+        json.dump({'environment': current, 'results': results}, fp,
+                  indent=2)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        differences = environment_differences(
+            current, baseline.get('environment', {}))
+        for difference in differences:
+            print(f'ENVIRONMENT {difference}')
+        if differences and not args.ignore_environment:
+            sys.exit(f'timings are not comparable with {args.baseline}, '
+                     f'recorded in a different environment (pass '
+                     f'--ignore_environment to compare anyway)')
+        baseline = baseline['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions against {args.baseline}')
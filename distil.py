@@ -0,0 +1,130 @@
+"""Knowledge distillation from a trained teacher into a student classifier."""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import torch.nn.functional as F
+
+from frozen_encoder import model_fingerprint, saved_classifier
+from length_sampler import BucketedTrainer
+from quantise import measure_speed
+from tokenise_cache import data_fingerprint
+
+
+TEACHER_LOGITS = 'teacher_logits'
+
+
+def teacher_logits(teacher, dataset) -> np.ndarray:
+    """Returns teacher logits over dataset, computed once and cached.
+
+    Logits are saved as memory-mapped NumPy file in the teacher's model folder
+    keyed by the fingerprints of the saved teacher model and the tokenised
+    dataset, so that retraining the teacher invalidates them. Logits are
+    always computed with the teacher model saved at its model_name_or_path.
+
+    Args:
+        teacher: SentenceClassifier with trained model
+        dataset: dataset tokenised by teacher's tokeniser
+    """
+    key = hashlib.sha256(
+        (model_fingerprint(teacher.model_name_or_path)
+         + data_fingerprint(dataset)).encode()).hexdigest()[:16]
+    path = Path(teacher.model_name_or_path).joinpath(
+        f'{TEACHER_LOGITS}-{key}.npy')
+    if not path.exists():
+        tmp_path = path.with_suffix('.tmp.npy')
+        np.save(tmp_path, saved_classifier(teacher).logits(dataset))
+        tmp_path.replace(path)
+    return np.load(path, mmap_mode='r')
+
+
+def add_teacher_logits(dataset, logits: np.ndarray):
+    """Returns dataset with 'teacher_logits' field added."""
+    if len(dataset) != len(logits):
+        raise ValueError(f'{len(logits)} teacher logits for dataset of '
+                         f'{len(dataset)} samples')
+    return dataset.map(
+        lambda _, indices: {TEACHER_LOGITS: logits[indices].tolist()},
+        with_indices=True, batched=True)
+
+
+class DistillationTrainer(BucketedTrainer):
+    """Trainer minimising mixed cross-entropy and distillation loss.
+
+    loss = alpha * CE(student, labels)
+           + (1 - alpha) * T² * KL(softmax(teacher / T) || softmax(student / T))
+
+    Training samples must have 'teacher_logits' field, samples without it (eg.
+    evaluation) use cross-entropy only.
+    """
+    def __init__(self, *args, alpha=0.5, temperature=2.0, **kwargs):
+        """Constructor.
+
+        Args:
+            alpha: weight of cross-entropy loss
+            temperature: softmax temperature of distillation loss
+            args, kwargs: passed to BucketedTrainer
+        """
+        self.alpha = alpha
+        self.temperature = temperature
+        super().__init__(*args, **kwargs)
+
+    def _remove_unused_columns(self, dataset, description=None):
+        if not self.args.remove_unused_columns:
+            return
+        super()._remove_unused_columns(dataset, description)
+        if TEACHER_LOGITS in dataset.column_names:
+            dataset.set_format(
+                type=dataset.format['type'],
+                columns=dataset.format['columns'] + [TEACHER_LOGITS])
+
+    def compute_loss(self, model, inputs):
+        teacher = inputs.pop(TEACHER_LOGITS, None)
+        outputs = model(**inputs)
+        loss = outputs['loss'] if isinstance(outputs, dict) else outputs[0]
+        if teacher is None:
+            return loss
+        logits = outputs['logits'] if isinstance(outputs, dict) else outputs[1]
+        t = self.temperature
+        distillation = F.kl_div(
+            F.log_softmax(logits / t, dim=-1),
+            F.softmax(teacher.to(logits.dtype) / t, dim=-1),
+            reduction='batchmean') * t ** 2
+        return self.alpha * loss + (1 - self.alpha) * distillation
+
+
+def report_tradeoff(teacher, student, test_dataset, test_teacher,
+                    batch_size=32) -> dict:
+    """Evaluates teacher and student on test data and measures CPU latency.
+
+    Results are saved into 'distillation_results.txt' in the student's
+    output folder.
+
+    Args:
+        teacher: SentenceClassifier with trained teacher model
+        student: SentenceClassifier with trained student model
+        test_dataset: test dataset tokenised by student's tokeniser
+        test_teacher: test dataset tokenised by teacher's tokeniser
+        batch_size: batch size for latency measurements
+    """
+    teacher.args.output_dir = student.args.output_dir
+    results = {}
+    for name, model, data in [('teacher', teacher, test_teacher),
+                              ('student', student, test_dataset)]:
+        model.model = model._cpu_model()
+        metrics = model.eval(data, suffix=f'-{name}')
+        results[f'{name}_accuracy'] = metrics['eval_accuracy']
+        speed = measure_speed(model, data['text'], batch_size)
+        for key, value in speed.items():
+            results[f'{name}_{key}'] = value
+        results[f'{name}_parameters'] = sum(
+            p.numel() for p in model.model.parameters())
+    results['accuracy_loss'] = (results['teacher_accuracy']
+                                - results['student_accuracy'])
+    results['speed_up'] = (results['teacher_latency_ms']
+                           / results['student_latency_ms'])
+    with open(Path(student.args.output_dir).joinpath(
+            'distillation_results.txt'), 'w') as writer:
+        for key, value in results.items():
+            writer.write(f'{key} = {value}\n')
+    return results
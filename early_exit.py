@@ -0,0 +1,311 @@
+"""Early-exit inference with classifiers on intermediate encoder layers.
+
+After fine-tuning, a linear exit head is trained on the mean pooled output of
+every encoder layer but the last, with the fine-tuned model frozen. At
+inference the encoder is run layer by layer, and each sentence leaves at the
+first layer whose softmax confidence reaches the threshold, so that easy
+sentences skip the remaining layers. Sentences that never reach the threshold
+are classified by the fine-tuned head after the last layer.
+
+Only models with BERT-style encoders ('embeddings' and 'encoder.layer'
+modules, eg. BERT, RoBERTa and ELECTRA) are supported.
+
+Example:
+    python early_exit.py models/bert-base-uncased_bank_10epochs bank \
+        --thresholds 0.5 0.8 0.9 0.95 0.99
+"""
+from pathlib import Path
+import tempfile
+
+import numpy as np
+import torch
+
+from frozen_encoder import train_head
+from label_index import masked_mean
+from quantise import measure_speed
+
+
+EXIT_HEADS = 'exit_heads.bin'
+
+
+def encoder_layers(model):
+    """Returns list of encoder layers of sequence classification model.
+
+    Raises:
+        ValueError if model has no BERT-style encoder.
+    """
+    layers = getattr(getattr(model.base_model, 'encoder', None), 'layer',
+                     None)
+    if layers is None or not hasattr(model.base_model, 'embeddings'):
+        raise ValueError(f'early exit needs a BERT-style encoder, '
+                         f'{type(model.base_model).__name__} has none')
+    return list(layers)
+
+
+def final_logits(model, hidden_states) -> torch.Tensor:
+    """Returns logits of fine-tuned head from last hidden states."""
+    pooler = getattr(model.base_model, 'pooler', None)
+    features = pooler(hidden_states) if pooler is not None else hidden_states
+    return model.classifier(features)
+
+
+class EarlyExit(torch.nn.Module):
+    """Exit heads of intermediate layers and confidence threshold."""
+    def __init__(self, hidden_size: int, num_classes: int, num_layers: int,
+                 threshold=0.9):
+        """Constructor.
+
+        Args:
+            hidden_size: hidden size of encoder
+            num_classes: number of classes
+            num_layers: number of encoder layers (one head per layer but the
+            last)
+            threshold: minimum softmax probability of predicted class to exit
+            (no early exits if above 1)
+        """
+        super().__init__()
+        self.heads = torch.nn.ModuleList(
+            [torch.nn.Linear(hidden_size, num_classes)
+             for _ in range(num_layers - 1)])
+        self.threshold = threshold
+
+    def forward(self, model, inputs):
+        """Runs model layer by layer, exiting confident samples early.
+
+        Args:
+            model: fine-tuned sequence classification model
+            inputs: padded model inputs with 'input_ids' and 'attention_mask'
+
+        Returns:
+            ([batch_size, number_of_classes] tensor of logits,
+             [batch_size] tensor of number of layers executed)
+        """
+        base = model.base_model
+        layers = encoder_layers(model)
+        input_ids = inputs['input_ids']
+        attention_mask = inputs['attention_mask']
+        hidden = base.embeddings(input_ids=input_ids,
+                                 token_type_ids=inputs.get('token_type_ids'))
+        if hasattr(base, 'embeddings_project'):
+            hidden = base.embeddings_project(hidden)
+        extended_mask = base.get_extended_attention_mask(
+            attention_mask, input_ids.shape, input_ids.device)
+        logits = torch.zeros(len(input_ids), model.config.num_labels,
+                             device=input_ids.device)
+        executed = torch.full((len(input_ids),), len(layers),
+                              dtype=torch.long, device=input_ids.device)
+        active = torch.arange(len(input_ids), device=input_ids.device)
+        for depth, layer in enumerate(layers, 1):
+            hidden = layer(hidden, extended_mask)[0]
+            if depth == len(layers):
+                logits[active] = final_logits(model, hidden).to(logits.dtype)
+                break
+            exit_logits = self.heads[depth - 1](
+                masked_mean(hidden, attention_mask))
+            confident = (torch.softmax(exit_logits, dim=-1).max(dim=-1)[0]
+                         >= self.threshold)
+            if confident.any():
+                logits[active[confident]] = exit_logits[confident].to(
+                    logits.dtype)
+                executed[active[confident]] = depth
+                remaining = ~confident
+                if not remaining.any():
+                    break
+                active = active[remaining]
+                hidden = hidden[remaining]
+                attention_mask = attention_mask[remaining]
+                extended_mask = extended_mask[remaining]
+        return logits, executed
+
+    def save(self, path):
+        """Saves exit heads and threshold."""
+        torch.save({'state_dict': self.state_dict(),
+                    'threshold': self.threshold,
+                    'num_layers': len(self.heads) + 1}, path)
+
+    @staticmethod
+    def load(path, hidden_size: int, num_classes: int, threshold=None):
+        """Loads exit heads saved by `save`.
+
+        Args:
+            path: file saved by `save`
+            hidden_size: hidden size of encoder
+            num_classes: number of classes
+            threshold: overrides saved threshold if not None
+        """
+        saved = torch.load(path, map_location='cpu')
+        early_exit = EarlyExit(hidden_size, num_classes, saved['num_layers'],
+                               saved['threshold'])
+        early_exit.load_state_dict(saved['state_dict'])
+        if threshold is not None:
+            early_exit.threshold = threshold
+        return early_exit
+
+
+def layer_features(classifier, dataset, path,
+                   batch_size: int=None) -> np.ndarray:
+    """Writes pooled outputs of intermediate layers of fine-tuned model into
+    a memory-mapped NumPy file, batch by batch.
+
+    Args:
+        classifier: SentenceClassifier with fine-tuned model
+        dataset: tokenised dataset
+        path: NumPy file of features
+        batch_size: evaluation batch size (from classifier.args if None)
+
+    Returns:
+        [number_of_layers - 1, len(dataset), hidden_size] memory-mapped
+        array, so that only the layers in use are held in memory.
+    """
+    model = classifier._inference_model()
+    device = next(model.parameters()).device
+    num_layers = len(encoder_layers(model))
+    features = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float32,
+        shape=(num_layers - 1, len(dataset), model.config.hidden_size))
+    start = 0
+    with torch.no_grad():
+        for inputs, _ in classifier._batches(dataset, batch_size, device):
+            hidden_states = model.base_model(
+                **inputs, output_hidden_states=True,
+                return_dict=True).hidden_states
+            end = start + len(inputs['input_ids'])
+            for i, hidden in enumerate(hidden_states[1:-1]):
+                features[i, start:end] = masked_mean(
+                    hidden, inputs['attention_mask']).cpu().numpy()
+            start = end
+    features.flush()
+    return features
+
+
+def train_exit_heads(classifier, train_dataset, eval_dataset, threshold=0.9,
+                     epochs=20, lr=1e-3, batch_size=256,
+                     cache_dir=None) -> EarlyExit:
+    """Trains exit heads on intermediate layers of frozen fine-tuned model.
+
+    Layer features are kept in temporary memory-mapped files (see
+    `layer_features`), and each head loads only the features of its layer.
+
+    Args:
+        classifier: SentenceClassifier with fine-tuned model
+        train_dataset: tokenised training dataset
+        eval_dataset: tokenised validation dataset for selecting best epoch
+        threshold: default exit threshold
+        epochs: training epochs of each head
+        lr: learning rate of heads
+        batch_size: training batch size of heads
+        cache_dir: folder of temporary feature files (system temporary folder
+        if None)
+
+    Returns:
+        EarlyExit on device of model.
+    """
+    model = classifier._inference_model()
+    device = next(model.parameters()).device
+    train_labels = np.asarray(train_dataset['label'])
+    eval_labels = np.asarray(eval_dataset['label'])
+    if cache_dir:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as tmp_dir:
+        train_features = layer_features(
+            classifier, train_dataset, Path(tmp_dir).joinpath('train.npy'))
+        eval_features = layer_features(
+            classifier, eval_dataset, Path(tmp_dir).joinpath('eval.npy'))
+        early_exit = EarlyExit(model.config.hidden_size,
+                               len(classifier.classes),
+                               len(train_features) + 1, threshold).to(device)
+        for depth, head in enumerate(early_exit.heads, 1):
+            result = train_head(head, train_features[depth - 1],
+                                train_labels, eval_features[depth - 1],
+                                eval_labels, epochs, lr,
+                                batch_size=batch_size,
+                                seed=classifier.args.seed)
+            print(f'exit head {depth}: validation accuracy = '
+                  f'{result["eval_accuracy"]:.3f}')
+        del train_features, eval_features
+    return early_exit.eval()
+
+
+def benchmark(classifier, test_dataset, thresholds, batch_size=32) -> list:
+    """Evaluates accuracy, average layers and CPU latency per threshold.
+
+    Each threshold is evaluated with `SentenceClassifier.eval` (results saved
+    with '-exit<threshold>' suffix) and a table of all thresholds is saved
+    into 'early_exit_results.txt'.
+
+    Args:
+        classifier: SentenceClassifier with early_exit set
+        test_dataset: tokenised test dataset with 'text' field
+        thresholds: exit thresholds to compare (above 1 runs all layers)
+        batch_size: batch size for latency measurements
+
+    Returns:
+        [{'threshold', 'accuracy', 'average_layers', 'latency_ms',
+          'sentences_per_second'}]
+    """
+    classifier.model = classifier._cpu_model()
+    classifier.early_exit.cpu()
+    default = classifier.early_exit.threshold
+    rows = []
+    for threshold in thresholds:
+        classifier.early_exit.threshold = threshold
+        metrics = classifier.eval(test_dataset, suffix=f'-exit{threshold}')
+        row = {'threshold': threshold, 'accuracy': metrics['eval_accuracy'],
+               'average_layers': metrics['eval_average_layers']}
+        row.update(measure_speed(classifier, test_dataset['text'],
+                                 batch_size))
+        rows.append(row)
+    classifier.early_exit.threshold = default
+    with open(Path(classifier.args.output_dir).joinpath(
+            'early_exit_results.txt'), 'w') as writer:
+        writer.write(f'{"threshold":>9} {"accuracy":>8} {"layers":>6} '
+                     f'{"ms/batch":>8} {"sentences/s":>11}\n')
+        for row in rows:
+            writer.write(f'{row["threshold"]:>9} {row["accuracy"]:>8.3f} '
+                         f'{row["average_layers"]:>6.2f} '
+                         f'{row["latency_ms"]:>8.1f} '
+                         f'{row["sentences_per_second"]:>11.0f}\n')
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='path to fine-tuned model')
+    parser.add_argument('dataset', type=str,
+                        help=f'dataset to use {list(DATASETS)}')
+    parser.add_argument('--thresholds', type=float, nargs='+',
+                        default=[0.5, 0.8, 0.9, 0.95, 0.99, 1.01],
+                        help='exit thresholds to benchmark (above 1 runs all '
+                        'layers)')
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help='default threshold saved with exit heads')
+    parser.add_argument('--epochs', type=int, default=20,
+                        help='training epochs of exit heads')
+    parser.add_argument('--batch', type=int, default=32,
+                        help='batch size for latency measurement')
+    parser.add_argument('--threads', type=int,
+                        help='CPU threads for latency measurement')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = SentenceClassifier.create(args.model,
+                                      DATASETS[args.dataset].load())
+    model.args.output_dir = args.model
+    path = Path(args.model).joinpath(EXIT_HEADS)
+    if path.exists():
+        model.load_early_exit(path)
+    else:
+        model.train_exit_heads(threshold=args.threshold, epochs=args.epochs)
+        model.early_exit.save(path)
+    for row in benchmark(model, model.data['test'], args.thresholds,
+                         args.batch):
+        print(f'threshold {row["threshold"]}: accuracy = '
+              f'{row["accuracy"]:.3f}, layers = '
+              f'{row["average_layers"]:.2f}, latency = '
+              f'{row["latency_ms"]:.1f} ms/batch')
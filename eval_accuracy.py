@@ -1,9 +1,87 @@
 """Functions for evaluating accuracy."""
-from sklearn.metrics import classification_report, accuracy_score
-
 import numpy as np
 
 
+class ConfusionMatrix():
+    """Running confusion matrix of a classifier.
+
+    Memory use is O(number_of_classes²) regardless of the number of evaluated
+    samples, so metrics can be accumulated batch by batch.
+    """
+    def __init__(self, classes: list):
+        """Constructor.
+
+        Args:
+            classes: list of class names
+        """
+        self.classes = classes
+        self.matrix = np.zeros((len(classes), len(classes)), dtype=np.int64)
+
+    def update(self, predictions: np.ndarray, label_ids: np.ndarray):
+        """Adds batch of results.
+
+        Args:
+            predictions: [batch_size] array of predicted integer class IDs
+            label_ids: [batch_size] array of true integer class IDs
+        """
+        n = len(self.classes)
+        self.matrix += np.bincount(
+            np.asarray(label_ids) * n + np.asarray(predictions),
+            minlength=n * n).reshape(n, n)
+
+    @property
+    def support(self) -> np.ndarray:
+        """[number_of_classes] array of true samples per class."""
+        return self.matrix.sum(axis=1)
+
+    def accuracy(self) -> float:
+        total = self.matrix.sum()
+        return float(np.trace(self.matrix) / total) if total else 0.0
+
+    def precision_recall_f1(self):
+        """Returns [number_of_classes] arrays of precision, recall and F1 score.
+
+        Ill-defined scores (no predicted or no true samples) are set to 0.
+        """
+        true_positives = np.diag(self.matrix).astype(np.float64)
+        predicted = self.matrix.sum(axis=0)
+        actual = self.support
+
+        def divide(x, y):
+            return np.divide(x, y, out=np.zeros_like(x, dtype=np.float64),
+                             where=y != 0)
+        precision = divide(true_positives, predicted)
+        recall = divide(true_positives, actual)
+        f1 = divide(2 * precision * recall, precision + recall)
+        return precision, recall, f1
+
+    def report(self, digits=3) -> str:
+        """Returns text report in the format of sklearn classification_report.
+        """
+        precision, recall, f1 = self.precision_recall_f1()
+        support = self.support
+        total = int(support.sum())
+        headers = ['precision', 'recall', 'f1-score', 'support']
+        width = max(max(len(c) for c in self.classes), len('weighted avg'),
+                    digits)
+        row_fmt = '{:>{width}s} ' + ' {:>9.{digits}f}' * 3 + ' {:>9}\n'
+        report = ('{:>{width}s} ' + ' {:>9}' * len(headers)).format(
+            '', *headers, width=width) + '\n\n'
+        for row in zip(self.classes, precision, recall, f1, support):
+            report += row_fmt.format(*row, width=width, digits=digits)
+        report += '\n'
+        report += ('{:>{width}s} ' + ' {:>9}' * 2 + ' {:>9.{digits}f}'
+                   + ' {:>9}\n').format('accuracy', '', '', self.accuracy(),
+                                        total, width=width, digits=digits)
+        weights = support / total if total else np.zeros(len(support))
+        for name, average in [('macro avg', np.mean),
+                              ('weighted avg', lambda x: np.sum(x * weights))]:
+            report += row_fmt.format(
+                name, average(precision), average(recall), average(f1), total,
+                width=width, digits=digits)
+        return report
+
+
 def eval_accuracy(logits: np.ndarray, label_ids: np.ndarray, classes: list,
                   save_predictions=False) -> dict:
     """Evaluates accuracy from predicted results.
@@ -21,9 +99,9 @@ def eval_accuracy(logits: np.ndarray, label_ids: np.ndarray, classes: list,
     """
     preds = logits[0] if isinstance(logits, tuple) else logits
     predictions = np.argmax(preds, axis=1)
-    result = {'accuracy': accuracy_score(label_ids, predictions),
-              'report': classification_report(label_ids, predictions, digits=3,
-                                              target_names=classes)}
+    matrix = ConfusionMatrix(classes)
+    matrix.update(predictions, label_ids)
+    result = {'accuracy': matrix.accuracy(), 'report': matrix.report()}
     if save_predictions:
         result['predictions'] = predictions
     return result
@@ -0,0 +1,266 @@
+"""Classification heads trained on cached embeddings of a frozen encoder.
+
+The pretrained encoder is run once over each tokenised split, and its mean
+pooled sentence embeddings are saved as memory-mapped NumPy files keyed by
+model and data fingerprints. A logistic regression or small MLP head is then
+trained on the embeddings, which takes seconds, so that label sets and head
+settings can be changed without fine-tuning the transformer.
+
+Example:
+    python frozen_encoder.py bert bank --cache_dir cache --hidden_size 256
+"""
+import copy
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import EvalPrediction
+
+from eval_accuracy import get_compute_metrics
+from label_index import mean_pool
+from tokenise_cache import data_fingerprint
+
+
+EMBEDDINGS = 'embeddings'
+HEAD_WEIGHTS = 'head.bin'
+
+
+def model_fingerprint(model_name_or_path) -> str:
+    """Returns hash of saved model config and weights, or of model name."""
+    hasher = hashlib.sha256(str(model_name_or_path).encode())
+    path = Path(model_name_or_path)
+    if path.is_dir():
+        for file in sorted(path.iterdir()):
+            if file.suffix in {'.json', '.bin', '.safetensors'}:
+                stat = file.stat()
+                hasher.update(f'{file.name}:{stat.st_size}:'
+                              f'{stat.st_mtime_ns}'.encode())
+    return hasher.hexdigest()
+
+
+def saved_classifier(classifier):
+    """Returns shallow copy of classifier whose model is loaded from its
+    model_name_or_path.
+
+    Cached outputs are keyed by `model_fingerprint` of the saved model, which
+    does not describe classifier.model if it was fine-tuned in memory (eg. by
+    `SentenceClassifier.train`).
+    """
+    saved = copy.copy(classifier)
+    saved.model = None
+    return saved
+
+
+def cached_embeddings(classifier, dataset, cache_dir, batch_size: int=None,
+                      saved=None) -> np.ndarray:
+    """Returns pooled encoder embeddings of dataset, computed once and cached.
+
+    Embeddings are written batch by batch into a NumPy file in cache_dir named
+    after the fingerprints of the classifier model and the tokenised dataset,
+    and returned memory-mapped. They are always computed with the model saved
+    at model_name_or_path (see `saved_classifier`).
+
+    Args:
+        classifier: SentenceClassifier
+        dataset: dataset tokenised by classifier's tokeniser
+        cache_dir: folder for embedding files
+        batch_size: evaluation batch size (from classifier.args if None)
+        saved: `saved_classifier(classifier)` shared by calls for several
+        datasets, so that the saved model is loaded at most once (created if
+        None)
+
+    Returns:
+        [len(dataset), hidden_size] read-only array of unit length embeddings.
+    """
+    key = hashlib.sha256(
+        (model_fingerprint(classifier.model_name_or_path)
+         + data_fingerprint(dataset)).encode()).hexdigest()[:16]
+    path = Path(cache_dir).joinpath(f'{EMBEDDINGS}-{key}.npy')
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        saved = saved or saved_classifier(classifier)
+        encoder = saved._inference_model().base_model
+        device = next(encoder.parameters()).device
+        tmp_path = path.with_suffix('.tmp.npy')
+        embeddings = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.float32,
+            shape=(len(dataset), encoder.config.hidden_size))
+        start = 0
+        with torch.no_grad():
+            for inputs, _ in classifier._batches(dataset, batch_size, device):
+                pooled = mean_pool(encoder(**inputs)[0],
+                                   inputs['attention_mask']).cpu().numpy()
+                embeddings[start:start + len(pooled)] = pooled
+                start += len(pooled)
+        embeddings.flush()
+        del embeddings
+        tmp_path.replace(path)
+    return np.load(path, mmap_mode='r')
+
+
+def create_head(input_size: int, num_classes: int, hidden_size=0,
+                dropout=0.1) -> torch.nn.Module:
+    """Returns logistic regression head, or MLP head if hidden_size > 0."""
+    if not hidden_size:
+        return torch.nn.Linear(input_size, num_classes)
+    return torch.nn.Sequential(
+        torch.nn.Dropout(dropout),
+        torch.nn.Linear(input_size, hidden_size),
+        torch.nn.ReLU(),
+        torch.nn.Dropout(dropout),
+        torch.nn.Linear(hidden_size, num_classes))
+
+
+def head_logits(head, embeddings, batch_size=4096) -> np.ndarray:
+    """Returns [len(embeddings), number_of_classes] array of head logits."""
+    device = next(head.parameters()).device
+    head.eval()
+    with torch.no_grad():
+        return np.concatenate([
+            head(torch.as_tensor(np.asarray(embeddings[i:i + batch_size]),
+                                 device=device)).cpu().numpy()
+            for i in range(0, len(embeddings), batch_size)])
+
+
+def train_head(head, train_embeddings, train_labels, eval_embeddings=None,
+               eval_labels=None, epochs=100, lr=1e-3, weight_decay=0.01,
+               batch_size=256, seed=42) -> dict:
+    """Trains head on embeddings, keeping the weights of the best epoch.
+
+    Args:
+        head: module returned by `create_head`
+        train_embeddings: [number_of_samples, hidden_size] array
+        train_labels: [number_of_samples] array of class IDs
+        eval_embeddings: validation embeddings for selecting best epoch (last
+        epoch is used if None)
+        eval_labels: validation class IDs
+        epochs: passes over training embeddings
+        lr: learning rate of AdamW
+        weight_decay: weight decay of AdamW
+        batch_size: training batch size
+        seed: random seed of shuffling
+
+    Returns:
+        {'epoch': best epoch, 'eval_accuracy': its validation accuracy}
+    """
+    device = next(head.parameters()).device
+    inputs = torch.as_tensor(np.asarray(train_embeddings), device=device)
+    labels = torch.as_tensor(np.asarray(train_labels), device=device)
+    optimiser = torch.optim.AdamW(head.parameters(), lr=lr,
+                                  weight_decay=weight_decay)
+    generator = torch.Generator().manual_seed(seed)
+    best = {'epoch': epochs, 'eval_accuracy': None}
+    best_state = None
+    for epoch in range(1, epochs + 1):
+        head.train()
+        order = torch.randperm(len(inputs), generator=generator).to(device)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            loss = torch.nn.functional.cross_entropy(head(inputs[batch]),
+                                                     labels[batch])
+            optimiser.zero_grad()
+            loss.backward()
+            optimiser.step()
+        if eval_embeddings is not None:
+            predictions = head_logits(head, eval_embeddings).argmax(axis=1)
+            accuracy = float(np.mean(predictions == np.asarray(eval_labels)))
+            if best['eval_accuracy'] is None or \
+                    accuracy > best['eval_accuracy']:
+                best = {'epoch': epoch, 'eval_accuracy': accuracy}
+                best_state = copy.deepcopy(head.state_dict())
+    if best_state is not None:
+        head.load_state_dict(best_state)
+    return best
+
+
+def train_frozen(classifier, cache_dir, train_dataset, eval_dataset,
+                 test_dataset=None, hidden_size=0, epochs=100, lr=1e-3,
+                 batch_size=256) -> dict:
+    """Trains head of classifier on cached embeddings of its frozen encoder.
+
+    Head weights are saved into 'head.bin'. If test dataset is provided,
+    classification results from `eval_accuracy.get_compute_metrics` are saved
+    into 'test_results-head.txt'.
+
+    Args:
+        classifier: SentenceClassifier
+        cache_dir: folder for embedding files
+        train_dataset: tokenised training dataset
+        eval_dataset: tokenised validation dataset for selecting best epoch
+        test_dataset: tokenised test dataset
+        hidden_size: hidden units of MLP head (logistic regression if 0)
+        epochs: training epochs of head
+        lr: learning rate of head
+        batch_size: training batch size of head
+
+    Returns:
+        Best epoch, its validation accuracy and test metrics ('accuracy',
+        'report') if test dataset is provided.
+    """
+    splits = {'train': train_dataset, 'validation': eval_dataset,
+              'test': test_dataset}
+    # Saved model is loaded on first uncached split, and reused for others
+    saved = saved_classifier(classifier)
+    embeddings = {name: cached_embeddings(classifier, split, cache_dir,
+                                          saved=saved)
+                  for name, split in splits.items() if split is not None}
+    labels = {name: np.asarray(split['label'])
+              for name, split in splits.items() if split is not None}
+    head = create_head(embeddings['train'].shape[1], len(classifier.classes),
+                       hidden_size).to(classifier.args.device)
+    results = train_head(head, embeddings['train'], labels['train'],
+                         embeddings.get('validation'),
+                         labels.get('validation'), epochs, lr,
+                         batch_size=batch_size, seed=classifier.args.seed)
+    output_dir = Path(classifier.args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    torch.save(head.state_dict(), output_dir.joinpath(HEAD_WEIGHTS))
+    if test_dataset is not None:
+        compute_metrics = get_compute_metrics(classifier.classes)
+        metrics = compute_metrics(EvalPrediction(
+            predictions=head_logits(head, embeddings['test']),
+            label_ids=labels['test']))
+        print(f'\naccuracy = {metrics["accuracy"]:.3f}')
+        with open(output_dir.joinpath('test_results-head.txt'),
+                  'w') as writer:
+            writer.write(f'{metrics["report"]}\n')
+            writer.write(f'accuracy = {metrics["accuracy"]}\n')
+        results.update(metrics)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='Huggingface pretrained model '
+                        'or path to saved model on disk')
+    parser.add_argument('dataset', type=str,
+                        help=f'dataset to use {list(DATASETS)}')
+    parser.add_argument('--out_dir', type=str, help='directory to save head')
+    parser.add_argument('--cache_dir', type=str, default='cache',
+                        help='directory to cache embeddings')
+    parser.add_argument('--hidden_size', type=int, default=0,
+                        help='hidden units of MLP head (logistic regression '
+                        'if 0)')
+    parser.add_argument('--epochs', type=int, default=100,
+                        help='training epochs of head')
+    parser.add_argument('--lr', type=float, default=1e-3,
+                        help='learning rate of head')
+    args = parser.parse_args()
+    model = SentenceClassifier.create(args.model, DATASETS[args.dataset].load())
+    if args.out_dir:
+        model.args.output_dir = args.out_dir
+    else:
+        suffix = f'{args.dataset}_frozen'
+        model.args.output_dir = f'{model.args.output_dir}_{suffix}'
+    results = model.train_head(args.cache_dir, test_dataset=model.data['test'],
+                               hidden_size=args.hidden_size,
+                               epochs=args.epochs, lr=args.lr)
+    print(f'best epoch = {results["epoch"]}, validation accuracy = '
+          f'{results["eval_accuracy"]:.3f}')
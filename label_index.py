@@ -0,0 +1,329 @@
+"""Nearest class centroid classification with an approximate index.
+
+For intent inventories too large for a dense softmax head, sentences are
+embedded with the encoder of the classifier and matched against class
+centroids (mean embeddings of training sentences). Centroids are clustered
+into `num_lists` inverted lists with spherical k-means, and each sentence is
+only scored against the centroids in its `num_probe` nearest lists, so search
+time grows with the square root of the number of classes.
+
+Example:
+    python label_index.py models/bert-base-uncased_clinc_10epochs clinc
+"""
+from pathlib import Path
+import time
+
+import numpy as np
+import torch
+
+
+LABEL_INDEX = 'label_index.npz'
+
+
+def normalise(vectors: np.ndarray) -> np.ndarray:
+    """Returns rows of vectors scaled to unit length (zero rows unchanged)."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def masked_mean(hidden_states, attention_mask) -> torch.Tensor:
+    """Returns mean of token embeddings over attention mask."""
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    return (hidden_states * mask).sum(1) / mask.sum(1).clamp(min=1)
+
+
+def mean_pool(hidden_states, attention_mask) -> torch.Tensor:
+    """Returns unit length mean of token embeddings over attention mask."""
+    return torch.nn.functional.normalize(
+        masked_mean(hidden_states, attention_mask), dim=-1)
+
+
+def embed_dataset(classifier, dataset, batch_size: int=None):
+    """Returns sentence embeddings of tokenised dataset.
+
+    Args:
+        classifier: SentenceClassifier
+        dataset: tokenised dataset with 'label' field
+        batch_size: evaluation batch size (from classifier.args if None)
+
+    Returns:
+        ([len(dataset), hidden_size] array of embeddings,
+         [len(dataset)] array of label IDs)
+    """
+    encoder = classifier._inference_model().base_model
+    device = next(encoder.parameters()).device
+    embeddings, label_ids = [], []
+    with torch.no_grad():
+        for inputs, labels in classifier._batches(dataset, batch_size,
+                                                  device):
+            pooled = mean_pool(encoder(**inputs)[0], inputs['attention_mask'])
+            embeddings.append(pooled.cpu().numpy())
+            label_ids.append(labels)
+    return np.concatenate(embeddings), np.concatenate(label_ids)
+
+
+def embed_texts(classifier, texts: list, batch_size=256) -> np.ndarray:
+    """Returns [len(texts), hidden_size] array of sentence embeddings.
+
+    Sentences are sorted by length before batching as in
+    `SentenceClassifier.predict`.
+    """
+    encoder = classifier._inference_model().base_model
+    device = next(encoder.parameters()).device
+    input_ids = classifier.tokeniser(
+        list(texts), truncation=True,
+        max_length=classifier.max_length)['input_ids']
+    order = np.argsort([len(ids) for ids in input_ids], kind='stable')
+    embeddings = np.zeros((len(input_ids), encoder.config.hidden_size),
+                          dtype=np.float32)
+    no_grad = getattr(torch, 'inference_mode', torch.no_grad)
+    with no_grad():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = classifier.tokeniser.pad(
+                {'input_ids': [input_ids[i] for i in batch]},
+                return_tensors='pt')
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+            hidden_states = encoder(**inputs)[0]
+            embeddings[batch] = mean_pool(
+                hidden_states, inputs['attention_mask']).cpu().numpy()
+    return embeddings
+
+
+def class_centroids(embeddings, label_ids, num_classes: int) -> np.ndarray:
+    """Returns [num_classes, hidden_size] array of unit length class means.
+
+    Classes without samples have zero centroids, which are never ranked above
+    classes with samples.
+    """
+    sums = np.zeros((num_classes, embeddings.shape[1]), dtype=np.float32)
+    np.add.at(sums, label_ids, embeddings)
+    return normalise(sums)
+
+
+def spherical_kmeans(vectors, k: int, iterations=10, seed=0):
+    """Clusters unit length vectors by cosine similarity.
+
+    Returns:
+        ([k, dimensions] array of unit length cluster centres,
+         [len(vectors)] array of cluster IDs)
+    """
+    rng = np.random.RandomState(seed)
+    centres = vectors[rng.choice(len(vectors), k, replace=False)]
+    for _ in range(iterations):
+        assignment = (vectors @ centres.T).argmax(axis=1)
+        sums = np.zeros_like(centres)
+        np.add.at(sums, assignment, vectors)
+        empty = np.flatnonzero(np.bincount(assignment, minlength=k) == 0)
+        # Restart empty clusters from random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty),
+                                         replace=False)]
+        centres = normalise(sums)
+    return centres, (vectors @ centres.T).argmax(axis=1)
+
+
+class CentroidIndex():
+    """Inverted file index over class centroids for top-k class search."""
+    def __init__(self, centroids, num_lists: int=None, num_probe=4, seed=0):
+        """Constructor.
+
+        Args:
+            centroids: [number_of_classes, hidden_size] array of unit length
+            class centroids
+            num_lists: number of inverted lists (square root of number of
+            classes if None)
+            num_probe: lists searched per query (exhaustive search if at least
+            num_lists)
+            seed: random seed of k-means initialisation
+        """
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        num_classes = len(self.centroids)
+        if num_lists is None:
+            num_lists = int(round(np.sqrt(num_classes)))
+        num_lists = max(1, min(num_lists, num_classes))
+        self.num_probe = num_probe
+        self.list_centres, assignment = spherical_kmeans(
+            self.centroids, num_lists, seed=seed)
+        # Class IDs grouped by list, list j holds members[offsets[j]:
+        # offsets[j + 1]]
+        self.members = np.argsort(assignment, kind='stable')
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assignment, minlength=num_lists))])
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def search(self, queries, top_k=1):
+        """Returns most similar classes of query embeddings.
+
+        Args:
+            queries: [number_of_queries, hidden_size] array of unit length
+            sentence embeddings
+            top_k: number of classes returned per query
+
+        Returns:
+            ([number_of_queries, top_k] array of class IDs,
+             [number_of_queries, top_k] array of cosine similarities), most
+            similar class first. Queries whose num_probe nearest lists hold
+            fewer than top_k classes are searched in further lists, nearest
+            first, until they do.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        num_lists = len(self.list_centres)
+        num_probe = min(self.num_probe, num_lists)
+        top_k = min(top_k, len(self))
+        ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        coarse = queries @ self.list_centres.T
+        order = np.argsort(-coarse, axis=1, kind='stable')
+        # Number of nearest lists searched per query, at least num_probe and
+        # enough to hold top_k classes
+        sizes = np.cumsum(np.diff(self.offsets)[order], axis=1)
+        depth = np.maximum(num_probe, (sizes < top_k).sum(axis=1) + 1)
+        rank = np.argsort(order, axis=1)
+        for j in range(num_lists):
+            rows = np.flatnonzero(rank[:, j] < depth)
+            if not len(rows):
+                continue
+            members = self.members[self.offsets[j]:self.offsets[j + 1]]
+            block = queries[rows] @ self.centroids[members].T
+            # Merge list scores into running top-k of each query
+            candidate_scores = np.concatenate([scores[rows], block], axis=1)
+            candidate_ids = np.concatenate(
+                [ids[rows], np.broadcast_to(members, block.shape)], axis=1)
+            best = np.argpartition(-candidate_scores, top_k - 1,
+                                   axis=1)[:, :top_k]
+            scores[rows] = np.take_along_axis(candidate_scores, best, axis=1)
+            ids[rows] = np.take_along_axis(candidate_ids, best, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        return (np.take_along_axis(ids, order, axis=1),
+                np.take_along_axis(scores, order, axis=1))
+
+    def save(self, path):
+        """Saves index into npz file."""
+        np.savez(path, centroids=self.centroids,
+                 list_centres=self.list_centres, members=self.members,
+                 offsets=self.offsets, num_probe=self.num_probe)
+
+    @staticmethod
+    def load(path):
+        """Loads index saved by `save`."""
+        arrays = np.load(path)
+        index = CentroidIndex.__new__(CentroidIndex)
+        index.centroids = arrays['centroids']
+        index.list_centres = arrays['list_centres']
+        index.members = arrays['members']
+        index.offsets = arrays['offsets']
+        index.num_probe = int(arrays['num_probe'])
+        return index
+
+
+def build_label_index(classifier, train_dataset, num_lists: int=None,
+                      num_probe=4, batch_size: int=None) -> CentroidIndex:
+    """Returns index over class centroids of training sentence embeddings.
+
+    Args:
+        classifier: SentenceClassifier with trained model
+        train_dataset: tokenised training dataset
+        num_lists: number of inverted lists (see `CentroidIndex`)
+        num_probe: lists searched per query
+        batch_size: evaluation batch size (from classifier.args if None)
+    """
+    embeddings, label_ids = embed_dataset(classifier, train_dataset,
+                                          batch_size)
+    centroids = class_centroids(embeddings, label_ids,
+                                len(classifier.classes))
+    return CentroidIndex(centroids, num_lists, num_probe, classifier.args.seed)
+
+
+def predict_nearest(classifier, texts: list, batch_size=256, top_k=1):
+    """Classifies raw sentences with `classifier.label_index`.
+
+    Returns:
+        ([len(texts), top_k] array of class names,
+         [len(texts), top_k] array of cosine similarities), most similar class
+        first.
+    """
+    embeddings = embed_texts(classifier, texts, batch_size)
+    ids, scores = classifier.label_index.search(embeddings, top_k)
+    return np.array(classifier.classes, dtype=object)[ids], scores
+
+
+def compare_with_head(classifier, index, test_dataset, top_k=1,
+                      batch_size=32) -> dict:
+    """Compares nearest centroid index with classification head.
+
+    Both are timed on `classifier.predict` of test sentences. Results are
+    saved into 'label_index_results.txt'.
+
+    Args:
+        classifier: SentenceClassifier with trained model
+        index: CentroidIndex of classifier
+        test_dataset: test dataset with 'text' and 'label' fields
+        top_k: a prediction is correct if the label is among top_k classes
+        batch_size: sentences per forward pass
+
+    Returns:
+        Dictionary of top-k accuracy, latency per batch and throughput of
+        'head' and 'index'.
+    """
+    texts = test_dataset['text']
+    label_ids = np.asarray(test_dataset['label'])
+    names = np.array(classifier.classes, dtype=object)
+    previous = classifier.label_index
+    results = {}
+    for name, label_index in [('head', None), ('index', index)]:
+        classifier.label_index = label_index
+        classifier.predict(texts[:batch_size], batch_size)  # warm-up
+        start = time.perf_counter()
+        predictions, _ = classifier.predict(texts, batch_size, top_k)
+        elapsed = time.perf_counter() - start
+        correct = (predictions == names[label_ids][:, None]).any(axis=1)
+        num_batches = -(-len(texts) // batch_size)
+        results[f'{name}_accuracy'] = float(correct.mean())
+        results[f'{name}_latency_ms'] = 1000 * elapsed / num_batches
+        results[f'{name}_sentences_per_second'] = len(texts) / elapsed
+    classifier.label_index = previous
+    results.update({'top_k': top_k, 'num_classes': len(index),
+                    'num_lists': len(index.list_centres),
+                    'num_probe': index.num_probe})
+    with open(Path(classifier.args.output_dir).joinpath(
+            'label_index_results.txt'), 'w') as writer:
+        for key, value in results.items():
+            writer.write(f'{key} = {value}\n')
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='path to saved model')
+    parser.add_argument('dataset', type=str,
+                        help=f'dataset to use {list(DATASETS)}')
+    parser.add_argument('--num_lists', type=int,
+                        help='inverted lists of index (square root of number '
+                        'of classes if not set)')
+    parser.add_argument('--num_probe', type=int, default=4,
+                        help='lists searched per sentence')
+    parser.add_argument('--top_k', type=int, default=1,
+                        help='classes returned per sentence')
+    parser.add_argument('--batch', type=int, default=32,
+                        help='batch size for latency measurement')
+    args = parser.parse_args()
+    model = SentenceClassifier.create(args.model, DATASETS[args.dataset].load())
+    model.args.output_dir = args.model
+    index = model.build_label_index(num_lists=args.num_lists,
+                                    num_probe=args.num_probe)
+    index.save(Path(args.model).joinpath(LABEL_INDEX))
+    results = compare_with_head(model, index, model.data['test'], args.top_k,
+                                args.batch)
+    for name in ['head', 'index']:
+        print(f'{name}: top-{args.top_k} accuracy = '
+              f'{results[f"{name}_accuracy"]:.3f}, '
+              f'latency = {results[f"{name}_latency_ms"]:.1f} ms/batch, '
+              f'{results[f"{name}_sentences_per_second"]:.0f} sentences/s')
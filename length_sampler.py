@@ -0,0 +1,236 @@
+"""Length-grouped batching to reduce padding of training batches."""
+import math
+import random
+import time
+
+from torch.utils.data import DataLoader, Sampler
+from transformers import Trainer
+
+from profiles import autocast, peak_memory_mb, reset_peak_memory
+from telemetry import timed_iter
+
+
+class LengthGroupedBatchSampler(Sampler):
+    """Yields batches of indices of samples with similar lengths.
+
+    With a fixed batch size, samples are shuffled, split into mega-batches of
+    `mega_batch` batches, and each mega-batch is sorted by length before it is
+    split into batches. With `max_tokens`, samples are sorted by length and
+    packed into batches of at most `max_tokens` padded tokens. Batch order is
+    shuffled every epoch.
+    """
+    def __init__(self, lengths, batch_size: int, max_tokens: int=None,
+                 mega_batch=50, seed=0, drop_last=False):
+        """Constructor.
+
+        Args:
+            lengths: length of each sample
+            batch_size: number of samples per batch (ignored with max_tokens)
+            max_tokens: maximum number of padded tokens per batch
+            mega_batch: number of batches sorted together in fixed size mode
+            seed: random seed, incremented every epoch
+            drop_last: drops last incomplete batch in fixed size mode
+        """
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.mega_batch = mega_batch
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+        if max_tokens:
+            self.token_batches = self._pack(
+                sorted(range(len(self.lengths)), key=self.lengths.__getitem__))
+
+    def _pack(self, indices):
+        """Packs length-sorted indices into batches within token budget."""
+        batches, batch, longest = [], [], 0
+        for i in indices:
+            longest_with_i = max(longest, self.lengths[i])
+            if batch and (len(batch) + 1) * longest_with_i > self.max_tokens:
+                batches.append(batch)
+                batch, longest_with_i = [], self.lengths[i]
+            batch.append(i)
+            longest = longest_with_i
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        if self.max_tokens:
+            # Batch sizes are fixed, only samples of equal length and the
+            # order of batches are shuffled
+            by_length = {}
+            for batch in self.token_batches:
+                for i in batch:
+                    by_length.setdefault(self.lengths[i], []).append(i)
+            for indices in by_length.values():
+                rng.shuffle(indices)
+            batches = [[by_length[self.lengths[i]].pop() for i in batch]
+                       for batch in self.token_batches]
+        else:
+            indices = list(range(len(self.lengths)))
+            rng.shuffle(indices)
+            size = self.batch_size * self.mega_batch
+            batches = []
+            for start in range(0, len(indices), size):
+                mega = sorted(indices[start:start + size],
+                              key=self.lengths.__getitem__, reverse=True)
+                batches.extend(mega[j:j + self.batch_size]
+                               for j in range(0, len(mega), self.batch_size))
+            if self.drop_last and len(batches[-1]) < self.batch_size:
+                batches = batches[:-1]
+        rng.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        if self.max_tokens:
+            return len(self.token_batches)
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return math.ceil(len(self.lengths) / self.batch_size)
+
+
+class PaddingStats():
+    """Counts samples, real and padded tokens of collated batches."""
+    def __init__(self, pad_token_id=0):
+        self.pad_token_id = pad_token_id
+        self.samples = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+
+    def update(self, batch):
+        """Adds counts of a collated batch with 'input_ids' tensor."""
+        input_ids = batch['input_ids']
+        self.samples += input_ids.shape[0]
+        if 'attention_mask' in batch:
+            self.tokens += int(batch['attention_mask'].sum())
+        else:
+            self.tokens += int((input_ids != self.pad_token_id).sum())
+        self.padded_tokens += input_ids.numel()
+
+    @property
+    def padding_ratio(self) -> float:
+        """Fraction of padding tokens in all counted batches."""
+        if not self.padded_tokens:
+            return 0.0
+        return 1 - self.tokens / self.padded_tokens
+
+
+class TimedDataLoader(DataLoader):
+    """DataLoader adding time spent waiting for batches (loading and
+    collation) to stats['stall_seconds']."""
+    def __init__(self, *args, stats: dict=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {} if stats is None else stats
+
+    def __iter__(self):
+        return timed_iter(super().__iter__(), self.stats)
+
+
+class BucketedTrainer(Trainer):
+    """Trainer with optional length-grouped batches and padding statistics.
+
+    After training, 'padding_ratio', 'train_tokens_per_second',
+    'train_samples_per_second', 'train_peak_memory_mb' and
+    'train_stall_seconds' (time spent waiting for batches) are added to the
+    training log. Throughput excludes time spent evaluating, logging and
+    saving checkpoints during training.
+    """
+    def __init__(self, *args, group_by_length=False, max_tokens: int=None,
+                 bf16=False, train_shards=None, **kwargs):
+        """Constructor.
+
+        Args:
+            group_by_length: groups training samples of similar lengths into
+            batches
+            max_tokens: sizes training batches by number of padded tokens
+            instead of per_device_train_batch_size (implies group_by_length)
+            bf16: runs training steps in bfloat16 autocast (fp16 is set in
+            TrainingArguments)
+            train_shards: TensorShards of train_dataset loaded instead of it
+            with a ShardLoader (see tensor_shards.py), whose batches are
+            already grouped by length and padded (group_by_length has no
+            effect)
+            args, kwargs: passed to Trainer
+
+        Raises:
+            ValueError if both max_tokens and train_shards are set.
+        """
+        if max_tokens and train_shards is not None:
+            raise ValueError('max_tokens cannot be combined with '
+                             'train_shards, whose batches have a fixed '
+                             'number of samples')
+        super().__init__(*args, **kwargs)
+        self.group_by_length = group_by_length or bool(max_tokens)
+        self.max_tokens = max_tokens
+        self.precision = 'bf16' if bf16 else 'fp32'
+        self.train_shards = train_shards
+        self.padding_stats = PaddingStats(
+            self.tokenizer.pad_token_id if self.tokenizer else 0)
+        self.loader_stats = {'stall_seconds': 0.0}
+        self.eval_seconds = 0.0  # evaluating, logging and saving in train
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.train_shards is not None:
+            from tensor_shards import SHARD_WORKERS, ShardBatches, ShardLoader
+            return ShardLoader(
+                ShardBatches(self.train_shards, self.args.train_batch_size,
+                             shuffle=True, seed=self.args.seed),
+                self.args.dataloader_num_workers or SHARD_WORKERS,
+                stats=self.loader_stats)
+        if self.train_dataset is None:
+            return super().get_train_dataloader()
+        if self.group_by_length and self.args.local_rank == -1:
+            kwargs = {'batch_sampler': LengthGroupedBatchSampler(
+                [len(ids) for ids in self.train_dataset['input_ids']],
+                self.args.train_batch_size, self.max_tokens,
+                seed=self.args.seed,
+                drop_last=self.args.dataloader_drop_last)}
+        else:
+            # Same as Trainer.get_train_dataloader
+            kwargs = {'batch_size': self.args.train_batch_size,
+                      'sampler': self._get_train_sampler(),
+                      'drop_last': self.args.dataloader_drop_last}
+        return TimedDataLoader(self.train_dataset,
+                               collate_fn=self.data_collator,
+                               num_workers=self.args.dataloader_num_workers,
+                               stats=self.loader_stats, **kwargs)
+
+    def num_examples(self, dataloader) -> int:
+        # Shard loaders yield batches, their length is the number of batches
+        return getattr(dataloader.dataset, 'num_samples', None) or \
+            super().num_examples(dataloader)
+
+    def training_step(self, model, inputs):
+        self.padding_stats.update(inputs)
+        with autocast(self.precision):
+            return super().training_step(model, inputs)
+
+    def _maybe_log_save_evaluate(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super()._maybe_log_save_evaluate(*args, **kwargs)
+        finally:
+            self.eval_seconds += time.perf_counter() - start
+
+    def train(self, *args, **kwargs):
+        stats = self.padding_stats
+        samples, tokens = stats.samples, stats.tokens
+        stall = self.loader_stats['stall_seconds']
+        eval_seconds = self.eval_seconds
+        reset_peak_memory()
+        start = time.perf_counter()
+        output = super().train(*args, **kwargs)
+        elapsed = (time.perf_counter() - start
+                   - (self.eval_seconds - eval_seconds))
+        self.log({
+            'padding_ratio': stats.padding_ratio,
+            'train_tokens_per_second': (stats.tokens - tokens) / elapsed,
+            'train_samples_per_second': (stats.samples - samples) / elapsed,
+            'train_peak_memory_mb': peak_memory_mb(),
+            'train_stall_seconds': self.loader_stats['stall_seconds'] - stall
+        })
+        return output
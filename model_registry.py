@@ -0,0 +1,271 @@
+"""Registry of saved checkpoints with a pool of warm models.
+
+Checkpoints (folders with 'config.json') under a root folder are indexed by
+path and hash of their config into 'registry.json'. Models are built from
+their config and the saved weights are copied in with `load_state_dict`.
+Weights are not memory-mapped: torch 1.6 of requirements.txt has no
+`torch.load(..., mmap=True)` and is not supported by safetensors. With a
+newer torch and the safetensors package installed (not in requirements.txt),
+weights are read from 'model.safetensors' files (`convert_to_safetensors`
+writes them next to 'pytorch_model.bin'), which skips unpickling; otherwise
+'pytorch_model.bin' is read with `torch.load`, and the 'weights' entry of
+the index tells which file is used.
+
+Loaded models are kept in a least recently used pool within a memory budget,
+so that repeated evaluations of a checkpoint skip deserialisation. Pooled
+models are shared, so they must not be modified (eg. trained).
+
+Example:
+    python model_registry.py models --dataset bank --repeats 2
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification
+
+try:
+    from safetensors.torch import load_file, save_file
+except ImportError:  # optional, weights are loaded with torch.load
+    load_file = save_file = None
+
+
+INDEX = 'registry.json'
+SAFETENSORS = 'model.safetensors'
+PYTORCH_WEIGHTS = 'pytorch_model.bin'
+
+
+def config_hash(model_dir) -> str:
+    """Returns hash of canonical JSON of saved model config."""
+    config = json.loads(Path(model_dir).joinpath('config.json').read_text())
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def weights_file(model_dir) -> Path:
+    """Returns safetensors weights if they can be loaded, else PyTorch weights
+    (None if model_dir has neither)."""
+    model_dir = Path(model_dir)
+    if load_file is not None and model_dir.joinpath(SAFETENSORS).exists():
+        return model_dir.joinpath(SAFETENSORS)
+    if model_dir.joinpath(PYTORCH_WEIGHTS).exists():
+        return model_dir.joinpath(PYTORCH_WEIGHTS)
+    return None
+
+
+def convert_to_safetensors(model_dir) -> Path:
+    """Writes 'model.safetensors' with the weights of 'pytorch_model.bin'.
+
+    Raises:
+        ImportError if safetensors is not installed.
+    """
+    if save_file is None:
+        raise ImportError('converting weights needs the safetensors package')
+    model_dir = Path(model_dir)
+    state_dict = torch.load(model_dir.joinpath(PYTORCH_WEIGHTS),
+                            map_location='cpu')
+    path = model_dir.joinpath(SAFETENSORS)
+    tmp_path = path.with_suffix('.tmp')
+    # Tensors are copied, as safetensors cannot store shared storage
+    save_file({name: tensor.contiguous().clone()
+               for name, tensor in state_dict.items()}, str(tmp_path))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_weights(model_dir) -> dict:
+    """Returns state dict of saved model on CPU."""
+    path = weights_file(model_dir)
+    if path is None:
+        raise FileNotFoundError(f'no model weights in {model_dir}')
+    if path.name == SAFETENSORS:
+        return load_file(str(path))
+    return torch.load(path, map_location='cpu')
+
+
+def model_bytes(model) -> int:
+    """Returns memory used by parameters and buffers of model in bytes."""
+    return sum(t.numel() * t.element_size()
+               for t in list(model.parameters()) + list(model.buffers()))
+
+
+class ModelRegistry():
+    """Index of saved checkpoints and LRU pool of loaded models."""
+    def __init__(self, root='models', max_memory: int=None):
+        """Constructor.
+
+        Args:
+            root: folder searched for checkpoints
+            max_memory: maximum memory of pooled models in bytes, least
+            recently used models are released when exceeded (no limit if
+            None)
+        """
+        self.root = Path(root)
+        self.max_memory = max_memory
+        self.pool = OrderedDict()  # key: (model, bytes)
+        self.load_times = []  # [(model, 'cold' or 'warm', seconds)]
+        self.evictions = 0
+
+    def index(self) -> dict:
+        """Indexes checkpoints under root and saves index into
+        'registry.json'.
+
+        Returns:
+            {path: {'config_hash', 'model_type', 'num_labels', 'weights',
+                    'size'}}
+        """
+        entries = {}
+        for config in sorted(self.root.rglob('config.json')):
+            model_dir = config.parent
+            weights = weights_file(model_dir)
+            if weights is None:
+                continue  # eg. tokeniser-only or ONNX export folders
+            saved = json.loads(config.read_text())
+            entries[str(model_dir)] = {
+                'config_hash': config_hash(model_dir),
+                'model_type': saved.get('model_type'),
+                'num_labels': len(saved.get('id2label', {})) or None,
+                'weights': weights.name,
+                'size': weights.stat().st_size}
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.root.joinpath(INDEX).write_text(json.dumps(entries, indent=2))
+        return entries
+
+    def find(self, config_hash: str=None, num_labels: int=None) -> list:
+        """Returns paths of indexed checkpoints matching the filters."""
+        index_file = self.root.joinpath(INDEX)
+        entries = (json.loads(index_file.read_text())
+                   if index_file.exists() else self.index())
+        return [path for path, entry in entries.items()
+                if config_hash in (None, entry['config_hash'])
+                and num_labels in (None, entry['num_labels'])]
+
+    def _key(self, model_name_or_path, kwargs) -> str:
+        """Returns pool key of model, which changes when a saved checkpoint
+        is overwritten (config or weights modification time) or loaded with
+        other config arguments."""
+        path = Path(model_name_or_path)
+        if path.joinpath('config.json').exists():
+            weights = weights_file(path)
+            identity = [str(path.resolve()), config_hash(path),
+                        weights and weights.stat().st_mtime_ns]
+        else:
+            identity = [str(model_name_or_path)]  # Huggingface model name
+        return json.dumps(identity + [kwargs], sort_keys=True, default=str)
+
+    def get(self, model_name_or_path, device=None, **kwargs):
+        """Returns model in evaluation mode, from pool or loaded.
+
+        Args:
+            model_name_or_path: saved checkpoint or Huggingface model name
+            device: device of model
+            kwargs: config arguments passed to `from_pretrained` (eg.
+            num_labels)
+        """
+        key = self._key(model_name_or_path, kwargs)
+        start = time.perf_counter()
+        if key in self.pool:
+            self.pool.move_to_end(key)
+            model = self.pool[key][0]
+            kind = 'warm'
+        else:
+            model = self._load(model_name_or_path, kwargs)
+            self.pool[key] = (model, model_bytes(model))
+            self._evict(keep=key)
+            kind = 'cold'
+        if device is not None:
+            model.to(device)
+        self.load_times.append((str(model_name_or_path), kind,
+                                time.perf_counter() - start))
+        return model.eval()
+
+    @staticmethod
+    def _load(model_name_or_path, kwargs):
+        """Loads model on CPU (see module docstring).
+
+        Checkpoints whose weights do not match the model built from config
+        (eg. pretrained encoders without classification layer) and
+        Huggingface model names are loaded with `from_pretrained`.
+        """
+        if weights_file(model_name_or_path) is None:
+            return AutoModelForSequenceClassification.from_pretrained(
+                model_name_or_path, **kwargs)
+        config = AutoConfig.from_pretrained(str(model_name_or_path), **kwargs)
+        state_dict = load_weights(model_name_or_path)
+        model = AutoModelForSequenceClassification.from_config(config)
+        missing, unexpected = model.load_state_dict(state_dict, strict=False)
+        if missing or unexpected:
+            model = AutoModelForSequenceClassification.from_pretrained(
+                str(model_name_or_path), config=config, state_dict=state_dict)
+        return model
+
+    def _evict(self, keep: str=None):
+        """Releases least recently used models until pool fits in
+        max_memory."""
+        if self.max_memory is None:
+            return
+        total = sum(size for _, size in self.pool.values())
+        for key in list(self.pool):
+            if total <= self.max_memory:
+                break
+            if key != keep:
+                total -= self.pool.pop(key)[1]
+                self.evictions += 1
+
+    def report(self) -> str:
+        """Returns summary of cold and warm load times."""
+        parts = []
+        for kind in ['cold', 'warm']:
+            times = [t for _, k, t in self.load_times if k == kind]
+            mean = sum(times) / len(times) if times else 0.0
+            parts.append(f'{len(times)} {kind} loads (mean {mean:.3f}s)')
+        memory = sum(size for _, size in self.pool.values()) / 2**20
+        return (f'model pool: {", ".join(parts)}, {self.evictions} evicted, '
+                f'{len(self.pool)} pooled ({memory:.0f} MB)')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('root', type=str, help='folder of saved checkpoints')
+    parser.add_argument('--dataset', choices=list(DATASETS),
+                        help='evaluate checkpoints with as many classes as '
+                        'dataset')
+    parser.add_argument('--repeats', type=int, default=2,
+                        help='evaluations per checkpoint')
+    parser.add_argument('--max_memory', type=float, default=4.0,
+                        help='memory budget of model pool in GB')
+    parser.add_argument('--convert', action='store_true',
+                        help='write model.safetensors for each checkpoint')
+    args = parser.parse_args()
+    registry = ModelRegistry(args.root, int(args.max_memory * 2**30))
+    entries = registry.index()
+    if args.convert:
+        for path in entries:
+            print(f'converted {convert_to_safetensors(path)}')
+        entries = registry.index()
+    for path, entry in entries.items():
+        print(f'{path}: {entry["model_type"]}, {entry["num_labels"]} labels, '
+              f'{entry["weights"]}, hash {entry["config_hash"]}')
+    if args.dataset:
+        dataset = DATASETS[args.dataset].load()
+        num_classes = dataset['train'].features['label'].num_classes
+        for path in registry.find(num_labels=num_classes):
+            model = SentenceClassifier.create(path, dataset,
+                                              registry=registry)
+            model.args.output_dir = path
+            for _ in range(args.repeats):
+                model.model = None  # reloads from registry
+                model.eval(model.data['test'], suffix='-registry')
+        for path, kind, seconds in registry.load_times:
+            print(f'{kind:>4} {seconds:8.3f}s {path}')
+        print(registry.report())
@@ -0,0 +1,550 @@
+"""Multi-task classifier with one shared encoder and a head per dataset.
+
+One pretrained backbone is fine-tuned on the training samples of several
+datasets, so that a single encoder pass classifies a sentence in every
+taxonomy. Compared with one SentenceClassifier per dataset, weights are stored
+once and the encoder runs once instead of once per dataset.
+
+The splits of all datasets are concatenated with the task of each sample, and
+trained by a BucketedTrainer whose loss scores each sample with the head of
+its task. Batches mix tasks, so length bucketing, training profiles and
+telemetry work as for SentenceClassifier.
+
+Example:
+    python multitask.py bert --datasets bank clinc hwu --epochs 5 \
+        --separate bank=models/bert-base-uncased_bank_10epochs \
+        clinc=models/bert-base-uncased_clinc_10epochs \
+        hwu=models/bert-base-uncased_hwu_10epochs
+"""
+import json
+from pathlib import Path
+import time
+
+from datasets import Dataset
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from transformers import (AutoModel, AutoModelForSequenceClassification,
+                          AutoTokenizer, DataCollatorWithPadding,
+                          TrainingArguments, set_seed)
+
+from eval_accuracy import ConfusionMatrix
+from label_index import masked_mean
+from length_sampler import BucketedTrainer
+from profiles import (enable_gradient_checkpointing, peak_memory_mb,
+                      reset_peak_memory)
+from quantise import model_size
+from sentence_classifier import MODEL_INPUTS, PRETRAINED
+from telemetry import Telemetry, TelemetryCallback, stage
+from tokenise_data import (load_truncation_length, save_truncation_length,
+                           token_lengths, tokenise_data, truncate_data,
+                           truncation_length)
+
+
+TASKS = 'tasks.json'
+HEADS = 'heads.bin'
+TASK_ID = 'task_id'  # field of index of sample's task in MultiTaskModel.tasks
+
+
+class MultiTaskModel(torch.nn.Module):
+    """Shared encoder with a linear classification head per task."""
+    def __init__(self, encoder, tasks: dict, dropout=0.1):
+        """Constructor.
+
+        Args:
+            encoder: Huggingface base model (eg. from AutoModel)
+            tasks: {task name: list of class names}
+            dropout: dropout before heads
+        """
+        super().__init__()
+        self.encoder = encoder
+        self.tasks = tasks
+        self.dropout = torch.nn.Dropout(dropout)
+        self.heads = torch.nn.ModuleDict({
+            task: torch.nn.Linear(encoder.config.hidden_size, len(classes))
+            for task, classes in tasks.items()})
+
+    def forward(self, task: str=None, **inputs):
+        """Runs encoder once and returns logits of one or all heads.
+
+        Args:
+            task: name of head (all heads if None)
+            inputs: padded model inputs with 'attention_mask'
+
+        Returns:
+            [batch_size, number_of_classes] tensor of logits of task, or
+            {task: logits} of all tasks.
+
+        Raises:
+            ValueError if model has no head for task.
+        """
+        if task is not None and task not in self.heads:
+            raise ValueError(f'no head for task {task!r}, use '
+                             f'{list(self.heads)}')
+        hidden_states = self.encoder(**inputs)[0]
+        pooled = self.dropout(masked_mean(hidden_states,
+                                          inputs['attention_mask']))
+        if task is not None:
+            return self.heads[task](pooled)
+        return {name: head(pooled) for name, head in self.heads.items()}
+
+    def save(self, output_dir, tokeniser=None):
+        """Saves encoder, heads, task classes and optional tokeniser."""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.encoder.save_pretrained(str(output_dir))
+        if tokeniser is not None:
+            tokeniser.save_pretrained(str(output_dir))
+        torch.save(self.heads.state_dict(), output_dir.joinpath(HEADS))
+        output_dir.joinpath(TASKS).write_text(json.dumps(self.tasks,
+                                                         indent=2))
+
+    @staticmethod
+    def load(model_dir):
+        """Loads model saved by `save`."""
+        model_dir = Path(model_dir)
+        tasks = json.loads(model_dir.joinpath(TASKS).read_text())
+        model = MultiTaskModel(AutoModel.from_pretrained(str(model_dir)),
+                               tasks)
+        model.heads.load_state_dict(torch.load(model_dir.joinpath(HEADS),
+                                               map_location='cpu'))
+        return model
+
+
+def task_dataset(splits: dict, tasks: list) -> Dataset:
+    """Returns one dataset of the samples of several tokenised datasets.
+
+    Args:
+        splits: {task: tokenised Dataset}
+        tasks: task names, whose index is the TASK_ID field of samples
+
+    Returns:
+        Dataset of model inputs, integer 'label' and TASK_ID.
+    """
+    fields = {}
+    for task, split in splits.items():
+        for key in MODEL_INPUTS + ['label']:
+            if key in split.column_names:
+                fields.setdefault(key, []).extend(split[key])
+        fields.setdefault(TASK_ID, []).extend(
+            [tasks.index(task)] * len(split))
+    return Dataset.from_dict(fields)
+
+
+def confusion_matrices(model, batches) -> dict:
+    """Returns {task: ConfusionMatrix} of predictions of each sample's head.
+
+    Args:
+        model: MultiTaskModel
+        batches: padded batches of a `task_dataset` with 'labels' and TASK_ID
+        tensors, on the device of model
+    """
+    matrices = {task: ConfusionMatrix(classes)
+                for task, classes in model.tasks.items()}
+    model.eval()
+    with torch.no_grad():
+        for inputs in batches:
+            inputs = dict(inputs)
+            labels = inputs.pop('labels').cpu().numpy()
+            task_ids = inputs.pop(TASK_ID).cpu().numpy()
+            logits = model(**inputs)
+            for i, task in enumerate(model.tasks):
+                selected = task_ids == i
+                if selected.any():
+                    predictions = logits[task][torch.as_tensor(
+                        selected, device=logits[task].device)].argmax(dim=-1)
+                    matrices[task].update(predictions.cpu().numpy(),
+                                          labels[selected])
+    return matrices
+
+
+class MultiTaskTrainer(BucketedTrainer):
+    """Trainer of MultiTaskModel on a `task_dataset`.
+
+    The loss is the cross-entropy of each sample's logits of its task's head,
+    averaged over the batch. Evaluation returns 'eval_accuracy' (mean of task
+    accuracies) and 'eval_accuracy_<task>' of each task.
+    """
+    def compute_loss(self, model, inputs):
+        labels = inputs.pop('labels')
+        task_ids = inputs.pop(TASK_ID)
+        logits = model(**inputs)
+        loss = 0.0
+        for i, task in enumerate(logits):
+            selected = task_ids == i
+            if selected.any():
+                loss = loss + F.cross_entropy(
+                    logits[task][selected], labels[selected], reduction='sum')
+        return loss / len(labels)
+
+    def evaluate(self, eval_dataset=None, ignore_keys=None,
+                 metric_key_prefix='eval'):
+        dataloader = self.get_eval_dataloader(eval_dataset)
+        matrices = confusion_matrices(
+            self.model, (self._prepare_inputs(inputs)
+                         for inputs in dataloader))
+        metrics = {f'{metric_key_prefix}_accuracy_{task}': matrix.accuracy()
+                   for task, matrix in matrices.items()}
+        metrics[f'{metric_key_prefix}_accuracy'] = float(
+            np.mean(list(metrics.values())))
+        self.log(metrics)
+        self.control = self.callback_handler.on_evaluate(
+            self.args, self.state, self.control, metrics)
+        return metrics
+
+
+class MultiTaskClassifier():
+    """Sentence classifier for several datasets sharing one encoder."""
+    def __init__(self, model_name_or_path: str, datasets: dict,
+                 batch_size=64, seed=42, group_by_length=False,
+                 max_tokens: int=None, max_length=None,
+                 telemetry: Telemetry=None):
+        """Constructor.
+
+        Args:
+            model_name_or_path: Huggingface pretrained model (or key of
+            PRETRAINED) or path to model saved by `train`
+            datasets: {task: DatasetDict} with 'train', 'validation' and
+            'test' splits
+            batch_size: training and evaluation batch size
+            seed: random seed
+            group_by_length: groups training samples of similar lengths into
+            batches to reduce padding
+            max_tokens: sizes training batches by number of padded tokens
+            instead of batch_size (implies group_by_length)
+            max_length: truncation policy applied to all splits and predict
+            (see `tokenise_data.truncation_length`), eg. 64, 'p99' or 'model'
+            (length saved with the model, or the model limit if None)
+            telemetry: records timings of 'tokenise', 'train' and 'eval'
+            stages (see telemetry.py)
+
+        Raises:
+            ValueError if a saved model has no head for one of datasets.
+        """
+        self.args = TrainingArguments(
+            output_dir='', learning_rate=1e-4, seed=seed,
+            per_device_train_batch_size=batch_size,
+            per_device_eval_batch_size=batch_size,
+            evaluation_strategy='epoch', metric_for_best_model='accuracy',
+            load_best_model_at_end=True, save_total_limit=1,
+            # Trainer would drop TASK_ID, which the model does not accept
+            remove_unused_columns=False)
+        set_seed(seed)  # affects initialisation of heads
+        self.model_name_or_path = PRETRAINED.get(model_name_or_path,
+                                                 model_name_or_path)
+        self.tokeniser = AutoTokenizer.from_pretrained(
+            self.model_name_or_path, use_fast=True)
+        with stage(telemetry, 'tokenise') as record:
+            data = {task: tokenise_data(self.tokeniser, dataset)
+                    for task, dataset in datasets.items()}
+            if max_length is None:
+                max_length = load_truncation_length(self.model_name_or_path)
+            if max_length is not None:
+                # Limit is derived from training splits only, and applied to
+                # all
+                max_length = truncation_length(
+                    self.tokeniser, np.concatenate(
+                        [token_lengths(d['train']) for d in data.values()]),
+                    max_length)
+                data = {task: truncate_data(self.tokeniser, d, max_length)
+                        for task, d in data.items()}
+            record['samples'] = sum(len(split) for d in data.values()
+                                    for split in d.values())
+        if Path(self.model_name_or_path).joinpath(TASKS).exists():
+            self.model = MultiTaskModel.load(self.model_name_or_path)
+            missing = [task for task in data if task not in self.model.tasks]
+            if missing:
+                raise ValueError(f'model has no head for {missing}, use '
+                                 f'{list(self.model.tasks)}')
+        else:
+            self.model = MultiTaskModel(
+                AutoModel.from_pretrained(self.model_name_or_path),
+                {task: d['train'].features['label'].names
+                 for task, d in data.items()})
+        self.model.to(self.args.device)
+        tasks = list(self.model.tasks)
+        self.data = {split: task_dataset({task: d[split]
+                                          for task, d in data.items()}, tasks)
+                     for split in ['train', 'validation', 'test']}
+        self.max_length = max_length  # truncation length (limit if None)
+        self.group_by_length = group_by_length
+        self.max_tokens = max_tokens
+        self.telemetry = telemetry
+        self.callbacks = []  # additional TrainerCallbacks of train
+        # Set by profiles.apply_profile
+        self.bf16 = False
+        self.gradient_checkpointing = False
+
+    def _load_model(self):
+        """Loads encoder with a classification layer of the largest task,
+        whose training memory approximates the multi-task model (used by
+        `profiles.apply_profile` to probe batch sizes)."""
+        return AutoModelForSequenceClassification.from_pretrained(
+            self.model_name_or_path,
+            num_labels=max(map(len, self.model.tasks.values())))
+
+    def accuracy(self, split='validation') -> dict:
+        """Returns {task: accuracy} on split of each dataset."""
+        return {task: matrix.accuracy()
+                for task, matrix in self._confusion(split).items()}
+
+    def _confusion(self, split) -> dict:
+        """Returns {task: ConfusionMatrix} of split of each dataset."""
+        device = self.args.device
+        loader = DataLoader(self.data[split],
+                            batch_size=self.args.per_device_eval_batch_size,
+                            collate_fn=DataCollatorWithPadding(self.tokeniser))
+        return confusion_matrices(
+            self.model, ({key: value.to(device)
+                          for key, value in inputs.items()}
+                         for inputs in loader))
+
+    def train(self, output_dir, epochs=5, lr=1e-4) -> dict:
+        """Trains encoder and heads on the training samples of all datasets.
+
+        Model of epoch with best mean validation accuracy is kept and saved
+        into output_dir, with the truncation length if set.
+
+        Args:
+            output_dir: folder of saved model
+            epochs: training epochs
+            lr: peak learning rate of AdamW (linear decay)
+
+        Returns:
+            {'epoch': best epoch, 'validation_accuracy': {task: accuracy}}
+        """
+        self.args.output_dir = str(output_dir)
+        self.args.num_train_epochs = epochs
+        self.args.learning_rate = lr
+        if self.gradient_checkpointing:
+            enable_gradient_checkpointing(self.model.encoder)
+        callbacks = list(self.callbacks)
+        if self.telemetry:
+            callbacks.append(TelemetryCallback(self.telemetry))
+        with stage(self.telemetry, 'train') as record:
+            trainer = MultiTaskTrainer(
+                model=self.model, args=self.args, tokenizer=self.tokeniser,
+                train_dataset=self.data['train'],
+                eval_dataset=self.data['validation'],
+                group_by_length=self.group_by_length,
+                max_tokens=self.max_tokens, bf16=self.bf16,
+                callbacks=callbacks or None)
+            trainer.train()
+            stats = trainer.state.log_history[-1]
+            record.update(samples=trainer.padding_stats.samples,
+                          tokens=trainer.padding_stats.tokens,
+                          stall_seconds=stats['train_stall_seconds'])
+        print(f'\npadding ratio = {stats["padding_ratio"]:.3f}, '
+              f'tokens/sec = {stats["train_tokens_per_second"]:.1f}, '
+              f'samples/sec = {stats["train_samples_per_second"]:.1f}, '
+              f'peak memory = {stats["train_peak_memory_mb"]:.0f} MB')
+        self.model = trainer.model
+        self.model.save(output_dir, self.tokeniser)
+        if self.max_length:
+            save_truncation_length(output_dir, self.max_length)
+        trainer.state.save_to_json(
+            str(Path(output_dir).joinpath('trainer_state.json')))
+        best = [log['epoch'] for log in trainer.state.log_history
+                if log.get('eval_accuracy') == trainer.state.best_metric]
+        return {'epoch': round(best[0]) if best else epochs,
+                'validation_accuracy': self.accuracy('validation')}
+
+    def eval(self, output_dir) -> dict:
+        """Evaluates test split of each dataset.
+
+        Classification report of each task is saved into
+        'test_results-<task>.txt'.
+
+        Returns:
+            {task: accuracy}
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        results = {}
+        with stage(self.telemetry, 'eval',
+                   samples=len(self.data['test'])):
+            matrices = self._confusion('test')
+        for task, matrix in matrices.items():
+            results[task] = matrix.accuracy()
+            print(f'{task}: accuracy = {results[task]:.3f}')
+            with open(output_dir.joinpath(f'test_results-{task}.txt'),
+                      'w') as writer:
+                writer.write(f'{matrix.report()}\n')
+                writer.write(f'accuracy = {results[task]}\n')
+        return results
+
+    def predict(self, texts: list, batch_size=256, top_k=1) -> dict:
+        """Classifies raw sentences with all heads from one encoder pass.
+
+        Sentences are truncated to self.max_length tokens as in training.
+
+        Args:
+            texts: list of sentences
+            batch_size: number of sentences per forward pass
+            top_k: number of most probable classes returned per sentence
+
+        Returns:
+            {task: ([len(texts), top_k] array of class names,
+                    [len(texts), top_k] array of class probabilities)}
+        """
+        self.model.eval()
+        input_ids = self.tokeniser(list(texts), truncation=True,
+                                   max_length=self.max_length)['input_ids']
+        order = np.argsort([len(ids) for ids in input_ids], kind='stable')
+        results = {task: (np.zeros((len(texts), min(top_k, len(classes))),
+                                   dtype=np.int64),
+                          np.zeros((len(texts), min(top_k, len(classes))),
+                                   dtype=np.float32))
+                   for task, classes in self.model.tasks.items()}
+        device = next(self.model.parameters()).device
+        no_grad = getattr(torch, 'inference_mode', torch.no_grad)
+        with no_grad():
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                inputs = self.tokeniser.pad(
+                    {'input_ids': [input_ids[i] for i in batch]},
+                    return_tensors='pt')
+                logits = self.model(**{k: v.to(device)
+                                       for k, v in inputs.items()})
+                for task, (ids, scores) in results.items():
+                    probs, classes = torch.softmax(logits[task], dim=-1).topk(
+                        ids.shape[1])
+                    ids[batch] = classes.cpu().numpy()
+                    scores[batch] = probs.cpu().numpy()
+        return {task: (np.array(self.model.tasks[task], dtype=object)[ids],
+                       scores)
+                for task, (ids, scores) in results.items()}
+
+
+def predict_and_measure(predict, *args) -> tuple:
+    """Returns output of predict(*args), its seconds and peak memory above
+    the memory used before it in MB (see `profiles.peak_memory_mb`)."""
+    reset_peak_memory()
+    before = peak_memory_mb()
+    start = time.perf_counter()
+    output = predict(*args)
+    seconds = time.perf_counter() - start
+    return output, seconds, peak_memory_mb() - before
+
+
+def compare_with_separate(multitask, classifiers: dict, texts: list,
+                          output_dir, batch_size=32) -> dict:
+    """Compares throughput, model size and memory with one classifier per
+    task.
+
+    Memory is the size of the models plus the peak increase of allocated
+    CUDA memory (or RSS on CPU) while predicting. Results are saved into
+    'multitask_results.txt'.
+
+    Args:
+        multitask: MultiTaskClassifier
+        classifiers: {task: SentenceClassifier with trained model}
+        texts: sentences to classify
+        output_dir: folder of results
+        batch_size: sentences per forward pass
+
+    Returns:
+        {'multitask_sentences_per_second', 'separate_sentences_per_second',
+         'multitask_size_mb', 'separate_size_mb', 'multitask_memory_mb',
+         'separate_memory_mb', 'agreement': {task: fraction of top classes
+         equal between the two}}
+    """
+    # Warm-up also loads all models before memory is measured
+    multitask.predict(texts[:batch_size], batch_size)
+    for classifier in classifiers.values():
+        classifier.predict(texts[:batch_size], batch_size)
+    shared, multitask_seconds, multitask_peak = predict_and_measure(
+        multitask.predict, texts, batch_size)
+    separate, separate_seconds, separate_peak = {}, 0.0, 0.0
+    for task, classifier in classifiers.items():
+        output, seconds, peak = predict_and_measure(classifier.predict, texts,
+                                                    batch_size)
+        separate[task] = output[0]
+        separate_seconds += seconds
+        separate_peak = max(separate_peak, peak)
+    multitask_size = model_size(multitask.model) / 2**20
+    separate_size = sum(model_size(c._inference_model())
+                        for c in classifiers.values()) / 2**20
+    results = {
+        'multitask_sentences_per_second': len(texts) / multitask_seconds,
+        'separate_sentences_per_second': len(texts) / separate_seconds,
+        'multitask_size_mb': multitask_size,
+        'separate_size_mb': separate_size,
+        'multitask_memory_mb': multitask_size + multitask_peak,
+        'separate_memory_mb': separate_size + separate_peak,
+        'agreement': {task: float(np.mean(shared[task][0][:, 0]
+                                          == labels[:, 0]))
+                      for task, labels in separate.items()}}
+    with open(Path(output_dir).joinpath('multitask_results.txt'),
+              'w') as writer:
+        for key, value in results.items():
+            writer.write(f'{key} = {value}\n')
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from profiles import apply_profile
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS, PROFILE_NAMES, create_telemetry
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='Huggingface pretrained model '
+                        'or path to saved multi-task model')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS),
+                        default=list(DATASETS),
+                        help='datasets (one head each)')
+    parser.add_argument('--out_dir', type=str, help='directory to save model')
+    parser.add_argument('--batch', type=int, default=64,
+                        help='per GPU training batch size (effective batch '
+                        'with accumulating profiles)')
+    parser.add_argument('--lr', type=float, default=1e-4,
+                        help='learning rate')
+    parser.add_argument('--epochs', type=int, default=5,
+                        help='training epochs (0 only evaluates)')
+    parser.add_argument('--profile', choices=PROFILE_NAMES, default='fp32',
+                        help='training performance profile (see profiles.py)')
+    parser.add_argument('--group_by_length', action='store_true',
+                        help='batch training samples of similar lengths')
+    parser.add_argument('--max_tokens', type=int,
+                        help='size training batches by number of padded '
+                        'tokens instead of --batch')
+    parser.add_argument('--max_length', type=str,
+                        help="truncation policy: fixed length (eg. 64), "
+                        "percentile of training lengths (eg. 'p99') or "
+                        "'model' limit")
+    parser.add_argument('--telemetry', type=str,
+                        help='JSONL file of stage timings and training logs')
+    parser.add_argument('--separate', nargs='+', default=[],
+                        metavar='DATASET=MODEL',
+                        help='trained single-dataset models to compare with')
+    args = parser.parse_args()
+    loaded = {name: DATASETS[name].load() for name in args.datasets}
+    model = MultiTaskClassifier(
+        args.model, loaded, args.batch, group_by_length=args.group_by_length,
+        max_tokens=args.max_tokens, max_length=args.max_length,
+        telemetry=create_telemetry(args))
+    out_dir = args.out_dir or str(Path('models').joinpath(
+        f'{Path(args.model).name}_{"-".join(args.datasets)}'))
+    if args.epochs:
+        apply_profile(model, args.profile)
+        model.train(out_dir, args.epochs, args.lr)
+    model.eval(out_dir)
+    if args.separate:
+        separate = {}
+        for item in args.separate:
+            name, path = item.split('=', 1)
+            separate[name] = SentenceClassifier.create(path, loaded[name])
+        texts = [text for name in separate
+                 for text in loaded[name]['test']['text']]
+        results = compare_with_separate(model, separate, texts, out_dir)
+        print(f'multi-task: '
+              f'{results["multitask_sentences_per_second"]:.0f} sentences/s, '
+              f'{results["multitask_size_mb"]:.0f} MB model, '
+              f'{results["multitask_memory_mb"]:.0f} MB peak; separate: '
+              f'{results["separate_sentences_per_second"]:.0f} sentences/s, '
+              f'{results["separate_size_mb"]:.0f} MB models, '
+              f'{results["separate_memory_mb"]:.0f} MB peak')
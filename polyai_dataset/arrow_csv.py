@@ -0,0 +1,144 @@
+"""Columnar ingestion of intent classification CSVs with PyArrow."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from datasets.arrow_writer import ArrowWriter
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+
+BLOCK_SIZE = 1 << 24  # bytes of CSV parsed per record batch
+
+
+def read_batches(filepath, columns=('text', 'category'),
+                 block_size=BLOCK_SIZE):
+    """Yields record batches of string columns of CSV file.
+
+    Only one batch of `block_size` bytes of CSV is held in memory at a time.
+
+    Args:
+        filepath: CSV file with header row
+        columns: names of columns to read
+        block_size: bytes of CSV per batch
+    """
+    reader = pa_csv.open_csv(
+        str(filepath),
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=list(columns),
+            column_types={column: pa.string() for column in columns}))
+    for batch in reader:
+        yield batch
+
+
+def read_shards(filepaths, columns=('text', 'category'), num_workers=None):
+    """Yields record batches of CSV files in order.
+
+    A single file is streamed. Shards of a multi-file split are parsed in
+    threads, with at most `num_workers` shards held in memory at a time.
+
+    Args:
+        filepaths: CSV file or list of CSV files with header rows
+        columns: names of columns to read
+        num_workers: threads (one per shard up to number of CPUs if None)
+    """
+    if isinstance(filepaths, (str, os.PathLike)):
+        filepaths = [filepaths]
+    if num_workers is None:
+        num_workers = min(len(filepaths), os.cpu_count() or 1)
+    if len(filepaths) == 1 or num_workers <= 1:
+        for filepath in filepaths:
+            yield from read_batches(filepath, columns)
+        return
+
+    def read(filepath):
+        return list(read_batches(filepath, columns))
+    shards = iter(filepaths)
+    with ThreadPoolExecutor(num_workers) as pool:
+        pending = deque(pool.submit(read, filepath)
+                        for _, filepath in zip(range(num_workers), shards))
+        while pending:
+            batches = pending.popleft().result()
+            filepath = next(shards, None)
+            if filepath is not None:
+                pending.append(pool.submit(read, filepath))
+            yield from batches
+
+
+def encode_labels(labels: pa.Array, names: list) -> np.ndarray:
+    """Maps array of class names to integer class IDs in bulk.
+
+    Args:
+        labels: string array of class names
+        names: list of class names, position is the class ID
+
+    Raises:
+        ValueError if a class name is not in names.
+    """
+    encoded = labels.dictionary_encode()
+    ids = {name: i for i, name in enumerate(names)}
+    try:
+        lookup = np.array(
+            [ids[name] for name in encoded.dictionary.to_pylist()],
+            dtype=np.int64)
+    except KeyError as e:
+        raise ValueError(f'invalid class name {e}') from None
+    indices = encoded.indices.to_numpy(zero_copy_only=False)
+    return lookup[indices] if len(lookup) else indices.astype(np.int64)
+
+
+def read_label_ids(filepaths, names: list, column='category',
+                   num_workers=None) -> np.ndarray:
+    """Returns [number_of_rows] array of class IDs of CSV files."""
+    return np.concatenate(
+        [encode_labels(batch.column(0), names)
+         for batch in read_shards(filepaths, [column], num_workers)] or
+        [np.zeros(0, dtype=np.int64)])
+
+
+class ArrowCsvMixin():
+    """Builds 'id', 'text' and 'label' splits from CSV record batches.
+
+    Mixed into `datasets.ArrowBasedBuilder` with features
+    {'id': string, 'text': string, 'label': ClassLabel}. Split generators pass
+    'filepaths' and optionally 'mask' and 'select' (see
+    `stratified_split.validation_mask`) as gen_kwargs. Shards are read with
+    `num_workers` threads of the builder config if it has that attribute.
+    """
+    def _generate_tables(self, filepaths, mask=None, select=1):
+        """Yields tables of examples."""
+        features = self.info.features
+        schema = pa.schema(features.type)
+        names = features['label'].names
+        mask = None if mask is None else np.frombuffer(mask, dtype=np.uint8)
+        start = 0  # row in CSV file
+        num_examples = 0  # row in split
+        num_workers = getattr(self.config, 'num_workers', None)
+        for batch in read_shards(filepaths, num_workers=num_workers):
+            text = batch.column(batch.schema.get_field_index('text'))
+            labels = batch.column(batch.schema.get_field_index('category'))
+            if mask is not None:
+                keep = pa.array(mask[start:start + len(batch)] == select)
+                text, labels = text.filter(keep), labels.filter(keep)
+            start += len(batch)
+            ids = np.arange(num_examples, num_examples + len(text)).astype(str)
+            num_examples += len(text)
+            columns = {'id': pa.array(ids), 'text': text,
+                       'label': pa.array(encode_labels(labels, names))}
+            yield num_examples, pa.Table.from_arrays(
+                [columns[name] for name in schema.names], schema=schema)
+
+    def _prepare_split(self, split_generator):
+        # Same as ArrowBasedBuilder._prepare_split, but keeps the ClassLabel
+        # feature instead of inferring features from the tables
+        fname = f'{self.name}-{split_generator.name}.arrow'
+        writer = ArrowWriter(features=self.info.features,
+                             path=os.path.join(self._cache_dir, fname))
+        for _, table in self._generate_tables(**split_generator.gen_kwargs):
+            writer.write_table(table)
+        num_examples, num_bytes = writer.finalize()
+        split_generator.split_info.num_examples = num_examples
+        split_generator.split_info.num_bytes = num_bytes
@@ -15,12 +15,15 @@
 # limitations under the License.
 """CLINC150 dataset used by PolyAI for Intent Detection."""
 
-import csv
-import json
-from pathlib import Path
-
 import datasets
 
+# datasets.load_dataset copies only modules imported by the dataset script,
+# so the helper modules of IntentDataset are imported although unused here
+# (no noqa comments, datasets 1.2 reads comments of import lines as URLs)
+from .arrow_csv import ArrowCsvMixin
+from .intent_dataset import IntentDataset
+from .stratified_split import StratifiedSplitConfig
+
 
 _CITATION = """
 @inproceedings{larson-etal-2019-evaluation,
@@ -54,37 +57,11 @@ domains. The dataset also includes 1,200 out-of-scope queries.
 _HOMEPAGE = 'https://github.com/clinc/oos-eval'
 
 
-class Clinc150(datasets.GeneratorBasedBuilder):
+class Clinc150(IntentDataset):
     """CLINC150 dataset used by PolyAI for Intent Detection."""
 
-    @staticmethod
-    def load(data_dir=None, **kwargs):
-        """Returns DatasetDict.
-
-        For convenience, create a symbolic link to the dataset folder here with
-        the same name as this source file (ie. "./clinc150").
-
-        Args:
-            data_dir: folder containing dataset files
-
-        Returns:
-            DatasetDict.
-
-        Raises:
-            FileNotFoundError if dataset files cannot be found.
-        """
-        src_file = Path(__file__)
-        if not data_dir:
-            data_dir = src_file.with_suffix('')
-        with open(Path(data_dir).joinpath('categories.json')) as fp:
-            features = datasets.Features(
-                {'id': datasets.Value('string'),
-                 'text': datasets.Value('string'),
-                 'label': datasets.features.ClassLabel(names=json.load(fp))}
-            )
-        return datasets.load_dataset(str(src_file.absolute()),
-                                     data_dir=data_dir,
-                                     features=features, **kwargs)
+    SPLIT_FILES = {'train': 'train.csv', 'validation': 'val.csv',
+                   'test': 'test.csv'}
 
     def _info(self):
         return datasets.DatasetInfo(
@@ -93,25 +70,3 @@ class Clinc150(datasets.GeneratorBasedBuilder):
             homepage=_HOMEPAGE,
             citation=_CITATION,
         )
-
-    def _split_generators(self, dl_manager):
-        """Returns SplitGenerators."""
-        data = dl_manager.download_and_extract({
-            split: Path(self.config.data_dir).joinpath(f'{split}.csv')
-            for split in ['train', 'val', 'test']
-        })
-        return [
-            datasets.SplitGenerator(name=datasets.Split.TRAIN,
-                                    gen_kwargs={'filepath': data['train']}),
-            datasets.SplitGenerator(name=datasets.Split.VALIDATION,
-                                    gen_kwargs={'filepath': data['val']}),
-            datasets.SplitGenerator(name=datasets.Split.TEST,
-                                    gen_kwargs={'filepath': data['test']})
-        ]
-
-    def _generate_examples(self, filepath):
-        """Yields examples."""
-        with open(filepath) as fp:
-            samples = [x for x in csv.DictReader(fp)]
-        for i, eg in enumerate(samples):
-            yield i, {'id': str(i), 'text': eg['text'], 'label': eg['category']}
@@ -15,13 +15,15 @@
 # limitations under the License.
 """Subset of HWU64 dataset used by PolyAI for Intent Detection."""
 
-from collections import Counter
-import csv
-import json
-from pathlib import Path
-
 import datasets
 
+# datasets.load_dataset copies only modules imported by the dataset script,
+# so the helper modules of IntentDataset are imported although unused here
+# (no noqa comments, datasets 1.2 reads comments of import lines as URLs)
+from .arrow_csv import ArrowCsvMixin
+from .intent_dataset import IntentDataset
+from .stratified_split import StratifiedSplitConfig
+
 
 _CITATION = """
 @InProceedings{XLiu.etal:IWSDS2019,
@@ -55,38 +57,9 @@ all the 64 Intents and 54 Entity Types.
 _HOMEPAGE = 'https://github.com/xliuhw/NLU-Evaluation-Data'
 
 
-class Hwu64Sub(datasets.GeneratorBasedBuilder):
+class Hwu64Sub(IntentDataset):
     """Subset of HWU64 dataset used by PolyAI for Intent Detection."""
 
-    @staticmethod
-    def load(data_dir=None, **kwargs):
-        """Returns DatasetDict.
-
-        For convenience, create a symbolic link to the dataset folder here with
-        the same name as this source file (ie. "./hwu64_sub").
-
-        Args:
-            data_dir: folder containing dataset files
-
-        Returns:
-            DatasetDict.
-
-        Raises:
-            FileNotFoundError if dataset files cannot be found.
-        """
-        src_file = Path(__file__)
-        if not data_dir:
-            data_dir = src_file.with_suffix('')
-        with open(Path(data_dir).joinpath('categories.json')) as fp:
-            features = datasets.Features(
-                {'id': datasets.Value('string'),
-                 'text': datasets.Value('string'),
-                 'label': datasets.features.ClassLabel(names=json.load(fp))}
-            )
-        return datasets.load_dataset(str(src_file.absolute()),
-                                     data_dir=data_dir,
-                                     features=features, **kwargs)
-
     def _info(self):
         return datasets.DatasetInfo(
             description=_DESCRIPTION,
@@ -94,37 +67,3 @@ class Hwu64Sub(datasets.GeneratorBasedBuilder):
             homepage=_HOMEPAGE,
             citation=_CITATION,
         )
-
-    def _split_generators(self, dl_manager):
-        """Returns SplitGenerators."""
-        data = dl_manager.download_and_extract({
-            split: Path(self.config.data_dir).joinpath(f'{split}.csv')
-            for split in ['train', 'test']
-        })
-        with open(data['train']) as fp:
-            all_train = [x for x in csv.DictReader(fp)]
-        with open(data['test']) as fp:
-            test = [x for x in csv.DictReader(fp)]
-        # Extract balanced validation split from training data
-        val_split = []
-        labels = [x['category'] for x in all_train]
-        for label, count in Counter(labels).items():
-            n = count // 5
-            val_split.extend(
-                [i for i, c in enumerate(labels) if c == label][:n])
-        train_split = [i for i in range(len(all_train)) if i not in val_split]
-        return [
-            datasets.SplitGenerator(
-                name=datasets.Split.TRAIN,
-                gen_kwargs={'samples': [all_train[i] for i in train_split]}),
-            datasets.SplitGenerator(
-                name=datasets.Split.VALIDATION,
-                gen_kwargs={'samples': [all_train[i] for i in val_split]}),
-            datasets.SplitGenerator(name=datasets.Split.TEST,
-                                    gen_kwargs={'samples': test})
-        ]
-
-    def _generate_examples(self, samples):
-        """Yields examples."""
-        for i, eg in enumerate(samples):
-            yield i, {'id': str(i), 'text': eg['text'], 'label': eg['category']}
@@ -0,0 +1,192 @@
+"""Configurable builder for intent classification datasets in CSV files.
+
+A dataset folder contains a JSON list of class names and one or more CSV files
+per split with 'text' and 'category' columns. Concrete datasets subclass
+`IntentDataset`, set `SPLIT_FILES` and implement `_info`.
+"""
+import abc
+from dataclasses import dataclass, fields
+import hashlib
+import inspect
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+import datasets
+from datasets.utils.file_utils import HF_DATASETS_CACHE
+
+from .arrow_csv import ArrowCsvMixin, read_label_ids
+from .stratified_split import StratifiedSplitConfig, validation_mask
+
+
+# Config fields that do not change the contents of a prepared dataset
+_RUNTIME_FIELDS = {'name', 'version', 'description', 'data_dir', 'data_files',
+                   'num_workers'}
+
+
+@dataclass
+class IntentDatasetConfig(StratifiedSplitConfig):
+    """BuilderConfig for intent classification datasets in CSV files.
+
+    Args:
+        split_files: {split: file name, glob pattern or list of them} relative
+        to data_dir, defaults to `SPLIT_FILES` of the builder. The
+        'validation' split is taken from 'train' if it is not given.
+        label_file: JSON list of class names relative to data_dir
+        num_workers: threads reading the shards of a split
+    """
+    split_files: dict = None
+    label_file: str = 'categories.json'
+    num_workers: int = None
+
+
+def resolve_files(data_dir, patterns) -> list:
+    """Returns sorted paths of files matching patterns in data_dir.
+
+    Raises:
+        FileNotFoundError if a pattern matches no files.
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    filepaths = []
+    for pattern in patterns:
+        matches = sorted(Path(data_dir).glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f'no files matching {pattern} in '
+                                    f'{data_dir}')
+        filepaths.extend(matches)
+    return filepaths
+
+
+class IntentDataset(ArrowCsvMixin, datasets.ArrowBasedBuilder,
+                    metaclass=abc.ABCMeta):
+    """Intent classification dataset of 'id', 'text' and 'label' fields."""
+
+    BUILDER_CONFIG_CLASS = IntentDatasetConfig
+    SPLIT_FILES = {'train': 'train.csv', 'test': 'test.csv'}
+
+    @classmethod
+    def load(cls, data_dir=None, prepared=True, **kwargs):
+        """Returns DatasetDict.
+
+        For convenience, create a symbolic link to the dataset folder here with
+        the same name as the source file of the dataset (eg. "./banking77").
+
+        Prepared datasets are saved in the 'prepared' folder of the cache and
+        loaded directly on later calls with the same config, source files and
+        builder code, which skips `datasets.load_dataset`.
+
+        Args:
+            data_dir: folder containing dataset files
+            prepared: uses and saves prepared dataset
+            kwargs: passed to `datasets.load_dataset`, eg. `cache_dir` or the
+            fields of `IntentDatasetConfig`
+
+        Returns:
+            DatasetDict.
+
+        Raises:
+            FileNotFoundError if dataset files cannot be found.
+        """
+        src_file = Path(inspect.getfile(cls))
+        if not data_dir:
+            data_dir = src_file.with_suffix('')
+        label_file = kwargs.get('label_file') or IntentDatasetConfig.label_file
+        with open(Path(data_dir).joinpath(label_file)) as fp:
+            names = json.load(fp)
+        prepared_dir = None
+        if prepared:
+            cache_dir = Path(kwargs.get('cache_dir') or HF_DATASETS_CACHE)
+            prepared_dir = cache_dir.expanduser().joinpath(
+                'prepared',
+                f'{src_file.stem}-{cls.config_hash(data_dir, names, kwargs)}')
+            if prepared_dir.exists():
+                return datasets.DatasetDict.load_from_disk(str(prepared_dir))
+        features = datasets.Features(
+            {'id': datasets.Value('string'),
+             'text': datasets.Value('string'),
+             'label': datasets.features.ClassLabel(names=names)}
+        )
+        data = datasets.load_dataset(str(src_file.absolute()),
+                                     data_dir=data_dir,
+                                     features=features, **kwargs)
+        if prepared_dir:
+            prepared_dir.parent.mkdir(parents=True, exist_ok=True)
+            # Save into temporary folder first so that concurrent loads never
+            # see a partially written dataset
+            tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{prepared_dir.name}-',
+                                            dir=prepared_dir.parent))
+            try:
+                data.save_to_disk(str(tmp_dir))
+                os.replace(tmp_dir, prepared_dir)
+            except OSError:
+                if not prepared_dir.exists():
+                    raise
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return data
+
+    @classmethod
+    def config_hash(cls, data_dir, names, config_kwargs) -> str:
+        """Returns hash of everything that determines the prepared dataset.
+
+        Covers config fields, class names, size and modification time of
+        source files, and source code of the builder modules.
+        """
+        config = {field.name: config_kwargs.get(field.name, field.default)
+                  for field in fields(IntentDatasetConfig)
+                  if field.name not in _RUNTIME_FIELDS}
+        config['split_files'] = config['split_files'] or cls.SPLIT_FILES
+        files = [[str(f.absolute()), f.stat().st_size, f.stat().st_mtime_ns]
+                 for patterns in config['split_files'].values()
+                 for f in resolve_files(data_dir, patterns)]
+        sources = [Path(inspect.getfile(cls)), Path(__file__),
+                   Path(__file__).with_name('arrow_csv.py'),
+                   Path(__file__).with_name('stratified_split.py')]
+        content = hashlib.sha256()
+        content.update(json.dumps({'config': config, 'names': names,
+                                   'files': files,
+                                   'datasets': datasets.__version__},
+                                  sort_keys=True).encode())
+        for source in sources:
+            content.update(source.read_bytes())
+        return content.hexdigest()[:32]
+
+    @abc.abstractmethod
+    def _info(self):
+        """Returns DatasetInfo with description, homepage and citation."""
+
+    def _split_generators(self, dl_manager):
+        """Returns SplitGenerators."""
+        split_files = self.config.split_files or self.SPLIT_FILES
+        data = dl_manager.download_and_extract({
+            split: [str(f) for f in resolve_files(self.config.data_dir,
+                                                  patterns)]
+            for split, patterns in split_files.items()
+        })
+        generators = []
+        for split, filepaths in data.items():
+            if split == 'train' and 'validation' not in data:
+                # Extract balanced validation split from training data
+                labels = read_label_ids(filepaths,
+                                        self.info.features['label'].names,
+                                        num_workers=self.config.num_workers)
+                val_mask = validation_mask(
+                    labels, self.config.val_fold, self.config.val_strategy,
+                    self.config.seed)
+                generators.extend([
+                    datasets.SplitGenerator(
+                        name=datasets.Split.TRAIN,
+                        gen_kwargs={'filepaths': filepaths, 'mask': val_mask,
+                                    'select': 0}),
+                    datasets.SplitGenerator(
+                        name=datasets.Split.VALIDATION,
+                        gen_kwargs={'filepaths': filepaths, 'mask': val_mask,
+                                    'select': 1})
+                ])
+            else:
+                generators.append(datasets.SplitGenerator(
+                    name=split, gen_kwargs={'filepaths': filepaths}))
+        return generators
@@ -0,0 +1,134 @@
+"""Streaming stratified validation split for intent classification CSVs."""
+from array import array
+from collections import Counter
+import csv
+from dataclasses import dataclass
+import random
+
+import datasets
+import numpy as np
+
+
+STRATEGIES = ['first', 'random']
+
+
+@dataclass
+class StratifiedSplitConfig(datasets.BuilderConfig):
+    """BuilderConfig for datasets with a validation split taken from 'train'.
+
+    Args:
+        val_fold: one in every `val_fold` samples of each class is used for
+        validation
+        val_strategy: 'first' selects the first samples of each class (in file
+        order), 'random' samples them uniformly with `seed`
+        seed: random seed for 'random' strategy
+    """
+    val_fold: int = 5
+    val_strategy: str = 'first'
+    seed: int = None
+
+
+def read_column(filepath, field='category'):
+    """Yields values of a single CSV column without building row dicts.
+
+    Args:
+        filepath: CSV file with header row
+        field: name of the column
+
+    Raises:
+        KeyError if field is not in the header.
+    """
+    with open(filepath, newline='') as fp:
+        reader = csv.reader(fp)
+        header = next(reader, [])
+        if field not in header:
+            raise KeyError(field)
+        column = header.index(field)
+        for row in reader:
+            yield row[column]
+
+
+def validation_mask(labels, fold=5, strategy='first', seed=None) -> bytearray:
+    """Selects a class-balanced validation subset in O(n) time.
+
+    `count // fold` samples of each class are selected. The 'first' strategy
+    selects the same samples as taking the first `count // fold` indices of
+    every class.
+
+    Args:
+        labels: iterable of class labels, one per sample, or numpy array of
+        integer class IDs (see `read_label_ids`), which is split with a
+        numpy sort (O(n log n)) without creating a Python object per sample
+        fold: one in every `fold` samples of each class is selected
+        strategy: 'first' or 'random'
+        seed: random seed for 'random' strategy
+
+    Returns:
+        bytearray with 1 for validation samples and 0 for training samples.
+
+    Raises:
+        ValueError if strategy is unknown.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'unknown strategy {strategy!r}, use {STRATEGIES}')
+    if isinstance(labels, np.ndarray):
+        return _array_validation_mask(labels, fold, strategy, seed)
+    # Encode labels as small ints to keep one pass over the labels cheap
+    ids = {}
+    encoded = array('l', (ids.setdefault(label, len(ids)) for label in labels))
+    counts = Counter(encoded)
+    quota = {c: n // fold for c, n in counts.items()}
+    if strategy == 'random':
+        rng = random.Random(seed)
+        chosen = {c: set(rng.sample(range(counts[c]), n))
+                  for c, n in quota.items()}
+    seen = dict.fromkeys(counts, 0)
+    mask = bytearray(len(encoded))
+    for i, c in enumerate(encoded):
+        if strategy == 'first':
+            mask[i] = seen[c] < quota[c]
+        else:
+            mask[i] = seen[c] in chosen[c]
+        seen[c] += 1
+    return mask
+
+
+def _array_validation_mask(labels, fold, strategy, seed) -> bytearray:
+    """Returns `validation_mask` of numpy array of integer class IDs.
+
+    Samples are grouped by class with a stable sort, so the rank of each
+    sample within its class is its offset in the group. Classes are visited
+    in order of first appearance, so 'random' draws the same samples as for
+    the equivalent list of labels.
+    """
+    order = np.argsort(labels, kind='stable')
+    classes, starts, counts = np.unique(labels[order], return_index=True,
+                                        return_counts=True)
+    selected = np.zeros(len(labels), dtype=np.uint8)  # in sorted order
+    if strategy == 'first':
+        quota = counts // fold
+        offsets = np.arange(len(labels)) - np.repeat(starts, counts)
+        selected[offsets < np.repeat(quota, counts)] = 1
+    else:
+        rng = random.Random(seed)
+        for c in np.argsort(order[starts], kind='stable'):
+            chosen = rng.sample(range(int(counts[c])),
+                                int(counts[c]) // fold)
+            selected[starts[c] + np.array(chosen, dtype=np.int64)] = 1
+    mask = np.empty_like(selected)
+    mask[order] = selected
+    return bytearray(mask.tobytes())
+
+
+def read_split(filepath, mask=None, select=1):
+    """Yields CSV rows as dicts, optionally filtered by a sample mask.
+
+    Args:
+        filepath: CSV file with header row
+        mask: sequence of 0/1 per row, see `validation_mask` (all rows if None)
+        select: yields rows where mask is equal to this value
+    """
+    with open(filepath, newline='') as fp:
+        for i, row in enumerate(csv.DictReader(fp)):
+            if mask is None or mask[i] == select:
+                yield row
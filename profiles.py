@@ -0,0 +1,329 @@
+"""Named training performance profiles and per-device batch size probing.
+
+A profile selects the precision of autocast (fp32, fp16 or bf16), gradient
+checkpointing, and whether the per-device batch is probed. With probing, the
+requested training batch becomes the effective batch: the largest batch that
+fits on the GPU is used per device, and gradients are accumulated over enough
+steps to reach the requested batch.
+
+Probed batch sizes are cached in a JSON file keyed by model, precision,
+checkpointing, sequence length and GPU.
+
+Example:
+    python profiles.py --profile fp16-accumulate --seq_length 64
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+import json
+from pathlib import Path
+
+import torch
+
+
+BATCH_SIZES = Path('models').joinpath('batch_sizes.json')
+
+
+@dataclass
+class Profile():
+    """Training performance settings.
+
+    Args:
+        precision: 'fp32', 'fp16' (CUDA AMP) or 'bf16' (needs torch >= 1.10)
+        gradient_checkpointing: recomputes activations in backward pass to
+        save memory
+        probe_batch: uses largest per-device batch that fits in GPU memory and
+        accumulates gradients up to the requested batch
+        memory_fraction: fraction of GPU memory a probed batch may use
+    """
+    precision: str = 'fp32'
+    gradient_checkpointing: bool = False
+    probe_batch: bool = False
+    memory_fraction: float = 0.9
+
+
+PROFILES = {
+    'fp32': Profile(),
+    'fp16': Profile(precision='fp16'),
+    'bf16': Profile(precision='bf16'),
+    'fp16-accumulate': Profile(precision='fp16', probe_batch=True),
+    'bf16-accumulate': Profile(precision='bf16', probe_batch=True),
+    'low-memory': Profile(precision='fp16', gradient_checkpointing=True,
+                          probe_batch=True)
+}
+PRECISIONS = ['fp32', 'fp16', 'bf16']
+
+
+@contextmanager
+def autocast(precision='fp32'):
+    """Runs CUDA operations in given precision.
+
+    Raises:
+        ValueError if precision is unknown or bf16 is not supported.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'unknown precision {precision!r}, use {PRECISIONS}')
+    if precision == 'fp32':
+        yield
+    elif precision == 'fp16':
+        with torch.cuda.amp.autocast():
+            yield
+    else:
+        if not hasattr(torch, 'autocast'):
+            raise ValueError('bf16 autocast needs torch >= 1.10')
+        with torch.autocast('cuda', dtype=torch.bfloat16):
+            yield
+
+
+def enable_gradient_checkpointing(model):
+    """Enables gradient checkpointing on Huggingface model if supported."""
+    if hasattr(model, 'gradient_checkpointing_enable'):
+        model.gradient_checkpointing_enable()
+    else:
+        # Older transformers read the flag from the config
+        model.config.gradient_checkpointing = True
+
+
+def reset_peak_rss():
+    """Resets peak returned by `peak_rss_mb` to the current resident set size
+    (Linux 4.0 or later, otherwise the peak stays the process lifetime peak).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    """Returns peak resident set size since `reset_peak_rss` in MB."""
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_memory():
+    """Resets peak returned by `peak_memory_mb` to the memory currently
+    used (see `reset_peak_rss` on CPU)."""
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        reset_peak_rss()
+
+
+def peak_memory_mb() -> float:
+    """Returns peak allocated CUDA memory, or peak RSS on CPU, in MB."""
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2**20
+    return peak_rss_mb()
+
+
+def fits(model, batch_size: int, seq_length: int, precision='fp32',
+         memory_limit: int=None) -> bool:
+    """Returns True if a training step of batch_size fits on model's GPU.
+
+    Runs forward, backward and AdamW step on random inputs of seq_length
+    tokens. Weights of model are changed.
+
+    Args:
+        model: sequence classification model on CUDA device
+        batch_size: per-device batch size
+        seq_length: tokens per sample
+        precision: autocast precision
+        memory_limit: maximum peak allocated memory in bytes
+    """
+    device = next(model.parameters()).device
+    optimiser = torch.optim.AdamW(model.parameters())
+    torch.cuda.reset_peak_memory_stats(device)
+    try:
+        input_ids = torch.randint(model.config.vocab_size,
+                                  (batch_size, seq_length), device=device)
+        labels = torch.zeros(batch_size, dtype=torch.long, device=device)
+        with autocast(precision):
+            loss = model(input_ids=input_ids, labels=labels)[0]
+        loss.backward()
+        optimiser.step()
+        peak = torch.cuda.max_memory_allocated(device)
+    except RuntimeError as e:
+        if 'out of memory' not in str(e):
+            raise
+        return False
+    finally:
+        model.zero_grad()
+        del optimiser
+        torch.cuda.empty_cache()
+    return memory_limit is None or peak <= memory_limit
+
+
+def probe_batch_size(model, seq_length: int, precision='fp32',
+                     memory_fraction=0.9, max_batch=4096) -> int:
+    """Returns largest per-device training batch that fits on model's GPU.
+
+    Batch size is doubled until a step fails, then binary searched.
+
+    Args:
+        model: sequence classification model on CUDA device (its weights are
+        changed)
+        seq_length: tokens per sample
+        precision: autocast precision
+        memory_fraction: fraction of GPU memory the step may use
+        max_batch: upper limit of batch size
+
+    Returns:
+        Batch size, 0 if a single sample does not fit.
+    """
+    device = next(model.parameters()).device
+    memory_limit = int(memory_fraction
+                       * torch.cuda.get_device_properties(device).total_memory)
+    model.train()
+    low, high = 0, 1
+    while high <= max_batch and fits(model, high, seq_length, precision,
+                                     memory_limit):
+        low, high = high, high * 2
+    high = min(high, max_batch + 1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(model, middle, seq_length, precision, memory_limit):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def cached_batch_size(model_name_or_path: str, load_model, seq_length: int,
+                      profile: Profile, cache_file=BATCH_SIZES) -> int:
+    """Returns probed batch size from cache file, probing it if not cached.
+
+    Args:
+        model_name_or_path: model name used in cache key
+        load_model: function returning the model on CPU
+        seq_length: tokens per sample
+        profile: training profile
+        cache_file: JSON file of probed batch sizes
+
+    Raises:
+        RuntimeError if no CUDA device is available.
+    """
+    if not torch.cuda.is_available():
+        raise RuntimeError('batch size probing needs a CUDA device')
+    device = torch.cuda.current_device()
+    key = '|'.join(str(x) for x in [
+        model_name_or_path, profile.precision, profile.gradient_checkpointing,
+        seq_length, profile.memory_fraction,
+        torch.cuda.get_device_name(device)])
+    cache_file = Path(cache_file)
+    sizes = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+    if key not in sizes:
+        model = load_model()
+        if profile.gradient_checkpointing:
+            enable_gradient_checkpointing(model)
+        sizes[key] = probe_batch_size(model.to(device), seq_length,
+                                      profile.precision,
+                                      profile.memory_fraction)
+        del model
+        torch.cuda.empty_cache()
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps(sizes, indent=2, sort_keys=True))
+    return sizes[key]
+
+
+def accumulation_batch(effective: int, fitting: int) -> int:
+    """Returns largest divisor of effective batch that is at most the
+    fitting per-device batch, so that accumulated batches sum to exactly the
+    effective batch.
+
+    Raises:
+        ValueError if the divisor is below half of the fitting batch (eg. 1
+        for a prime effective batch), which would waste most of the device.
+    """
+    for batch in range(min(effective, fitting), 0, -1):
+        if effective % batch == 0:
+            break
+    if batch < min(effective, fitting) / 2:
+        lower = max(fitting, effective // fitting * fitting)
+        upper = -(-effective // fitting) * fitting
+        raise ValueError(
+            f'effective batch {effective} would be accumulated from batches '
+            f'of {batch} although {fitting} samples fit on the device, use '
+            f'a batch with a larger divisor, eg. '
+            f'{sorted({lower, upper})}')
+    return batch
+
+
+def apply_profile(classifier, profile, cache_file=BATCH_SIZES):
+    """Configures SentenceClassifier for training with profile.
+
+    Args:
+        classifier: SentenceClassifier
+        profile: Profile or name of profile in PROFILES
+        cache_file: JSON file of probed batch sizes
+
+    Raises:
+        ValueError if profile is unknown, a single sample does not fit, or
+        the effective batch has no divisor close to the fitting batch (see
+        `accumulation_batch`).
+    """
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(f'unknown profile {profile!r}, use '
+                             f'{list(PROFILES)}')
+        profile = PROFILES[profile]
+    args = classifier.args
+    # Autocast only applies to CUDA operations
+    cuda = torch.cuda.is_available()
+    args.fp16 = cuda and profile.precision == 'fp16'
+    classifier.bf16 = cuda and profile.precision == 'bf16'
+    classifier.gradient_checkpointing = profile.gradient_checkpointing
+    if profile.probe_batch and cuda:
+        seq_length = max(len(ids)
+                         for ids in classifier.data['train']['input_ids'])
+        fitting = cached_batch_size(classifier.model_name_or_path,
+                                    classifier._load_model, seq_length,
+                                    profile, cache_file)
+        if not fitting:
+            raise ValueError(f'a batch of one sample of {seq_length} tokens '
+                             f'does not fit in GPU memory')
+        effective = args.per_device_train_batch_size
+        per_device = accumulation_batch(effective, fitting)
+        args.per_device_train_batch_size = per_device
+        args.gradient_accumulation_steps = effective // per_device
+    print(f'profile {profile}: per-device batch = '
+          f'{args.per_device_train_batch_size}, gradient accumulation = '
+          f'{args.gradient_accumulation_steps}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from transformers import AutoModelForSequenceClassification
+
+    from sentence_classifier import PRETRAINED
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--models', nargs='+', default=list(PRETRAINED),
+                        help='Huggingface pretrained models or paths')
+    parser.add_argument('--profile', choices=list(PROFILES),
+                        default='fp16-accumulate', help='training profile')
+    parser.add_argument('--seq_length', type=int, default=64,
+                        help='tokens per sample')
+    parser.add_argument('--num_labels', type=int, default=150,
+                        help='classes of classification layer')
+    parser.add_argument('--cache_file', type=str, default=str(BATCH_SIZES),
+                        help='JSON file of probed batch sizes')
+    args = parser.parse_args()
+    profile = PROFILES[args.profile]
+    print(f'{"model":>14} {"batch":>6}')
+    for model in args.models:
+        name = PRETRAINED.get(model, model)
+        batch = cached_batch_size(
+            name,
+            lambda: AutoModelForSequenceClassification.from_pretrained(
+                name, num_labels=args.num_labels),
+            args.seq_length, profile, args.cache_file)
+        print(f'{model:>14} {batch:>6}')
@@ -0,0 +1,267 @@
+"""Structured pruning of attention heads and feed-forward neurons.
+
+Heads and feed-forward (FFN) neurons of a fine-tuned model are scored by the
+gradient of the validation loss with respect to a mask on their outputs
+(Michel et al., 2019, "Are Sixteen Heads Really Better than One?"). The
+least important are removed from the weight matrices: heads with
+`prune_heads` (recorded in config 'pruned_heads'), and neurons by shrinking
+the FFN of every layer to the same smaller 'intermediate_size'. Pruned
+checkpoints therefore load with `from_pretrained` like any other model.
+
+Each pruning ratio is followed by a short recovery fine-tune, and accuracy,
+CPU latency and parameter count of all ratios are saved into
+'pruning_results.txt' with the Pareto optimal ratios marked.
+
+Only models with BERT-style encoders (eg. BERT, RoBERTa and ELECTRA) are
+supported.
+
+Example:
+    python prune.py models/bert-base-uncased_bank_10epochs bank \
+        --ratios 0.1 0.2 0.3 0.5 --epochs 1
+"""
+import copy
+from pathlib import Path
+
+import torch
+from transformers.modeling_utils import prune_linear_layer
+
+from early_exit import encoder_layers
+from quantise import measure_speed
+
+
+def importance_scores(classifier, dataset, batch_size: int=None):
+    """Returns importance of heads and FFN neurons of classifier model.
+
+    Importance is the absolute gradient of the summed cross-entropy loss with
+    respect to a mask multiplying the output of each head or neuron,
+    accumulated over batches of dataset. Head scores are normalised per
+    layer.
+
+    Args:
+        classifier: SentenceClassifier with fine-tuned model
+        dataset: tokenised dataset with 'label' field (eg. validation split)
+        batch_size: evaluation batch size (from classifier.args if None)
+
+    Returns:
+        ([number_of_layers, number_of_heads] tensor,
+         [number_of_layers, intermediate_size] tensor)
+
+    Raises:
+        ValueError if model has no BERT-style encoder or heads were pruned.
+    """
+    model = classifier._inference_model()
+    if model.config.pruned_heads:
+        raise ValueError('heads of model are already pruned')
+    device = next(model.parameters()).device
+    layers = encoder_layers(model)
+    head_mask = torch.ones(len(layers), model.config.num_attention_heads,
+                           device=device, requires_grad=True)
+    neuron_masks = [torch.ones(layer.intermediate.dense.out_features,
+                               device=device, requires_grad=True)
+                    for layer in layers]
+    hooks = [layer.intermediate.register_forward_hook(
+                 lambda module, inputs, output, mask=mask: output * mask)
+             for layer, mask in zip(layers, neuron_masks)]
+    heads = torch.zeros_like(head_mask)
+    neurons = torch.zeros(len(layers), len(neuron_masks[0]), device=device)
+    try:
+        for inputs, label_ids in classifier._batches(dataset, batch_size,
+                                                     device):
+            logits = model(**inputs, head_mask=head_mask)[0]
+            loss = torch.nn.functional.cross_entropy(
+                logits, torch.as_tensor(label_ids).to(device),
+                reduction='sum')
+            grads = torch.autograd.grad(loss, [head_mask] + neuron_masks)
+            heads += grads[0].abs()
+            neurons += torch.stack(grads[1:]).abs()
+    finally:
+        for hook in hooks:
+            hook.remove()
+    heads /= heads.norm(dim=-1, keepdim=True).clamp(min=1e-20)
+    return heads.cpu(), neurons.cpu()
+
+
+def heads_to_prune(head_importance, ratio: float) -> dict:
+    """Returns {layer: [heads]} of the least important fraction of heads.
+
+    At least one head is kept in every layer.
+
+    Args:
+        head_importance: [number_of_layers, number_of_heads] tensor
+        ratio: fraction of all heads to prune
+    """
+    num_layers, num_heads = head_importance.shape
+    remaining = int(round(ratio * num_layers * num_heads))
+    heads = {}
+    for i in head_importance.flatten().argsort().tolist():
+        if remaining == 0:
+            break
+        layer, head = divmod(i, num_heads)
+        if len(heads.get(layer, [])) < num_heads - 1:
+            heads.setdefault(layer, []).append(head)
+            remaining -= 1
+    return {layer: sorted(pruned) for layer, pruned in heads.items()}
+
+
+def prune_model(model, head_importance, neuron_importance, ratio: float):
+    """Removes the least important fraction of heads and FFN neurons.
+
+    Every layer keeps its most important `(1 - ratio) * intermediate_size`
+    neurons, so that the model config describes the pruned FFN.
+
+    Args:
+        model: sequence classification model with BERT-style encoder,
+        modified in place
+        head_importance: [number_of_layers, number_of_heads] tensor
+        neuron_importance: [number_of_layers, intermediate_size] tensor
+        ratio: fraction of heads and FFN neurons to prune
+
+    Returns:
+        model
+    """
+    model.prune_heads(heads_to_prune(head_importance, ratio))
+    keep = max(1, int(round(neuron_importance.shape[1] * (1 - ratio))))
+    for layer, scores in zip(encoder_layers(model), neuron_importance):
+        index = scores.argsort(descending=True)[:keep].sort().values
+        index = index.to(layer.intermediate.dense.weight.device)
+        layer.intermediate.dense = prune_linear_layer(
+            layer.intermediate.dense, index, dim=0)
+        layer.output.dense = prune_linear_layer(layer.output.dense, index,
+                                                dim=1)
+    model.config.intermediate_size = keep
+    return model
+
+
+def num_parameters(model) -> int:
+    """Returns number of parameters of model."""
+    return sum(p.numel() for p in model.parameters())
+
+
+def pareto_optimal(rows: list) -> list:
+    """Returns flags of rows not dominated by another row (higher or equal
+    'accuracy', and lower or equal 'latency_ms' and 'parameters', one of them
+    strictly)."""
+    keys = ['accuracy', 'latency_ms', 'parameters']
+
+    def dominates(a, b):
+        better = [a['accuracy'] >= b['accuracy'],
+                  a['latency_ms'] <= b['latency_ms'],
+                  a['parameters'] <= b['parameters']]
+        return all(better) and any(a[k] != b[k] for k in keys)
+    return [not any(dominates(other, row) for other in rows) for row in rows]
+
+
+def prune_classifier(classifier, ratios, eval_dataset, test_dataset,
+                     epochs=1, output_dir=None, batch_size=32) -> list:
+    """Prunes classifier model at several ratios and compares them on CPU.
+
+    For each ratio, a pruned copy of the model is saved into
+    '<output_dir>/pruned-<ratio>', fine-tuned there for `epochs` epochs with
+    the classifier's training arguments, and evaluated with
+    `SentenceClassifier.eval` (results saved with '-pruned<ratio>' suffix).
+    A table of all ratios, including the unpruned model as ratio 0, is
+    saved into 'pruning_results.txt'.
+
+    Args:
+        classifier: SentenceClassifier with fine-tuned model
+        ratios: fractions of heads and FFN neurons to prune
+        eval_dataset: tokenised validation dataset for importance scores
+        test_dataset: tokenised test dataset with 'text' field
+        epochs: recovery fine-tuning epochs (no fine-tuning if 0)
+        output_dir: folder of pruned models (classifier output_dir with
+        '-pruned' suffix if None)
+        batch_size: batch size for latency measurements
+
+    Returns:
+        [{'ratio', 'accuracy', 'latency_ms', 'sentences_per_second',
+          'parameters', 'heads', 'intermediate_size', 'pareto', 'path'}]
+    """
+    if not output_dir:
+        output_dir = f'{str(classifier.args.output_dir).rstrip("/")}-pruned'
+    head_importance, neuron_importance = importance_scores(classifier,
+                                                           eval_dataset)
+    original = classifier._cpu_model()
+    rows = []
+    for ratio in [0.0] + sorted(ratios):
+        if ratio:
+            path = Path(output_dir).joinpath(f'pruned-{ratio}')
+            prune_model(copy.deepcopy(original), head_importance,
+                        neuron_importance, ratio).save_pretrained(str(path))
+            classifier.tokeniser.save_pretrained(str(path))
+            model = copy.copy(classifier)
+            model.args = copy.deepcopy(classifier.args)
+            model.args.output_dir = str(path)
+            model.args.num_train_epochs = epochs
+            model.model_name_or_path = str(path)
+            model.registry = model.early_exit = model.label_index = None
+            model.model = None
+            if epochs:
+                model.train()
+        else:
+            model, path = classifier, classifier.model_name_or_path
+        model.model = (original if model is classifier
+                       else model._cpu_model())
+        config = model.model.config
+        metrics = model.eval(test_dataset, suffix=f'-pruned{ratio}')
+        row = {'ratio': ratio, 'accuracy': metrics['eval_accuracy']}
+        row.update(measure_speed(model, test_dataset['text'], batch_size))
+        row.update(parameters=num_parameters(model.model),
+                   heads=(config.num_hidden_layers
+                          * config.num_attention_heads
+                          - sum(map(len, config.pruned_heads.values()))),
+                   intermediate_size=config.intermediate_size,
+                   path=str(path))
+        rows.append(row)
+    for row, optimal in zip(rows, pareto_optimal(rows)):
+        row['pareto'] = optimal
+    with open(Path(classifier.args.output_dir).joinpath(
+            'pruning_results.txt'), 'w') as writer:
+        writer.write(f'{"ratio":>5} {"accuracy":>8} {"ms/batch":>8} '
+                     f'{"parameters":>10} {"heads":>5} {"ffn":>5} pareto\n')
+        for row in rows:
+            writer.write(f'{row["ratio"]:>5} {row["accuracy"]:>8.3f} '
+                         f'{row["latency_ms"]:>8.1f} '
+                         f'{row["parameters"]:>10} {row["heads"]:>5} '
+                         f'{row["intermediate_size"]:>5} '
+                         f'{"*" if row["pareto"] else "":>6}\n')
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='path to fine-tuned model')
+    parser.add_argument('dataset', type=str,
+                        help=f'dataset to use {list(DATASETS)}')
+    parser.add_argument('--ratios', type=float, nargs='+',
+                        default=[0.1, 0.2, 0.3, 0.5],
+                        help='fractions of heads and FFN neurons to prune')
+    parser.add_argument('--epochs', type=int, default=1,
+                        help='recovery fine-tuning epochs per ratio')
+    parser.add_argument('--lr', type=float, default=5e-5,
+                        help='learning rate of recovery fine-tuning')
+    parser.add_argument('--out_dir', type=str, help='directory of pruned '
+                        'models (model directory with -pruned suffix if not '
+                        'set)')
+    parser.add_argument('--batch', type=int, default=32,
+                        help='batch size for latency measurement')
+    parser.add_argument('--threads', type=int,
+                        help='CPU threads for latency measurement')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = SentenceClassifier.create(args.model,
+                                      DATASETS[args.dataset].load())
+    model.args.output_dir = args.model
+    model.args.learning_rate = args.lr
+    for row in model.prune(args.ratios, args.epochs, args.out_dir,
+                           args.batch):
+        print(f'ratio {row["ratio"]}: accuracy = {row["accuracy"]:.3f}, '
+              f'latency = {row["latency_ms"]:.1f} ms/batch, '
+              f'parameters = {row["parameters"] / 1e6:.1f}M'
+              f'{" (Pareto optimal)" if row["pareto"] else ""}')
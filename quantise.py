@@ -0,0 +1,205 @@
+"""Post-training dynamic INT8 quantisation of sentence classifiers for CPU."""
+import copy
+import io
+from pathlib import Path
+import time
+
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification
+
+
+INT8_WEIGHTS = 'pytorch_model_int8.bin'
+EXPORTS = ['torchscript', 'onnx']
+
+
+class LogitsOnly(torch.nn.Module):
+    """Wraps sequence classifier to return logits tensor for tracing."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                          return_dict=False)[0]
+
+
+def quantise_dynamic(model):
+    """Returns copy of model on CPU with Linear layers quantised to INT8."""
+    model = copy.deepcopy(model).cpu().eval()
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def model_size(model) -> int:
+    """Returns size of serialised model state in bytes."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def save_quantised(model, tokeniser, output_dir):
+    """Saves quantised model state with config and tokeniser."""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    tokeniser.save_pretrained(output_dir)
+    torch.save(model.state_dict(), output_dir.joinpath(INT8_WEIGHTS))
+
+
+def load_quantised(model_dir):
+    """Loads model saved by `save_quantised`."""
+    config = AutoConfig.from_pretrained(model_dir)
+    model = quantise_dynamic(
+        AutoModelForSequenceClassification.from_config(config))
+    model.load_state_dict(torch.load(Path(model_dir).joinpath(INT8_WEIGHTS)))
+    return model.eval()
+
+
+def export(model, tokeniser, path, export_format='torchscript'):
+    """Exports model taking (input_ids, attention_mask) and returning logits.
+
+    Args:
+        model: sequence classification model on CPU
+        tokeniser: tokeniser used to create example inputs
+        path: output file
+        export_format: 'torchscript' or 'onnx' (dynamically quantised models
+        can only be exported to TorchScript)
+
+    Raises:
+        ValueError if export_format is unknown.
+    """
+    if export_format not in EXPORTS:
+        raise ValueError(f'unknown export format {export_format!r}, use '
+                         f'{EXPORTS}')
+    inputs = tokeniser(['an example sentence'], return_tensors='pt')
+    example = (inputs['input_ids'], inputs['attention_mask'])
+    wrapped = LogitsOnly(model).eval()
+    with torch.no_grad():
+        if export_format == 'torchscript':
+            torch.jit.trace(wrapped, example).save(str(path))
+        else:
+            axes = {0: 'batch', 1: 'sequence'}
+            torch.onnx.export(
+                wrapped, example, str(path),
+                input_names=['input_ids', 'attention_mask'],
+                output_names=['logits'],
+                dynamic_axes={'input_ids': axes, 'attention_mask': axes,
+                              'logits': {0: 'batch'}},
+                opset_version=11)
+
+
+def measure_speed(classifier, texts, batch_size=32) -> dict:
+    """Returns latency per batch and throughput of `classifier.predict`."""
+    classifier.predict(texts[:batch_size], batch_size)  # warm-up
+    start = time.perf_counter()
+    classifier.predict(texts, batch_size)
+    elapsed = time.perf_counter() - start
+    num_batches = -(-len(texts) // batch_size)
+    return {'latency_ms': 1000 * elapsed / num_batches,
+            'sentences_per_second': len(texts) / elapsed}
+
+
+def quantise_classifier(classifier, test_dataset, tolerance=0.01,
+                        output_dir=None, export_format=None,
+                        batch_size=32) -> dict:
+    """Quantises classifier model and compares it with the FP32 model on CPU.
+
+    Both models are evaluated on test dataset with `SentenceClassifier.eval`
+    (results saved with '-fp32' and '-int8' suffixes). Quantised model is
+    saved only if its accuracy is at most `tolerance` lower.
+
+    Args:
+        classifier: SentenceClassifier with trained model
+        test_dataset: tokenised test dataset with 'text' field
+        tolerance: maximum allowed accuracy loss (absolute)
+        output_dir: folder for quantised model (classifier output_dir with
+        '-int8' suffix if None)
+        export_format: optionally exports quantised model to TorchScript
+        ('torchscript' saves 'model.pt' into output_dir). 'onnx' is not
+        supported, as quantised operators cannot be exported to ONNX (export
+        the FP32 model with `export` instead)
+        batch_size: batch size for latency measurements
+
+    Returns:
+        Dictionary of accuracy, latency, throughput and size of both models,
+        and 'accepted'.
+
+    Raises:
+        ValueError if export_format is not 'torchscript'.
+    """
+    if export_format and export_format != 'torchscript':
+        raise ValueError(f'quantised models can only be exported to '
+                         f'TorchScript, not {export_format!r} (export the '
+                         f'FP32 model with `train.py export` instead)')
+    # Compared on CPU copies, classifier.model stays on its device
+    original = classifier._inference_model()
+    fp32 = copy.deepcopy(original).cpu()
+    int8 = quantise_dynamic(fp32)
+    texts = test_dataset['text']
+    results = {}
+    try:
+        for name, model in [('fp32', fp32), ('int8', int8)]:
+            classifier.model = model
+            metrics = classifier.eval(test_dataset, suffix=f'-{name}')
+            results[f'{name}_accuracy'] = metrics['eval_accuracy']
+            speed = measure_speed(classifier, texts, batch_size)
+            for key, value in speed.items():
+                results[f'{name}_{key}'] = value
+            results[f'{name}_size_mb'] = model_size(model) / 2**20
+    finally:
+        classifier.model = original
+    results['accuracy_loss'] = (results['fp32_accuracy']
+                                - results['int8_accuracy'])
+    results['accepted'] = results['accuracy_loss'] <= tolerance
+    if results['accepted']:
+        if not output_dir:
+            output_dir = f'{str(classifier.args.output_dir).rstrip("/")}-int8'
+        save_quantised(int8, classifier.tokeniser, output_dir)
+        if export_format:
+            export(int8, classifier.tokeniser,
+                   Path(output_dir).joinpath('model.pt'), export_format)
+        results['output_dir'] = str(output_dir)
+    with open(Path(classifier.args.output_dir).joinpath(
+            'quantisation_results.txt'), 'w') as writer:
+        for key, value in results.items():
+            writer.write(f'{key} = {value}\n')
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    from sentence_classifier import SentenceClassifier
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='path to saved model')
+    parser.add_argument('dataset', type=str,
+                        help=f'dataset to use {list(DATASETS)}')
+    parser.add_argument('--out_dir', type=str, help='directory to save '
+                        'quantised model (model directory with -int8 suffix '
+                        'if not set)')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='maximum accuracy loss of quantised model')
+    parser.add_argument('--export', choices=['torchscript'],
+                        help='also export quantised model in this format '
+                        '(ONNX cannot represent quantised operators)')
+    parser.add_argument('--batch', type=int, default=32,
+                        help='batch size for latency measurement')
+    args = parser.parse_args()
+    model = SentenceClassifier.create(args.model, DATASETS[args.dataset].load())
+    model.args.output_dir = args.model
+    results = model.quantise(tolerance=args.tolerance, output_dir=args.out_dir,
+                             export_format=args.export, batch_size=args.batch)
+    for name in ['fp32', 'int8']:
+        print(f'{name}: accuracy = {results[f"{name}_accuracy"]:.3f}, '
+              f'latency = {results[f"{name}_latency_ms"]:.1f} ms/batch, '
+              f'{results[f"{name}_sentences_per_second"]:.0f} sentences/s, '
+              f'size = {results[f"{name}_size_mb"]:.1f} MB')
+    if not results['accepted']:
+        print(f'rejected: accuracy loss {results["accuracy_loss"]:.3f} > '
+              f'{args.tolerance}')
+        sys.exit(1)
+    print(f'saved quantised model to {results["output_dir"]}')
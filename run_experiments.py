@@ -0,0 +1,196 @@
+"""Trains and evaluates a matrix of models, datasets and seeds in parallel.
+
+Datasets are tokenised once per distinct tokeniser in the main process and
+shared with the training workers through a TokenisedCache. Runs with an
+existing 'trainer_state.json' are skipped, so an interrupted experiment can be
+restarted. Results of all runs are collected into 'results.csv'.
+
+Example:
+    python run_experiments.py --models bert distilbert --datasets bank hwu \
+        --seeds 1 2 3 --cache_dir cache
+"""
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import re
+import time
+
+
+def run_dir(out_dir, model, dataset, epochs, seed) -> Path:
+    """Returns output folder of a run."""
+    name = Path(model).name
+    return Path(out_dir).joinpath(f'{name}_{dataset}_{epochs}epochs_seed{seed}')
+
+
+def is_finished(output_dir) -> bool:
+    return Path(output_dir).joinpath('trainer_state.json').exists()
+
+
+def _init_worker(devices, threads):
+    """Pins worker process to one GPU from devices queue (or CPU threads)."""
+    device = devices.get()
+    os.environ['CUDA_VISIBLE_DEVICES'] = '' if device is None else str(device)
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+
+
+def train_run(model, dataset, seed, output_dir, batch, lr, epochs, cache_dir):
+    """Trains one model and returns wall-clock seconds."""
+    from sentence_classifier import SentenceClassifier
+    from tokenise_cache import TokenisedCache
+    from train import DATASETS
+
+    start = time.perf_counter()
+    cache = TokenisedCache(cache_dir) if cache_dir else None
+    classifier = SentenceClassifier.create(
+        model, DATASETS[dataset].load(), batch, seed=seed, cache=cache)
+    classifier.args.output_dir = str(output_dir)
+    classifier.args.num_train_epochs = epochs
+    classifier.args.learning_rate = lr
+    classifier.train(test_dataset=classifier.data['test'])
+    elapsed = time.perf_counter() - start
+    with open(Path(output_dir).joinpath('run.json'), 'w') as fp:
+        json.dump({'model': model, 'dataset': dataset, 'seed': seed,
+                   'wall_clock': elapsed}, fp)
+    return elapsed
+
+
+def pretokenise(models, datasets, cache_dir):
+    """Tokenises every dataset once per distinct tokeniser into cache."""
+    from transformers import AutoTokenizer
+
+    from sentence_classifier import PRETRAINED
+    from tokenise_cache import TokenisedCache, tokeniser_fingerprint
+    from train import DATASETS
+
+    cache = TokenisedCache(cache_dir)
+    loaded = {name: DATASETS[name].load() for name in datasets}
+    seen = set()
+    for model in models:
+        tokeniser = AutoTokenizer.from_pretrained(
+            PRETRAINED.get(model, model), use_fast=True)
+        fingerprint = tokeniser_fingerprint(tokeniser)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        for data in loaded.values():
+            cache.tokenise(tokeniser, data)
+    print(cache.report())
+
+
+def collect_results(out_dir, runs) -> list:
+    """Returns result rows of finished runs."""
+    rows = []
+    for model, dataset, seed, output_dir in runs:
+        results = Path(output_dir).joinpath('test_results-train.txt')
+        if not results.exists():
+            continue
+        row = {'model': model, 'dataset': dataset, 'seed': seed}
+        match = re.search(r'^accuracy = (\S+)$', results.read_text(), re.M)
+        row['accuracy'] = float(match.group(1)) if match else None
+        info = Path(output_dir).joinpath('run.json')
+        if info.exists():
+            row['wall_clock'] = json.loads(info.read_text())['wall_clock']
+        with open(Path(output_dir).joinpath('trainer_state.json')) as fp:
+            history = json.load(fp)['log_history']
+        for entry in history:
+            for key in ['train_samples_per_second', 'train_tokens_per_second']:
+                if key in entry:
+                    row[key] = entry[key]
+        rows.append(row)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    with open(Path(out_dir).joinpath('results.csv'), 'w', newline='') as fp:
+        fields = ['model', 'dataset', 'seed', 'accuracy', 'wall_clock',
+                  'train_samples_per_second', 'train_tokens_per_second']
+        writer = csv.DictWriter(fp, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def print_table(rows):
+    """Prints mean accuracy and throughput per model and dataset."""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['model'], row['dataset']), []).append(row)
+    print(f'\n{"model":>14} {"dataset":>8} {"runs":>4} {"accuracy":>9} '
+          f'{"wall s":>8} {"samples/s":>10}')
+    for (model, dataset), group in sorted(groups.items()):
+        def mean(key):
+            values = [r[key] for r in group if r.get(key) is not None]
+            return sum(values) / len(values) if values else float('nan')
+        print(f'{model:>14} {dataset:>8} {len(group):>4} '
+              f'{mean("accuracy"):>9.3f} {mean("wall_clock"):>8.0f} '
+              f'{mean("train_samples_per_second"):>10.1f}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from sentence_classifier import PRETRAINED
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--models', nargs='+', default=list(PRETRAINED),
+                        help='Huggingface pretrained models or paths')
+    parser.add_argument('--datasets', nargs='+', default=list(DATASETS),
+                        help=f'datasets to use {list(DATASETS)}')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[42],
+                        help='random seeds')
+    parser.add_argument('--out_dir', type=str, default='models',
+                        help='directory to save models and results')
+    parser.add_argument('--cache_dir', type=str, default='cache',
+                        help='directory to cache tokenised datasets')
+    parser.add_argument('--batch', type=int, default=128,
+                        help='per GPU training batch size')
+    parser.add_argument('--lr', type=float, default=1e-4,
+                        help='learning rate')
+    parser.add_argument('--epochs', type=int, default=10,
+                        help='training epochs')
+    parser.add_argument('--workers', type=int,
+                        help='parallel runs on CPU (one per GPU if available)')
+    args = parser.parse_args()
+
+    import torch
+
+    runs = [(model, dataset, seed,
+             run_dir(args.out_dir, model, dataset, args.epochs, seed))
+            for model in args.models for dataset in args.datasets
+            for seed in args.seeds]
+    pending = [run for run in runs if not is_finished(run[-1])]
+    print(f'{len(runs)} runs, {len(runs) - len(pending)} already finished')
+    if pending:
+        pretokenise(args.models, args.datasets, args.cache_dir)
+        context = multiprocessing.get_context('spawn')
+        devices = context.Manager().Queue()
+        num_gpus = torch.cuda.device_count()
+        if num_gpus:
+            workers = num_gpus
+            for device in range(num_gpus):
+                devices.put(device)
+            threads = None
+        else:
+            workers = args.workers or 1
+            for _ in range(workers):
+                devices.put(None)
+            threads = max(1, os.cpu_count() // workers)
+        with ProcessPoolExecutor(workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(devices, threads)) as pool:
+            futures = {
+                pool.submit(train_run, model, dataset, seed, output_dir,
+                            args.batch, args.lr, args.epochs,
+                            args.cache_dir): (model, dataset, seed)
+                for model, dataset, seed, output_dir in pending}
+            for future in as_completed(futures):
+                try:
+                    elapsed = future.result()
+                    print(f'finished {futures[future]} in {elapsed:.0f}s')
+                except Exception as e:
+                    print(f'failed {futures[future]}: {e!r}')
+    print_table(collect_results(args.out_dir, runs))
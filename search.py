@@ -0,0 +1,302 @@
+"""Hyperparameter search with asynchronous successive halving (ASHA).
+
+Trials sample learning rate, batch size, warmup and weight decay, and are
+trained in parallel, one per GPU (or split between CPU cores), from a dataset
+tokenised once into a shared TokenisedCache (see run_experiments.py). After
+each epoch a trial reports its validation accuracy from `compute_metrics`.
+At rung epochs (min_epochs * reduction^k) a trial is stopped unless its
+accuracy is in the top 1 / reduction of the accuracies reported at that rung
+so far (Li et al., 2020, "A System for Massively Parallel Hyperparameter
+Tuning"). Optionally a grid of learning rates and batch sizes is trained for
+all epochs as a baseline.
+
+Total epochs and seconds of training, and the best configuration of each
+method are saved into 'search_results.json'. Finished trials are reloaded
+from their 'trial.json', so an interrupted search can be restarted.
+
+Example:
+    python search.py bert bank --trials 27 --epochs 9 --grid
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
+import json
+import math
+import multiprocessing
+import os
+from pathlib import Path
+import random
+import time
+
+import numpy as np
+from transformers import TrainerCallback
+
+from run_experiments import _init_worker, pretokenise
+
+
+# Ranges of log-uniform learning rate and uniform warmup (fraction of
+# training steps), choices of batch size and weight decay
+SEARCH_SPACE = {'lr': (1e-5, 3e-4), 'batch': [16, 32, 64, 128],
+                'warmup': (0.0, 0.2), 'weight_decay': [0.0, 0.01, 0.1]}
+GRID = {'lr': [2e-5, 5e-5, 1e-4], 'batch': [32, 128]}
+
+
+def sample_configs(num_trials: int, seed=0, space: dict=None) -> list:
+    """Returns list of random trial configurations from search space."""
+    space = space or SEARCH_SPACE
+    rng = random.Random(seed)
+    configs = []
+    low, high = math.log10(space['lr'][0]), math.log10(space['lr'][1])
+    for _ in range(num_trials):
+        configs.append({
+            'lr': float(f'{10 ** rng.uniform(low, high):.2e}'),
+            'batch': rng.choice(space['batch']),
+            'warmup': round(rng.uniform(*space['warmup']), 3),
+            'weight_decay': rng.choice(space['weight_decay'])})
+    return configs
+
+
+def grid_configs(grid: dict=None) -> list:
+    """Returns trial configurations of all combinations of grid values
+    (without warmup and weight decay)."""
+    grid = grid or GRID
+    return [{'lr': lr, 'batch': batch, 'warmup': 0.0, 'weight_decay': 0.0}
+            for lr, batch in itertools.product(grid['lr'], grid['batch'])]
+
+
+def rung_epochs(min_epochs: int, max_epochs: int, reduction: int) -> list:
+    """Returns epochs min_epochs * reduction^k below max_epochs."""
+    rungs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= reduction
+    return rungs
+
+
+class SuccessiveHalving():
+    """Asynchronous successive halving decisions shared between processes."""
+    def __init__(self, rungs: list, reduction: int, records, lock):
+        """Constructor.
+
+        Args:
+            rungs: epochs at which trials may be stopped
+            reduction: fraction 1 / reduction of trials continues at each
+            rung
+            records: dict of {rung epoch: [accuracies]} (eg. a
+            multiprocessing Manager dict)
+            lock: lock of records
+        """
+        self.rungs = rungs
+        self.reduction = reduction
+        self.records = records
+        self.lock = lock
+
+    def report(self, epoch: int, accuracy: float) -> bool:
+        """Records accuracy of a trial after epoch, and returns whether the
+        trial should continue."""
+        if epoch not in self.rungs:
+            return True
+        with self.lock:
+            recorded = list(self.records.get(epoch, []))
+            self.records[epoch] = recorded + [accuracy]
+        if not recorded:
+            return True
+        cutoff = np.percentile(recorded, 100 * (1 - 1 / self.reduction))
+        return accuracy >= cutoff
+
+
+class HalvingCallback(TrainerCallback):
+    """Records validation accuracy of each epoch and stops training when
+    SuccessiveHalving decides so."""
+    def __init__(self, scheduler: SuccessiveHalving=None):
+        self.scheduler = scheduler
+        self.accuracies = {}  # epoch: validation accuracy
+        self.stopped = False
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        epoch = int(round(state.epoch))
+        accuracy = metrics['eval_accuracy']
+        self.accuracies[epoch] = accuracy
+        if self.scheduler and not self.scheduler.report(epoch, accuracy):
+            control.should_training_stop = True
+            self.stopped = True
+
+
+def train_trial(config: dict, model, dataset, seed, output_dir, max_epochs,
+                cache_dir, scheduler: SuccessiveHalving=None) -> dict:
+    """Trains one trial and returns its result.
+
+    Args:
+        config: {'lr', 'batch', 'warmup', 'weight_decay'}
+        model: Huggingface pretrained model or path
+        dataset: name of dataset
+        seed: random seed
+        output_dir: folder of trial, result is saved into 'trial.json'
+        max_epochs: training epochs unless stopped
+        cache_dir: folder of tokenised dataset cache
+        scheduler: stops trial early (trained for max_epochs if None)
+
+    Returns:
+        {'config', 'accuracies' ({epoch: validation accuracy}),
+         'accuracy' (best validation accuracy), 'epochs', 'seconds',
+         'stopped'}
+    """
+    from sentence_classifier import SentenceClassifier
+    from tokenise_cache import TokenisedCache
+    from train import DATASETS
+
+    start = time.perf_counter()
+    cache = TokenisedCache(cache_dir) if cache_dir else None
+    classifier = SentenceClassifier.create(
+        model, DATASETS[dataset].load(), config['batch'], seed=seed,
+        cache=cache)
+    args = classifier.args
+    args.output_dir = str(output_dir)
+    args.num_train_epochs = max_epochs
+    args.learning_rate = config['lr']
+    args.weight_decay = config['weight_decay']
+    steps = math.ceil(len(classifier.data['train']) / args.train_batch_size)
+    args.warmup_steps = int(config['warmup'] * steps * max_epochs)
+    callback = HalvingCallback(scheduler)
+    classifier.callbacks.append(callback)
+    classifier.train()
+    result = {'config': config, 'accuracies': callback.accuracies,
+              'accuracy': max(callback.accuracies.values()),
+              'epochs': max(callback.accuracies),
+              'seconds': time.perf_counter() - start,
+              'stopped': callback.stopped}
+    with open(Path(output_dir).joinpath('trial.json'), 'w') as fp:
+        json.dump(result, fp)
+    return result
+
+
+def load_trial(output_dir) -> dict:
+    """Returns result of finished trial, or None."""
+    path = Path(output_dir).joinpath('trial.json')
+    if not path.exists():
+        return None
+    result = json.loads(path.read_text())
+    result['accuracies'] = {int(epoch): accuracy for epoch, accuracy
+                            in result['accuracies'].items()}
+    return result
+
+
+def summary(results: list) -> dict:
+    """Returns total compute and best trial of a search method."""
+    best = max(results, key=lambda result: result['accuracy'])
+    return {'trials': len(results),
+            'stopped': sum(result['stopped'] for result in results),
+            'epochs': sum(result['epochs'] for result in results),
+            'seconds': sum(result['seconds'] for result in results),
+            'accuracy': best['accuracy'], 'config': best['config']}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='Huggingface pretrained model '
+                        'or path to saved model on disk')
+    parser.add_argument('dataset', choices=list(DATASETS),
+                        help='dataset to use')
+    parser.add_argument('--trials', type=int, default=27,
+                        help='number of sampled configurations')
+    parser.add_argument('--epochs', type=int, default=9,
+                        help='maximum training epochs per trial')
+    parser.add_argument('--min_epochs', type=int, default=1,
+                        help='epochs before the first stopping decision')
+    parser.add_argument('--reduction', type=int, default=3,
+                        help='1 / reduction of trials continues at each rung')
+    parser.add_argument('--grid', action='store_true',
+                        help='also train grid baseline for all epochs')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='random seed of sampling and training')
+    parser.add_argument('--out_dir', type=str, default='models/search',
+                        help='directory of trials and results')
+    parser.add_argument('--cache_dir', type=str, default='cache',
+                        help='directory to cache tokenised datasets')
+    parser.add_argument('--workers', type=int,
+                        help='parallel trials on CPU (one per GPU if '
+                        'available)')
+    args = parser.parse_args()
+
+    import torch
+
+    out_dir = Path(args.out_dir).joinpath(
+        f'{Path(args.model).name}_{args.dataset}')
+    methods = {'asha': sample_configs(args.trials, args.seed)}
+    if args.grid:
+        methods['grid'] = grid_configs()
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    rungs = rung_epochs(args.min_epochs, args.epochs, args.reduction)
+    scheduler = SuccessiveHalving(rungs, args.reduction, manager.dict(),
+                                  manager.Lock())
+    print(f'stopping decisions at epochs {rungs}')
+    results, pending = {method: [] for method in methods}, []
+    for method, configs in methods.items():
+        for i, config in enumerate(configs):
+            output_dir = out_dir.joinpath(f'{method}-{i:03d}')
+            result = load_trial(output_dir)
+            if result is None:
+                pending.append((method, config, output_dir))
+                continue
+            results[method].append(result)
+            if method == 'asha':
+                for epoch, accuracy in sorted(result['accuracies'].items()):
+                    scheduler.report(epoch, accuracy)
+    print(f'{sum(map(len, methods.values()))} trials, {len(pending)} to run')
+    start = time.perf_counter()
+    if pending:
+        pretokenise([args.model], [args.dataset], args.cache_dir)
+        devices = manager.Queue()
+        num_gpus = torch.cuda.device_count()
+        if num_gpus:
+            workers = num_gpus
+            for device in range(num_gpus):
+                devices.put(device)
+            threads = None
+        else:
+            workers = args.workers or 1
+            for _ in range(workers):
+                devices.put(None)
+            threads = max(1, os.cpu_count() // workers)
+        with ProcessPoolExecutor(workers, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(devices, threads)) as pool:
+            futures = {
+                pool.submit(train_trial, config, args.model, args.dataset,
+                            args.seed, output_dir, args.epochs,
+                            args.cache_dir,
+                            scheduler if method == 'asha' else None):
+                (method, output_dir)
+                for method, config, output_dir in pending}
+            for future in as_completed(futures):
+                method, output_dir = futures[future]
+                try:
+                    result = future.result()
+                    results[method].append(result)
+                    print(f'{output_dir.name}: accuracy = '
+                          f'{result["accuracy"]:.3f} after '
+                          f'{result["epochs"]} epochs'
+                          f'{" (stopped)" if result["stopped"] else ""}')
+                except Exception as e:
+                    print(f'failed {output_dir.name}: {e!r}')
+    summaries = {method: summary(method_results)
+                 for method, method_results in results.items()
+                 if method_results}
+    summaries['wall_clock'] = time.perf_counter() - start
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir.joinpath('search_results.json'), 'w') as fp:
+        json.dump(summaries, fp, indent=2)
+    print(f'\n{"method":>6} {"trials":>6} {"stopped":>7} {"epochs":>6} '
+          f'{"seconds":>8} {"accuracy":>8}  best configuration')
+    for method in methods:
+        if method in summaries:
+            row = summaries[method]
+            print(f'{method:>6} {row["trials"]:>6} {row["stopped"]:>7} '
+                  f'{row["epochs"]:>6} {row["seconds"]:>8.0f} '
+                  f'{row["accuracy"]:>8.3f}  {row["config"]}')
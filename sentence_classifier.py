@@ -1,14 +1,23 @@
 """Sentence classification model."""
+from contextlib import ExitStack
+import copy
 from pathlib import Path
 
 from datasets import DatasetDict
+import numpy as np
+import torch
 from transformers import (
     AutoTokenizer, AutoModelForSequenceClassification, set_seed,
-    TrainingArguments, Trainer
+    TrainingArguments
 )
 
-from eval_accuracy import get_compute_metrics
-from tokenise_data import tokenise_data
+from eval_accuracy import ConfusionMatrix, get_compute_metrics
+from profiles import enable_gradient_checkpointing
+from telemetry import Telemetry, TelemetryCallback, stage, timed_iter
+from tokenise_cache import TokenisedCache
+from tokenise_data import (load_truncation_length, save_truncation_length,
+                           token_lengths, tokenise_data, truncate_data,
+                           truncation_length)
 
 
 # Pretrained models from Huggingface
@@ -26,12 +35,17 @@ PRETRAINED = {
     'squeezebert': 'squeezebert/squeezebert-uncased'
 }
 
+# Tokenised fields passed to the model
+MODEL_INPUTS = ['input_ids', 'attention_mask', 'token_type_ids']
+
 
 class SentenceClassifier():
     """Sentence classification model."""
     @staticmethod
     def create(model_name_or_path: str, dataset: DatasetDict,
-               train_batch=128, seed: int=None):
+               train_batch=128, seed: int=None, cache: TokenisedCache=None,
+               group_by_length=False, max_tokens: int=None,
+               max_length=None, telemetry: Telemetry=None, registry=None):
         """Static factory method.
 
         Args:
@@ -40,6 +54,34 @@ class SentenceClassifier():
             dataset: dataset to use
             train_batch: training batch size
             seed: random seed to use
+            cache: cache of tokenised datasets (tokenises dataset if None)
+            group_by_length: groups training samples of similar lengths into
+            batches to reduce padding
+            max_tokens: sizes training batches by number of padded tokens
+            instead of train_batch (implies group_by_length)
+            max_length: truncation policy applied to all splits and predict
+            (see `tokenise_data.truncation_length`), eg. 64, 'p99' or 'model'
+            (length saved with the model, or the model limit if None)
+            telemetry: records timings of 'create', 'tokenise', 'train' and
+            'eval' stages (see telemetry.py)
+            registry: ModelRegistry whose pool of warm models is used by eval
+            and predict (see model_registry.py)
+        """
+        with stage(telemetry, 'create', model=model_name_or_path) as record:
+            model = SentenceClassifier._create(
+                model_name_or_path, dataset, train_batch, seed, cache,
+                max_length, telemetry)
+            model.group_by_length = group_by_length
+            model.max_tokens = max_tokens
+            model.telemetry = telemetry
+            model.registry = registry
+            record['samples'] = sum(map(len, model.data.values()))
+        return model
+
+    @staticmethod
+    def _create(model_name_or_path, dataset, train_batch, seed, cache,
+                max_length, telemetry):
+        """Tokenises dataset and returns SentenceClassifier (see `create`).
         """
         args = TrainingArguments(output_dir='', learning_rate=1e-4,
                                  per_device_train_batch_size=train_batch,
@@ -56,8 +98,26 @@ class SentenceClassifier():
             model_name_or_path = PRETRAINED[model_name_or_path]
         tokeniser = AutoTokenizer.from_pretrained(
             model_name_or_path, use_fast=True)
-        return SentenceClassifier(args, model_name_or_path, tokeniser,
-                                  tokenise_data(tokeniser, dataset))
+        with stage(telemetry, 'tokenise') as record:
+            if cache:
+                data = cache.tokenise(tokeniser, dataset)
+            else:
+                data = tokenise_data(tokeniser, dataset)
+            if max_length is None:
+                max_length = load_truncation_length(model_name_or_path)
+            if max_length is not None:
+                # Limit is derived from training split only, and applied to
+                # all
+                max_length = truncation_length(
+                    tokeniser, token_lengths(data['train']), max_length)
+                data = truncate_data(tokeniser, data, max_length)
+            if telemetry:
+                lengths = token_lengths(data)
+                record['samples'] = sum(len(x) for x in lengths.values())
+                record['tokens'] = int(sum(x.sum() for x in lengths.values()))
+        model = SentenceClassifier(args, model_name_or_path, tokeniser, data)
+        model.max_length = max_length
+        return model
 
     def __init__(self, args, model_name_or_path, tokeniser, data):
         self.args = args
@@ -65,68 +125,485 @@ class SentenceClassifier():
         self.tokeniser = tokeniser
         self.data = data
         self.classes = data['train'].features['label'].names
+        self.group_by_length = False
+        self.max_tokens = None
+        self.max_length = None  # truncation length (model limit if None)
+        self.telemetry = None  # Telemetry of stages
+        self.callbacks = []  # additional TrainerCallbacks of train
+        self.registry = None  # ModelRegistry of inference models
+        # {split: TensorShards} used by train and eval (see use_shards)
+        self.shards = None
+        # Set by profiles.apply_profile
+        self.bf16 = False
+        self.gradient_checkpointing = False
+        self.model = None  # trained or loaded model used by predict
+        # CentroidIndex used by predict instead of classification head
+        self.label_index = None
+        # EarlyExit used by eval and predict to skip layers of confident
+        # samples
+        self.early_exit = None
+
+    def _labels(self) -> dict:
+        """Returns config arguments of a classification layer for
+        self.classes."""
+        return {'num_labels': len(self.classes),
+                'id2label': dict(enumerate(self.classes)),
+                'label2id': {c: i for i, c in enumerate(self.classes)}}
+
+    def _load_model(self):
+        """Loads model with a classification layer for self.classes."""
+        return AutoModelForSequenceClassification.from_pretrained(
+            self.model_name_or_path, **self._labels())
 
-    def train(self, train_dataset=None, eval_dataset=None, test_dataset=None):
+    def train(self, train_dataset=None, eval_dataset=None, test_dataset=None,
+              teacher_logits=None, alpha=0.5, temperature=2.0):
         """Runs training, and evaluation if test dataset provided.
 
         If test dataset is provided, classification results are saved into
-        'test_results.txt'.
+        'test_results-train.txt'. Training batches are loaded from
+        self.shards['train'] if set and train_dataset and teacher_logits are
+        None.
 
         Args:
             train_dataset: tokenised training dataset ('train' split if None)
             eval_dataset: tokenised validation dataset ('validation' split if
             None)
-            test_dataset: tokenised test dataset
+            test_dataset: tokenised test dataset or TensorShards
+            teacher_logits: [len(train_dataset), number_of_classes] array of
+            teacher logits for knowledge distillation (see distil.py)
+            alpha: weight of cross-entropy loss in distillation
+            temperature: softmax temperature of distillation loss
         """
+        # Trainers are only needed for training (faster eval-only startup)
+        from distil import DistillationTrainer, add_teacher_logits
+        from length_sampler import BucketedTrainer
+        trainer_class, kwargs = BucketedTrainer, {}
+        if self.shards and not train_dataset:
+            if teacher_logits is None:
+                kwargs['train_shards'] = self.shards['train']
+            else:
+                print('distillation trains from the tokenised dataset, '
+                      'not from shards')
         if not train_dataset:
             train_dataset = self.data['train']
         if not eval_dataset:
             eval_dataset = self.data['validation']
-        trainer = Trainer(
-            args=self.args, tokenizer=self.tokeniser,
-            model=AutoModelForSequenceClassification.from_pretrained(
-                self.model_name_or_path, num_labels=len(self.classes)),
+        if teacher_logits is not None:
+            train_dataset = add_teacher_logits(train_dataset, teacher_logits)
+            trainer_class = DistillationTrainer
+            kwargs = {'alpha': alpha, 'temperature': temperature}
+        callbacks = list(self.callbacks)
+        if self.telemetry:
+            callbacks.append(TelemetryCallback(self.telemetry))
+        if callbacks:
+            kwargs['callbacks'] = callbacks
+        with stage(self.telemetry, 'train') as record:
+            trainer = self._train(trainer_class, train_dataset, eval_dataset,
+                                  kwargs)
+            stats = trainer.state.log_history[-1]
+            record.update(samples=trainer.padding_stats.samples,
+                          tokens=trainer.padding_stats.tokens,
+                          stall_seconds=stats['train_stall_seconds'])
+        print(f'\npadding ratio = {stats["padding_ratio"]:.3f}, '
+              f'tokens/sec = {stats["train_tokens_per_second"]:.1f}, '
+              f'samples/sec = {stats["train_samples_per_second"]:.1f}, '
+              f'peak memory = {stats["train_peak_memory_mb"]:.0f} MB, '
+              f'dataloader wait = {stats["train_stall_seconds"]:.1f}s')
+        if test_dataset:
+            self.eval(test_dataset, suffix='-train', trainer=trainer)
+
+    def _train(self, trainer_class, train_dataset, eval_dataset,
+               kwargs):
+        """Trains and saves model, returns trainer (see `train`)."""
+        model = self._load_model()
+        if self.gradient_checkpointing:
+            enable_gradient_checkpointing(model)
+        trainer = trainer_class(
+            args=self.args, tokenizer=self.tokeniser, model=model,
             compute_metrics=get_compute_metrics(self.classes),
-            train_dataset=train_dataset, eval_dataset=eval_dataset
+            train_dataset=train_dataset, eval_dataset=eval_dataset,
+            group_by_length=self.group_by_length, max_tokens=self.max_tokens,
+            bf16=self.bf16, **kwargs
         )
         output_dir = Path(self.args.output_dir)
         trainer.train()
+        self.model = trainer.model
         trainer.save_model()
+        if self.max_length:
+            save_truncation_length(output_dir, self.max_length)
         trainer.state.save_to_json(output_dir.joinpath('trainer_state.json'))
-        if test_dataset:
-            self.eval(test_dataset, suffix='-train', trainer=trainer)
+        return trainer
+
+    def use_shards(self, output_dir, bucket_width=8, shard_size=4096) -> dict:
+        """Loads pre-padded tensor shards of tokenised splits, exporting
+        them if missing or stale (see `tensor_shards.load_shards`).
+
+        Args:
+            output_dir: folder of shards of each split
+            bucket_width: padded lengths are rounded up to multiples of it
+            shard_size: maximum number of samples per shard
+
+        Returns:
+            {split: TensorShards}, also set as self.shards.
+        """
+        from tensor_shards import load_shards
+        with stage(self.telemetry, 'export_shards',
+                   samples=sum(map(len, self.data.values()))):
+            self.shards = load_shards(self.tokeniser, self.data, output_dir,
+                                      bucket_width, shard_size)
+        return self.shards
+
+    def train_head(self, cache_dir, train_dataset=None, eval_dataset=None,
+                   test_dataset=None, hidden_size=0, epochs=100, lr=1e-3,
+                   batch_size=256) -> dict:
+        """Trains only a classification head on frozen encoder embeddings.
+
+        Embeddings are computed once per model and dataset and cached (see
+        `frozen_encoder.train_frozen`). If test dataset is provided,
+        classification results are saved into 'test_results-head.txt'.
+
+        Args:
+            cache_dir: folder for embedding files
+            train_dataset: tokenised training dataset ('train' split if None)
+            eval_dataset: tokenised validation dataset ('validation' split if
+            None)
+            test_dataset: tokenised test dataset
+            hidden_size: hidden units of MLP head (logistic regression if 0)
+            epochs: training epochs of head
+            lr: learning rate of head
+            batch_size: training batch size of head
+        """
+        from frozen_encoder import train_frozen
+        if not train_dataset:
+            train_dataset = self.data['train']
+        if not eval_dataset:
+            eval_dataset = self.data['validation']
+        return train_frozen(self, cache_dir, train_dataset, eval_dataset,
+                            test_dataset, hidden_size, epochs, lr, batch_size)
+
+    def _inference_model(self):
+        """Returns self.model in evaluation mode, loading it if necessary
+        (from the pool of self.registry if set)."""
+        if self.model is None:
+            if self.registry is not None:
+                self.model = self.registry.get(self.model_name_or_path,
+                                               self.args.device,
+                                               **self._labels())
+            else:
+                self.model = self._load_model().to(self.args.device)
+        return self.model.eval()
+
+    def _cpu_model(self):
+        """Returns inference model on CPU. Models shared through the pool of
+        self.registry are copied rather than moved, so that other users of
+        the pooled model keep it on its device."""
+        model = self._inference_model()
+        if (self.registry is not None
+                and next(model.parameters()).device.type != 'cpu'):
+            model = copy.deepcopy(model)
+        return model.cpu()
+
+    def _batches(self, dataset, batch_size: int=None, device=None,
+                 indices=False):
+        """Yields (model inputs, label IDs) batches of tokenised dataset.
+
+        Batches of TensorShards are loaded in the order of shards by a
+        ShardLoader, other datasets are padded batch by batch in their order.
+
+        Args:
+            dataset: tokenised dataset with 'label' field, or TensorShards
+            batch_size: evaluation batch size (from self.args if None)
+            device: device of model inputs (from self.args if None)
+            indices: adds array of dataset indices of samples to batches
+        """
+        from tensor_shards import ShardBatches, ShardLoader, TensorShards
+        batch_size = batch_size or self.args.eval_batch_size
+        device = device or self.args.device
+        if isinstance(dataset, TensorShards):
+            for inputs in ShardLoader(ShardBatches(dataset, batch_size,
+                                                   with_index=True)):
+                label_ids = inputs.pop('labels').numpy()
+                index = inputs.pop('index').numpy()
+                inputs = {key: value.to(device, non_blocking=True)
+                          for key, value in inputs.items()}
+                yield (inputs, label_ids, index) if indices else \
+                    (inputs, label_ids)
+            return
+        for start in range(0, len(dataset), batch_size):
+            batch = dataset[start:start + batch_size]
+            inputs = self.tokeniser.pad(
+                {key: batch[key] for key in MODEL_INPUTS if key in batch},
+                return_tensors='pt')
+            inputs = {key: value.to(device) for key, value in inputs.items()}
+            label_ids = np.asarray(batch['label'])
+            if indices:
+                yield inputs, label_ids, np.arange(start,
+                                                   start + len(label_ids))
+            else:
+                yield inputs, label_ids
+
+    def logits(self, dataset, batch_size: int=None) -> np.ndarray:
+        """Returns [len(dataset), number_of_classes] array of model logits.
+
+        Args:
+            dataset: tokenised dataset
+            batch_size: evaluation batch size (from self.args if None)
+        """
+        model = self._inference_model()
+        device = next(model.parameters()).device
+        logits = np.zeros((len(dataset), len(self.classes)), dtype=np.float32)
+        start = 0
+        with torch.no_grad():
+            for inputs, _ in self._batches(dataset, batch_size, device):
+                batch = model(**inputs)[0].cpu().numpy()
+                logits[start:start + len(batch)] = batch
+                start += len(batch)
+        return logits
+
+    def _forward(self, model, inputs):
+        """Returns (logits, number of layers executed per sample or None)."""
+        if self.early_exit is not None:
+            return self.early_exit(model, inputs)
+        return model(**inputs)[0], None
 
     def eval(self, test_dataset, suffix='', trainer=None,
              save_predictions=False):
         """Runs evaluation on tokenised test dataset.
 
         Classification results are saved into 'test_results.txt'. Predicted
-        class labels are saved into 'test_predictions.txt'.
+        class labels are saved into 'test_predictions.txt'. Metrics are
+        accumulated and predictions written batch by batch, so memory use
+        does not grow with the size of test dataset (except for predicted
+        class IDs of TensorShards, which are reordered before saving).
 
         Args:
-            test_dataset: tokenised test dataset
+            test_dataset: tokenised test dataset, or TensorShards (see
+            `use_shards`)
             suffix: optional suffix to append to 'test_results' (eg. '-train'
             will save results into 'test_results-train.txt')
-            trainer: trainer with model, metrics and data_collator provided
+            trainer: trainer with model to evaluate (model from
+            model_name_or_path if None)
             save_predictions: saves predicted class labels
+
+        Returns:
+            {'eval_accuracy': accuracy, 'eval_loss': mean loss,
+             'eval_report': detailed classification report,
+             (optional)'eval_average_layers': mean number of encoder layers
+             executed with self.early_exit}
         """
+        from tensor_shards import TensorShards
         output_dir = Path(self.args.output_dir)
-        if not trainer:
-            trainer = Trainer(
-                model=AutoModelForSequenceClassification.from_pretrained(
-                    self.model_name_or_path, num_labels=len(self.classes)),
-                compute_metrics=get_compute_metrics(
-                    self.classes, save_predictions=save_predictions)
-            )
-        metrics = trainer.predict(test_dataset)[-1]
+        model = trainer.model.eval() if trainer else self._inference_model()
+        device = next(model.parameters()).device
+        matrix = ConfusionMatrix(self.classes)
+        loss = 0.0
+        layers = 0
+        # Batches of shards are not in dataset order
+        predicted = None
+        if save_predictions and isinstance(test_dataset, TensorShards):
+            predicted = np.zeros(len(test_dataset), dtype=np.int64)
+        with ExitStack() as stack:
+            record = stack.enter_context(stage(
+                self.telemetry, 'eval', samples=len(test_dataset), tokens=0))
+            if save_predictions:
+                predictions_file = stack.enter_context(open(
+                    output_dir.joinpath('test_predictions.txt'), 'w'))
+            separator = ''
+            with torch.no_grad():
+                for inputs, label_ids, indices in timed_iter(
+                        self._batches(test_dataset, device=device,
+                                      indices=True), record):
+                    if self.telemetry:
+                        record['tokens'] += int(inputs['attention_mask'].sum())
+                    logits, executed = self._forward(model, inputs)
+                    if executed is not None:
+                        layers += executed.sum().item()
+                    loss += torch.nn.functional.cross_entropy(
+                        logits, torch.as_tensor(label_ids).to(logits.device),
+                        reduction='sum').item()
+                    predictions = logits.argmax(dim=-1).cpu().numpy()
+                    matrix.update(predictions, label_ids)
+                    if predicted is not None:
+                        predicted[indices] = predictions
+                    elif save_predictions:
+                        predictions_file.write(separator + ' '.join(
+                            self.classes[i] for i in predictions))
+                        separator = ' '
+            if predicted is not None:
+                predictions_file.write(' '.join(self.classes[i]
+                                                for i in predicted))
+            if save_predictions:
+                predictions_file.write('\n')
+        with stage(self.telemetry, 'eval_metrics'):
+            metrics = {'eval_accuracy': matrix.accuracy(),
+                       'eval_loss': loss / max(len(test_dataset), 1),
+                       'eval_report': matrix.report()}
+        if self.early_exit is not None:
+            metrics['eval_average_layers'] = layers / max(len(test_dataset), 1)
         print(f'\naccuracy = {metrics["eval_accuracy"]:.3f}')
         with open(output_dir.joinpath(f'test_results{suffix}.txt'),
                   'w') as writer:
             writer.write(f'{metrics["eval_report"]}\n')
-            for key in ['accuracy', 'loss']:
-                result = metrics[f'eval_{key}']
-                writer.write(f'{key} = {result}\n')
-        if save_predictions:
-            with open(output_dir.joinpath('test_predictions.txt'),
-                      'w') as writer:
-                writer.write(' '.join(metrics['eval_predictions']) + '\n')
+            for key in ['accuracy', 'loss', 'average_layers']:
+                if f'eval_{key}' in metrics:
+                    result = metrics[f'eval_{key}']
+                    writer.write(f'{key} = {result}\n')
+        return metrics
+
+    def predict(self, texts: list, batch_size=256, top_k=1):
+        """Classifies raw sentences without Trainer or labels.
+
+        Sentences are tokenised at once, sorted by length and run through the
+        model in batches, so that each batch is padded to similar lengths.
+
+        Args:
+            texts: list of sentences
+            batch_size: number of sentences per forward pass
+            top_k: number of most probable classes returned per sentence
+
+        Returns:
+            ([len(texts), top_k] array of class names,
+             [len(texts), top_k] array of class probabilities), most probable
+            class first. Cosine similarities to class centroids instead of
+            probabilities if self.label_index is set.
+        """
+        if self.label_index is not None:
+            from label_index import predict_nearest
+            return predict_nearest(self, texts, batch_size, top_k)
+        model = self._inference_model()
+        device = next(model.parameters()).device
+        top_k = min(top_k, len(self.classes))
+        input_ids = self.tokeniser(list(texts), truncation=True,
+                                   max_length=self.max_length)['input_ids']
+        order = np.argsort([len(ids) for ids in input_ids], kind='stable')
+        ids = np.zeros((len(input_ids), top_k), dtype=np.int64)
+        scores = np.zeros((len(input_ids), top_k), dtype=np.float32)
+        # inference_mode is only available in newer torch versions
+        no_grad = getattr(torch, 'inference_mode', torch.no_grad)
+        with no_grad():
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                inputs = self.tokeniser.pad(
+                    {'input_ids': [input_ids[i] for i in batch]},
+                    return_tensors='pt')
+                logits, _ = self._forward(
+                    model, {k: v.to(device) for k, v in inputs.items()})
+                probs, classes = torch.softmax(logits, dim=-1).topk(top_k)
+                ids[batch] = classes.cpu().numpy()
+                scores[batch] = probs.cpu().numpy()
+        return np.array(self.classes, dtype=object)[ids], scores
+
+    def build_label_index(self, train_dataset=None, num_lists: int=None,
+                          num_probe=4, batch_size: int=None):
+        """Builds nearest class centroid index used by predict.
+
+        See `label_index.CentroidIndex`.
+
+        Args:
+            train_dataset: tokenised training dataset ('train' split if None)
+            num_lists: number of inverted lists (square root of number of
+            classes if None)
+            num_probe: lists searched per sentence
+            batch_size: evaluation batch size (from self.args if None)
+
+        Returns:
+            CentroidIndex, also set as self.label_index.
+        """
+        from label_index import build_label_index
+        if not train_dataset:
+            train_dataset = self.data['train']
+        self.label_index = build_label_index(self, train_dataset, num_lists,
+                                             num_probe, batch_size)
+        return self.label_index
+
+    def train_exit_heads(self, train_dataset=None, eval_dataset=None,
+                         threshold=0.9, epochs=20, lr=1e-3, cache_dir=None):
+        """Trains early-exit heads on intermediate layers of trained model.
+
+        See `early_exit.EarlyExit`.
+
+        Args:
+            train_dataset: tokenised training dataset ('train' split if None)
+            eval_dataset: tokenised validation dataset ('validation' split if
+            None)
+            threshold: softmax probability needed to exit early
+            epochs: training epochs of each head
+            lr: learning rate of heads
+            cache_dir: folder of temporary memory-mapped layer features
+            (system temporary folder if None)
+
+        Returns:
+            EarlyExit, also set as self.early_exit.
+        """
+        from early_exit import train_exit_heads
+        if not train_dataset:
+            train_dataset = self.data['train']
+        if not eval_dataset:
+            eval_dataset = self.data['validation']
+        self.early_exit = None
+        self.early_exit = train_exit_heads(self, train_dataset, eval_dataset,
+                                           threshold, epochs, lr,
+                                           cache_dir=cache_dir)
+        return self.early_exit
+
+    def load_early_exit(self, path, threshold: float=None):
+        """Loads early-exit heads saved by `EarlyExit.save`.
+
+        Args:
+            path: saved exit heads
+            threshold: overrides saved threshold if not None
+
+        Returns:
+            EarlyExit, also set as self.early_exit.
+        """
+        from early_exit import EarlyExit
+        model = self._inference_model()
+        self.early_exit = EarlyExit.load(
+            path, model.config.hidden_size, len(self.classes),
+            threshold).to(next(model.parameters()).device).eval()
+        return self.early_exit
+
+    def quantise(self, test_dataset=None, tolerance=0.01, output_dir=None,
+                 export_format=None, batch_size=32) -> dict:
+        """Quantises model to dynamic INT8 for CPU inference.
+
+        See `quantise.quantise_classifier`. Results are saved into
+        'quantisation_results.txt'.
+
+        Args:
+            test_dataset: tokenised test dataset ('test' split if None)
+            tolerance: maximum allowed accuracy loss of quantised model
+            output_dir: folder for quantised model
+            export_format: optionally exports quantised model ('torchscript'
+            only)
+            batch_size: batch size for latency measurements
+        """
+        from quantise import quantise_classifier
+        if not test_dataset:
+            test_dataset = self.data['test']
+        return quantise_classifier(self, test_dataset, tolerance, output_dir,
+                                   export_format, batch_size)
+
+    def prune(self, ratios=(0.1, 0.2, 0.3, 0.5), epochs=1, output_dir=None,
+              batch_size=32, eval_dataset=None, test_dataset=None) -> list:
+        """Prunes attention heads and FFN neurons at several ratios.
+
+        See `prune.prune_classifier`. Results are saved into
+        'pruning_results.txt'.
+
+        Args:
+            ratios: fractions of heads and FFN neurons to prune
+            epochs: recovery fine-tuning epochs of each pruned model
+            output_dir: folder of pruned models
+            batch_size: batch size for latency measurements
+            eval_dataset: tokenised dataset for importance scores
+            ('validation' split if None)
+            test_dataset: tokenised test dataset ('test' split if None)
+        """
+        from prune import prune_classifier
+        if not eval_dataset:
+            eval_dataset = self.data['validation']
+        if not test_dataset:
+            test_dataset = self.data['test']
+        return prune_classifier(self, ratios, eval_dataset, test_dataset,
+                                epochs, output_dir, batch_size)
@@ -0,0 +1,200 @@
+"""HTTP server classifying sentences with a trained model.
+
+Concurrent requests are grouped into micro-batches: a batch is run when it
+reaches `max_batch` sentences or `max_latency` milliseconds after its first
+sentence arrived, whichever comes first.
+
+Example:
+    python serve.py models/bert-base-uncased_bank_10epochs --port 8000
+    curl -d '{"text": "my card is lost"}' localhost:8000/predict
+"""
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+import time
+
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from tokenise_data import load_truncation_length
+
+
+class BatchPredictor():
+    """Loads saved model once and classifies micro-batches of sentences."""
+    def __init__(self, model_dir, classes: list=None, top_k=1,
+                 max_batch=32, max_latency=5.0, max_length: int=None):
+        """Constructor.
+
+        Args:
+            model_dir: folder with model and tokeniser saved by
+            `SentenceClassifier.train`
+            classes: list of class names (names in model config if None)
+            top_k: number of most probable classes returned per sentence
+            max_batch: maximum number of sentences per batch
+            max_latency: maximum time in milliseconds a sentence waits for
+            its batch to fill up
+            max_length: truncation length (length saved with model, or the
+            model limit if None)
+        """
+        self.tokeniser = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+        self.model = AutoModelForSequenceClassification.from_pretrained(
+            model_dir).eval()
+        config = self.model.config
+        self.classes = classes or [config.id2label[i]
+                                   for i in range(config.num_labels)]
+        self.top_k = min(top_k, len(self.classes))
+        self.max_batch = max_batch
+        self.max_latency = max_latency / 1000
+        self.max_length = max_length or load_truncation_length(model_dir)
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queues sentence for classification.
+
+        Returns:
+            Future resolving to [(class name, probability)] of `top_k` most
+            probable classes.
+        """
+        future = Future()
+        self._requests.put((text, future))
+        return future
+
+    def predict(self, texts: list) -> list:
+        """Classifies a batch of sentences in the calling thread.
+
+        Returns:
+            [(class name, probability)] of `top_k` classes for each sentence.
+        """
+        inputs = self.tokeniser(texts, padding=True, truncation=True,
+                                max_length=self.max_length,
+                                return_tensors='pt')
+        with torch.no_grad():
+            probs = torch.softmax(self.model(**inputs)[0], dim=-1)
+        scores, ids = probs.topk(self.top_k, dim=-1)
+        return [[(self.classes[i], p) for i, p in zip(row_ids, row_scores)]
+                for row_ids, row_scores in zip(ids.tolist(), scores.tolist())]
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.perf_counter() + self.max_latency
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            texts, futures = zip(*batch)
+            try:
+                results = self.predict(list(texts))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+def make_handler(predictor: BatchPredictor):
+    """Returns request handler class serving predictor.
+
+    POST /predict accepts {"text": str} or {"texts": [str]} and responds with
+    {"predictions": [{"label": str, "probability": float,
+                      "top_k": [[label, probability]]}]}.
+    Requests whose prediction fails get status 500 with {"error": str}.
+    GET /health responds with {"status": "ok"}.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send(200, {'status': 'ok'})
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                texts = request['texts'] if 'texts' in request else [
+                    request['text']]
+                if not isinstance(texts, list):
+                    raise ValueError('texts must be a list of strings')
+                if not all(isinstance(text, str) for text in texts):
+                    raise ValueError('text must be a string')
+            except (KeyError, TypeError, ValueError) as e:
+                self._send(400, {'error': f'invalid request: {e}'})
+                return
+            futures = [predictor.submit(text) for text in texts]
+            predictions = []
+            try:
+                for future in futures:
+                    top_k = future.result()
+                    predictions.append({'label': top_k[0][0],
+                                        'probability': top_k[0][1],
+                                        'top_k': top_k})
+            except Exception as e:  # eg. model error, reported to client
+                self._send(500, {'error': f'prediction failed: {e}'})
+                return
+            self._send(200, {'predictions': predictions})
+
+        def log_message(self, *args):
+            pass  # per-request logging costs more than inference on CPU
+    return Handler
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model_dir', type=str,
+                        help='directory of model saved by train.py')
+    parser.add_argument('--classes', type=str, help='JSON file with list of '
+                        'class names (eg. dataset categories.json) for models '
+                        'saved without class names')
+    parser.add_argument('--host', default='127.0.0.1', help='host to bind')
+    parser.add_argument('--port', type=int, default=8000, help='port to bind')
+    parser.add_argument('--top_k', type=int, default=1,
+                        help='number of most probable classes returned')
+    parser.add_argument('--max_batch', type=int, default=32,
+                        help='maximum number of sentences per batch')
+    parser.add_argument('--max_latency', type=float, default=5.0,
+                        help='milliseconds to wait for a batch to fill up')
+    parser.add_argument('--max_length', type=int,
+                        help='truncation length (length saved with model if '
+                        'not set)')
+    parser.add_argument('--threads', type=int,
+                        help='number of torch CPU threads')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    classes = None
+    if args.classes:
+        with open(args.classes) as fp:
+            classes = json.load(fp)
+    server = ThreadingHTTPServer(
+        (args.host, args.port),
+        make_handler(BatchPredictor(args.model_dir, classes, args.top_k,
+                                    args.max_batch, args.max_latency,
+                                    args.max_length)))
+    print(f'serving {args.model_dir} on http://{args.host}:{args.port}')
+    server.serve_forever()
@@ -0,0 +1,174 @@
+"""Per-stage timing, throughput and memory telemetry.
+
+Stages such as 'create', 'tokenise', 'train' and 'eval' are timed with
+`Telemetry.stage`, which records wall time, samples and tokens per second,
+time spent waiting for batches (dataloader stall), and peak RSS and peak GPU
+memory of the stage. Each record, and each Trainer log during training, is
+appended as a line of JSON to the telemetry file.
+
+`TelemetryCallback` optionally traces a window of training steps with the
+PyTorch profiler into a Chrome trace file (chrome://tracing).
+
+Example:
+    python train.py train bert bank --telemetry models/telemetry.jsonl \
+        --trace_steps 10 20
+"""
+from contextlib import contextmanager, nullcontext
+import json
+from pathlib import Path
+import time
+
+import torch
+from transformers import TrainerCallback
+
+from profiles import (peak_memory_mb, peak_rss_mb, reset_peak_memory,
+                      reset_peak_rss)
+
+
+def timed_iter(iterable, record: dict):
+    """Yields items of iterable, adding time spent waiting for each item to
+    record['stall_seconds']."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record['stall_seconds'] = (record.get('stall_seconds', 0.0)
+                                   + time.perf_counter() - start)
+        yield item
+
+
+class Telemetry():
+    """Records of timed stages, appended to a JSONL file."""
+    def __init__(self, path=None, trace_steps: tuple=None, trace_file=None):
+        """Constructor.
+
+        Args:
+            path: JSONL file of records (records are only kept in memory if
+            None)
+            trace_steps: (first, last) training steps traced with the PyTorch
+            profiler (no trace if None)
+            trace_file: Chrome trace file ('<path>-trace.json' if None)
+        """
+        self.path = Path(path) if path else None
+        self.trace_steps = trace_steps
+        if trace_file is None and trace_steps:
+            trace_file = (self.path.with_name(f'{self.path.stem}-trace.json')
+                          if self.path else Path('trace.json'))
+        self.trace_file = trace_file
+        self.records = []
+        self._stages = []  # records of open stages, innermost last
+
+    def log(self, record: dict):
+        """Adds timestamped record and appends it to the JSONL file."""
+        record = {'time': time.time(), **record}
+        self.records.append(record)
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a') as writer:
+                writer.write(json.dumps(record) + '\n')
+
+    @staticmethod
+    def _update_peaks(state: dict, cuda: bool):
+        """Raises peaks of an open stage to the peaks since last reset."""
+        state['rss_peak'] = max(state['rss_peak'], peak_rss_mb())
+        if cuda:
+            state['gpu_peak'] = max(state['gpu_peak'], peak_memory_mb())
+
+    @contextmanager
+    def stage(self, name: str, **counters):
+        """Times a stage and logs its record on exit.
+
+        The yielded record can be updated inside the stage, eg. with
+        'samples', 'tokens' and 'stall_seconds' counts, which are also
+        converted into rates. Peak RSS and peak GPU memory are reset on entry,
+        so they are peaks of the stage; peaks of nested stages are included
+        in their enclosing stage.
+
+        Args:
+            name: name of stage
+            counters: initial values of record
+        """
+        cuda = torch.cuda.is_available()
+        record = {'stage': name, **counters}
+        if self._stages:
+            self._update_peaks(self._stages[-1], cuda)
+        reset_peak_rss()
+        if cuda:
+            reset_peak_memory()
+        self._stages.append({'rss_peak': 0.0, 'gpu_peak': 0.0})
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            state = self._stages.pop()
+            record['seconds'] = seconds
+            for key in ['samples', 'tokens']:
+                if record.get(key) is not None:
+                    record[f'{key}_per_second'] = record[key] / max(seconds,
+                                                                    1e-9)
+            self._update_peaks(state, cuda)
+            record['peak_rss_mb'] = state['rss_peak']
+            if cuda:
+                record['peak_gpu_mb'] = state['gpu_peak']
+            if self._stages:
+                parent = self._stages[-1]
+                for key in ['rss_peak', 'gpu_peak']:
+                    parent[key] = max(parent[key], state[key])
+            self.log(record)
+
+
+def stage(telemetry, name: str, **counters):
+    """Returns `telemetry.stage(name, **counters)`, or a context yielding an
+    unused record if telemetry is None."""
+    if telemetry is None:
+        return nullcontext(dict(counters))
+    return telemetry.stage(name, **counters)
+
+
+class TelemetryCallback(TrainerCallback):
+    """Logs Trainer logs into telemetry and traces a window of steps."""
+    def __init__(self, telemetry: Telemetry):
+        self.telemetry = telemetry
+        self.profiler = None
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        steps = self.telemetry.trace_steps
+        if steps and self.profiler is None and \
+                state.global_step + 1 == steps[0]:
+            if hasattr(torch, 'profiler'):
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                self.profiler = torch.profiler.profile(
+                    activities=activities, record_shapes=True,
+                    profile_memory=True)
+            else:
+                # torch < 1.8.1
+                self.profiler = torch.autograd.profiler.profile(
+                    use_cuda=torch.cuda.is_available(), record_shapes=True)
+            self.profiler.__enter__()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        steps = self.telemetry.trace_steps
+        if self.profiler is not None and state.global_step >= steps[1]:
+            self._stop_profiler()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.profiler is not None:
+            self._stop_profiler()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        self.telemetry.log({'stage': 'train_log', 'step': state.global_step,
+                            **(logs or {})})
+
+    def _stop_profiler(self):
+        self.profiler.__exit__(None, None, None)
+        trace_file = Path(self.telemetry.trace_file)
+        trace_file.parent.mkdir(parents=True, exist_ok=True)
+        self.profiler.export_chrome_trace(str(trace_file))
+        print(f'profiler trace saved into {trace_file}')
+        self.profiler = None
@@ -0,0 +1,314 @@
+"""Pre-padded tensor shards of tokenised datasets and their data loader.
+
+`export_shards` writes each split of a tokenised dataset into a folder of
+shards. Samples are grouped into buckets by length rounded up to a multiple
+of `bucket_width`, and each bucket is split into shards of at most
+`shard_size` samples, which are padded to the bucket length and saved as one
+int32 NumPy file per field ('input_ids', 'attention_mask' and optional
+'token_type_ids'), with 'label' and dataset 'index' files. 'shards.json'
+lists the shards of a split.
+
+`ShardLoader` memory-maps the shards and slices whole batches out of them in
+background workers, so that training and evaluation steps need no
+per-sample collation or padding. Batches are pinned in memory for faster
+copies to GPU.
+
+Example:
+    python tensor_shards.py bert bank shards/bert_bank --batch 128
+"""
+import json
+from pathlib import Path
+import random
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from length_sampler import TimedDataLoader
+
+
+MANIFEST = 'shards.json'
+SHARD_WORKERS = 2  # background workers of ShardLoader
+
+
+def export_split(tokeniser, dataset, output_dir, bucket_width=8,
+                 shard_size=4096):
+    """Writes tokenised dataset as pre-padded shards (see module docstring).
+
+    Args:
+        tokeniser: tokeniser of dataset (for padding values and side)
+        dataset: tokenised dataset with 'input_ids' and 'label' fields
+        output_dir: folder of shards
+        bucket_width: padded lengths are rounded up to multiples of it
+        shard_size: maximum number of samples per shard
+
+    Returns:
+        TensorShards of output_dir.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    columns = {'input_ids': dataset['input_ids']}
+    pad_values = {'input_ids': tokeniser.pad_token_id, 'attention_mask': 0}
+    if 'token_type_ids' in dataset.column_names:
+        columns['token_type_ids'] = dataset['token_type_ids']
+        pad_values['token_type_ids'] = tokeniser.pad_token_type_id
+    lengths = np.array([len(ids) for ids in columns['input_ids']])
+    columns['attention_mask'] = [[1] * length for length in lengths]
+    labels = np.asarray(dataset['label'], dtype=np.int64)
+    padded = -(-lengths // bucket_width) * bucket_width
+    left = tokeniser.padding_side == 'left'
+    shards = []
+    for length in np.unique(padded):
+        indices = np.flatnonzero(padded == length)
+        for start in range(0, len(indices), shard_size):
+            rows = indices[start:start + shard_size]
+            name = f'{length:04d}-{start // shard_size:04d}'
+            for field, values in columns.items():
+                array = np.full((len(rows), length), pad_values[field],
+                                dtype=np.int32)
+                for row, i in enumerate(rows):
+                    if left:
+                        array[row, length - len(values[i]):] = values[i]
+                    else:
+                        array[row, :len(values[i])] = values[i]
+                np.save(output_dir.joinpath(f'{name}-{field}.npy'), array)
+            np.save(output_dir.joinpath(f'{name}-label.npy'), labels[rows])
+            np.save(output_dir.joinpath(f'{name}-index.npy'), rows)
+            shards.append({'name': name, 'length': int(length),
+                           'size': len(rows)})
+    tokens = int(lengths.sum())
+    padded_tokens = int(sum(s['length'] * s['size'] for s in shards))
+    manifest = {'fields': list(columns), 'num_samples': len(dataset),
+                'fingerprint': getattr(dataset, '_fingerprint', None),
+                'padding_ratio': 1 - tokens / max(padded_tokens, 1),
+                'shards': shards}
+    output_dir.joinpath(MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return TensorShards(output_dir)
+
+
+def export_shards(tokeniser, data, output_dir, bucket_width=8,
+                  shard_size=4096) -> dict:
+    """Writes each split of tokenised DatasetDict into output_dir/<split>.
+
+    See `export_split` for arguments.
+
+    Returns:
+        {split: TensorShards}
+    """
+    shards = {}
+    for split, dataset in data.items():
+        shards[split] = export_split(tokeniser, dataset,
+                                     Path(output_dir).joinpath(split),
+                                     bucket_width, shard_size)
+        print(f'{split}: {len(shards[split].shards)} shards, padding ratio '
+              f'{shards[split].padding_ratio:.3f}')
+    return shards
+
+
+def load_shards(tokeniser, data, output_dir, bucket_width=8,
+                shard_size=4096) -> dict:
+    """Returns {split: TensorShards} of output_dir, exporting splits that are
+    missing or were exported from different tokenised data (see
+    `export_split` for arguments)."""
+    shards = {}
+    for split, dataset in data.items():
+        path = Path(output_dir).joinpath(split)
+        if path.joinpath(MANIFEST).exists():
+            shards[split] = TensorShards(path)
+            fingerprint = getattr(dataset, '_fingerprint', None)
+            if fingerprint and shards[split].fingerprint == fingerprint:
+                continue
+        shards[split] = export_split(tokeniser, dataset, path, bucket_width,
+                                     shard_size)
+    return shards
+
+
+class TensorShards():
+    """Pre-padded shards of a split, memory-mapped on first use."""
+    def __init__(self, path):
+        """Constructor.
+
+        Args:
+            path: folder written by `export_split`
+        """
+        self.path = Path(path)
+        manifest = json.loads(self.path.joinpath(MANIFEST).read_text())
+        self.fields = manifest['fields']
+        self.num_samples = manifest['num_samples']
+        self.fingerprint = manifest['fingerprint']
+        self.padding_ratio = manifest['padding_ratio']
+        self.shards = manifest['shards']
+        self._arrays = {}  # shard: {field: memory-mapped array}
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getstate__(self):
+        # Memory maps are reopened by DataLoader workers, not pickled
+        return {**self.__dict__, '_arrays': {}}
+
+    def arrays(self, shard: int) -> dict:
+        """Returns {field: memory-mapped array} of shard, including 'label'
+        and 'index'."""
+        if shard not in self._arrays:
+            name = self.shards[shard]['name']
+            self._arrays[shard] = {
+                field: np.load(self.path.joinpath(f'{name}-{field}.npy'),
+                               mmap_mode='r')
+                for field in self.fields + ['label', 'index']}
+        return self._arrays[shard]
+
+    def batch_plan(self, batch_size: int, shuffle=False, seed=0) -> list:
+        """Returns [(shard, row indices)] of batches.
+
+        Args:
+            batch_size: maximum samples per batch (batches do not cross
+            shards)
+            shuffle: shuffles samples within shards and order of batches
+            seed: random seed of shuffling
+        """
+        rng = random.Random(seed)
+        plan = []
+        for shard, entry in enumerate(self.shards):
+            rows = list(range(entry['size']))
+            if shuffle:
+                rng.shuffle(rows)
+            plan.extend((shard, rows[start:start + batch_size])
+                        for start in range(0, len(rows), batch_size))
+        if shuffle:
+            rng.shuffle(plan)
+        return plan
+
+    def batch(self, shard: int, rows: list, with_index=False) -> dict:
+        """Returns {field: tensor} of rows of shard, with int64 'input_ids'
+        and 'labels', and dataset indices as 'index' if with_index."""
+        arrays = self.arrays(shard)
+        if rows == list(range(rows[0], rows[0] + len(rows))):
+            rows = slice(rows[0], rows[0] + len(rows))  # contiguous read
+        batch = {field: torch.from_numpy(arrays[field][rows].astype(np.int64))
+                 for field in self.fields}
+        batch['labels'] = torch.from_numpy(np.array(arrays['label'][rows]))
+        if with_index:
+            batch['index'] = torch.from_numpy(np.array(arrays['index'][rows]))
+        return batch
+
+
+class ShardBatches(IterableDataset):
+    """Batches of TensorShards, split between DataLoader workers."""
+    def __init__(self, shards: TensorShards, batch_size: int, shuffle=False,
+                 seed=0, with_index=False):
+        """Constructor.
+
+        Args:
+            shards: shards of a split
+            batch_size: maximum samples per batch
+            shuffle: shuffles samples within shards and order of batches,
+            differently every epoch
+            seed: random seed, incremented every epoch
+            with_index: adds dataset indices of samples to batches as 'index'
+        """
+        self.shards = shards
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.with_index = with_index
+        self.epoch = 0
+
+    @property
+    def num_samples(self) -> int:
+        return len(self.shards)
+
+    def __len__(self):
+        return sum(-(-entry['size'] // self.batch_size)
+                   for entry in self.shards.shards)
+
+    def __iter__(self):
+        plan = self.shards.batch_plan(self.batch_size, self.shuffle,
+                                      self.seed + self.epoch)
+        worker = get_worker_info()
+        if worker is not None:
+            # Workers are polled in turn, so batches keep the plan order
+            plan = plan[worker.id::worker.num_workers]
+        for shard, rows in plan:
+            yield self.shards.batch(shard, rows, self.with_index)
+
+
+class ShardLoader(TimedDataLoader):
+    """Prefetching DataLoader of ShardBatches (batches are not collated).
+
+    Time spent waiting for batches is added to stats['stall_seconds'].
+    """
+    def __init__(self, batches: ShardBatches, num_workers=SHARD_WORKERS,
+                 pin_memory: bool=None, stats: dict=None):
+        """Constructor.
+
+        Args:
+            batches: batches of shards
+            num_workers: background workers (batches are loaded in the main
+            process if 0)
+            pin_memory: pins batches in memory (if CUDA is available if None)
+            stats: dict updated with 'stall_seconds'
+        """
+        if pin_memory is None:
+            pin_memory = torch.cuda.is_available()
+        super().__init__(batches, batch_size=None, num_workers=num_workers,
+                         pin_memory=pin_memory, stats=stats)
+        self.epoch = 0
+
+    def __iter__(self):
+        # Set before workers are started, as they get a copy of the dataset
+        self.dataset.epoch = self.epoch
+        self.epoch += 1
+        return super().__iter__()
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from transformers import AutoTokenizer, DataCollatorWithPadding
+
+    from sentence_classifier import PRETRAINED
+    from tokenise_data import tokenise_data
+    from train import DATASETS
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('model', type=str, help='Huggingface pretrained model '
+                        'or path to saved model on disk')
+    parser.add_argument('dataset', choices=list(DATASETS),
+                        help='dataset to export')
+    parser.add_argument('output_dir', type=str, help='folder of shards')
+    parser.add_argument('--bucket_width', type=int, default=8,
+                        help='padded lengths are multiples of it')
+    parser.add_argument('--shard_size', type=int, default=4096,
+                        help='maximum samples per shard')
+    parser.add_argument('--batch', type=int, default=128,
+                        help='batch size of loader comparison')
+    parser.add_argument('--workers', type=int, default=SHARD_WORKERS,
+                        help='background workers of loaders')
+    args = parser.parse_args()
+    tokeniser = AutoTokenizer.from_pretrained(
+        PRETRAINED.get(args.model, args.model), use_fast=True)
+    data = tokenise_data(tokeniser, DATASETS[args.dataset].load())
+    start = time.perf_counter()
+    shards = export_shards(tokeniser, data, args.output_dir,
+                           args.bucket_width, args.shard_size)
+    print(f'exported in {time.perf_counter() - start:.1f}s')
+    # Time spent waiting for one epoch of training batches
+    train = data['train'].remove_columns(
+        [c for c in data['train'].column_names
+         if c not in ['input_ids', 'attention_mask', 'token_type_ids',
+                      'label']])
+    loaders = {
+        'collated': TimedDataLoader(
+            train, batch_size=args.batch, shuffle=True,
+            collate_fn=DataCollatorWithPadding(tokeniser),
+            num_workers=args.workers),
+        'shards': ShardLoader(ShardBatches(shards['train'], args.batch,
+                                           shuffle=True), args.workers)}
+    for name, loader in loaders.items():
+        for _ in loader:
+            pass
+        print(f'{name:>8}: {loader.stats["stall_seconds"]:.3f}s waiting '
+              f'for {len(loader)} batches')
@@ -0,0 +1,36 @@
+"""Tests for polyai_dataset.arrow_csv."""
+import csv
+from pathlib import Path
+import tempfile
+import unittest
+
+import pyarrow as pa
+
+from polyai_dataset.arrow_csv import encode_labels, read_label_ids
+
+
+class TestArrowCsv(unittest.TestCase):
+    def setUp(self):
+        self.names = ['a', 'b', 'c']
+
+    def test_encode_labels(self):
+        labels = pa.array(['c', 'a', 'c', 'b'])
+        self.assertEqual([2, 0, 2, 1],
+                         encode_labels(labels, self.names).tolist())
+
+    def test_encode_labels_invalid_name(self):
+        """Raises ValueError."""
+        with self.assertRaises(ValueError):
+            encode_labels(pa.array(['a', 'd']), self.names)
+
+    def test_read_label_ids(self):
+        labels = ['b', 'a', 'c', 'a'] * 50
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = Path(tmp_dir).joinpath('train.csv')
+            with open(filepath, 'w', newline='') as fp:
+                writer = csv.writer(fp)
+                writer.writerow(['text', 'category'])
+                for i, label in enumerate(labels):
+                    writer.writerow([f'text, "quoted"\n{i}', label])
+            ids = read_label_ids(filepath, self.names)
+        self.assertEqual([self.names.index(c) for c in labels], ids.tolist())
@@ -0,0 +1,77 @@
+"""Tests for distil."""
+from pathlib import Path
+import tempfile
+from types import SimpleNamespace
+import unittest
+
+from datasets import Dataset
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from distil import (DistillationTrainer, TEACHER_LOGITS, add_teacher_logits,
+                    teacher_logits)
+
+
+class TestDistil(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.logits = torch.randn(4, 3)
+        self.labels = torch.tensor([0, 2, 1, 2])
+        self.trainer = DistillationTrainer.__new__(DistillationTrainer)
+        self.trainer.alpha = 0.25
+        self.trainer.temperature = 2.0
+
+    def model(self, labels, **kwargs):
+        return {'loss': F.cross_entropy(self.logits, labels),
+                'logits': self.logits}
+
+    def test_add_teacher_logits(self):
+        dataset = Dataset.from_dict({'label': [0, 1, 2]})
+        logits = np.arange(6, dtype=np.float32).reshape(3, 2)
+        result = add_teacher_logits(dataset, logits)
+        self.assertEqual(logits.tolist(), result[TEACHER_LOGITS])
+        with self.assertRaises(ValueError):
+            add_teacher_logits(dataset, logits[:2])
+
+    def test_loss_mixes_cross_entropy_and_kl(self):
+        teacher = torch.randn(4, 3)
+        loss = self.trainer.compute_loss(
+            self.model, {'labels': self.labels, TEACHER_LOGITS: teacher})
+        t = self.trainer.temperature
+        teacher_probs = torch.softmax(teacher / t, dim=-1)
+        kl = (teacher_probs * (teacher_probs.log() - torch.log_softmax(
+            self.logits / t, dim=-1))).sum(-1).mean()
+        expected = (0.25 * F.cross_entropy(self.logits, self.labels)
+                    + 0.75 * t ** 2 * kl)
+        self.assertAlmostEqual(expected.item(), loss.item(), places=5)
+
+    def test_loss_is_cross_entropy_without_teacher(self):
+        cross_entropy = F.cross_entropy(self.logits, self.labels)
+        loss = self.trainer.compute_loss(self.model, {'labels': self.labels})
+        self.assertAlmostEqual(cross_entropy.item(), loss.item(), places=6)
+        loss = self.trainer.compute_loss(
+            self.model, {'labels': self.labels,
+                         TEACHER_LOGITS: self.logits.clone()})
+        self.assertAlmostEqual(0.25 * cross_entropy.item(), loss.item(),
+                               places=5)
+
+    def test_teacher_logits_are_keyed_by_teacher_weights(self):
+        dataset = Dataset.from_dict({'input_ids': [[1, 2], [3]]})
+        with tempfile.TemporaryDirectory() as model_dir:
+            weights = Path(model_dir).joinpath('pytorch_model.bin')
+            weights.write_bytes(b'teacher')
+            calls = []
+
+            def logits(data):
+                calls.append(len(data))
+                return np.full((len(data), 2), len(calls), dtype=np.float32)
+            teacher = SimpleNamespace(model_name_or_path=model_dir,
+                                      logits=logits)
+            first = teacher_logits(teacher, dataset)
+            self.assertEqual(first.tolist(),
+                             teacher_logits(teacher, dataset).tolist())
+            self.assertEqual(1, len(calls))
+            weights.write_bytes(b'retrained teacher')
+            self.assertEqual([[2, 2], [2, 2]],
+                             teacher_logits(teacher, dataset).tolist())
@@ -0,0 +1,70 @@
+"""Tests for early_exit."""
+import tempfile
+from types import SimpleNamespace
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import BertConfig, BertForSequenceClassification
+
+from early_exit import EarlyExit, layer_features
+from label_index import masked_mean
+
+
+class TestEarlyExit(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size=50, hidden_size=16, num_hidden_layers=3,
+                            num_attention_heads=2, intermediate_size=32,
+                            num_labels=4)
+        self.model = BertForSequenceClassification(config).eval()
+        self.inputs = {'input_ids': torch.randint(50, (5, 7)),
+                       'attention_mask': torch.ones(5, 7, dtype=torch.long)}
+        self.inputs['attention_mask'][0, 4:] = 0
+        self.early_exit = EarlyExit(16, 4, 3)
+
+    def test_no_exit_matches_model(self):
+        self.early_exit.threshold = 1.1
+        with torch.no_grad():
+            logits, layers = self.early_exit(self.model, self.inputs)
+            expected = self.model(**self.inputs)[0]
+        self.assertTrue(torch.allclose(expected, logits, atol=1e-5))
+        self.assertEqual([3] * 5, layers.tolist())
+
+    def test_exit_at_first_layer(self):
+        self.early_exit.threshold = 0.0
+        with torch.no_grad():
+            _, layers = self.early_exit(self.model, self.inputs)
+        self.assertEqual([1] * 5, layers.tolist())
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp).joinpath('exit_heads.bin')
+            self.early_exit.save(path)
+            loaded = EarlyExit.load(path, 16, 4, threshold=0.5)
+        self.assertEqual(0.5, loaded.threshold)
+        self.assertEqual(2, len(loaded.heads))
+        self.assertTrue(torch.equal(self.early_exit.heads[0].weight,
+                                    loaded.heads[0].weight))
+
+    def test_layer_features_are_memory_mapped(self):
+        batches = [({k: v[:3] for k, v in self.inputs.items()}, None),
+                   ({k: v[3:] for k, v in self.inputs.items()}, None)]
+        classifier = SimpleNamespace(
+            _inference_model=lambda: self.model,
+            _batches=lambda dataset, batch_size, device: iter(batches))
+        with torch.no_grad():
+            hidden_states = self.model.base_model(
+                **self.inputs, output_hidden_states=True,
+                return_dict=True).hidden_states
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            features = layer_features(classifier, [None] * 5,
+                                      Path(tmp_dir).joinpath('train.npy'))
+            self.assertIsInstance(features, np.memmap)
+            self.assertEqual((2, 5, 16), features.shape)
+            for i, hidden in enumerate(hidden_states[1:-1]):
+                np.testing.assert_allclose(
+                    masked_mean(hidden, self.inputs['attention_mask']),
+                    features[i], atol=1e-6)
+            del features
@@ -0,0 +1,46 @@
+"""Tests for eval_accuracy."""
+import unittest
+
+import numpy as np
+from sklearn.metrics import accuracy_score, classification_report
+
+from eval_accuracy import ConfusionMatrix, eval_accuracy
+
+
+class TestConfusionMatrix(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.classes = ['card_lost', 'balance', 'top_up', 'exchange_rate']
+        self.label_ids = rng.randint(len(self.classes), size=500)
+        self.predictions = np.where(
+            rng.rand(500) < 0.7, self.label_ids,
+            rng.randint(len(self.classes), size=500))
+
+    def test_report_matches_classification_report(self):
+        matrix = ConfusionMatrix(self.classes)
+        matrix.update(self.predictions, self.label_ids)
+        expected = classification_report(
+            self.label_ids, self.predictions, digits=3,
+            target_names=self.classes)
+        self.assertEqual(expected, matrix.report())
+
+    def test_update_in_batches_equals_single_update(self):
+        single = ConfusionMatrix(self.classes)
+        single.update(self.predictions, self.label_ids)
+        batched = ConfusionMatrix(self.classes)
+        for start in range(0, len(self.label_ids), 64):
+            batched.update(self.predictions[start:start + 64],
+                           self.label_ids[start:start + 64])
+        np.testing.assert_array_equal(single.matrix, batched.matrix)
+        self.assertAlmostEqual(
+            accuracy_score(self.label_ids, self.predictions),
+            batched.accuracy())
+
+    def test_eval_accuracy_from_logits(self):
+        logits = np.eye(len(self.classes))[self.predictions]
+        result = eval_accuracy(logits, self.label_ids, self.classes,
+                               save_predictions=True)
+        self.assertAlmostEqual(
+            accuracy_score(self.label_ids, self.predictions),
+            result['accuracy'])
+        np.testing.assert_array_equal(self.predictions, result['predictions'])
@@ -0,0 +1,80 @@
+"""Tests for frozen_encoder."""
+import tempfile
+from types import SimpleNamespace
+import unittest
+
+from datasets import Dataset
+import numpy as np
+import torch
+from transformers import BertConfig, BertForSequenceClassification
+
+from frozen_encoder import (create_head, head_logits, saved_classifier,
+                            train_frozen, train_head)
+
+
+class Classifier():
+    """SentenceClassifier counting model loads."""
+    def __init__(self, output_dir):
+        self.model_name_or_path = 'bert'
+        self.model = None
+        self.loads = []
+        self.classes = ['a', 'b']
+        self.args = SimpleNamespace(device='cpu', seed=0,
+                                    output_dir=output_dir)
+        torch.manual_seed(0)
+        self.saved = BertForSequenceClassification(BertConfig(
+            vocab_size=50, hidden_size=8, num_hidden_layers=1,
+            num_attention_heads=2, intermediate_size=16)).eval()
+
+    def _inference_model(self):
+        if self.model is None:
+            self.loads.append(self.model_name_or_path)
+            self.model = self.saved
+        return self.model
+
+    def _batches(self, dataset, batch_size=None, device=None):
+        ids = torch.tensor(dataset['input_ids'])
+        yield {'input_ids': ids, 'attention_mask': torch.ones_like(ids)}, None
+
+
+class TestFrozenEncoder(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        centres = rng.randn(4, 8).astype(np.float32)
+        self.labels = rng.randint(4, size=400)
+        self.embeddings = (centres[self.labels]
+                           + 0.1 * rng.randn(400, 8).astype(np.float32))
+
+    def test_create_head(self):
+        self.assertIsInstance(create_head(8, 4), torch.nn.Linear)
+        head = create_head(8, 4, hidden_size=16)
+        self.assertEqual((3, 4), head_logits(head, self.embeddings[:3]).shape)
+
+    def test_train_head_selects_best_epoch(self):
+        head = create_head(8, 4)
+        result = train_head(head, self.embeddings[:300], self.labels[:300],
+                            self.embeddings[300:], self.labels[300:],
+                            epochs=20, lr=1e-2, batch_size=32)
+        predictions = head_logits(head, self.embeddings[300:]).argmax(axis=1)
+        accuracy = np.mean(predictions == self.labels[300:])
+        self.assertGreater(result['eval_accuracy'], 0.95)
+        self.assertAlmostEqual(result['eval_accuracy'], accuracy)
+
+    def test_saved_classifier_reloads_model(self):
+        classifier = SimpleNamespace(model_name_or_path='bert',
+                                     model='fine-tuned')
+        saved = saved_classifier(classifier)
+        self.assertIsNone(saved.model)
+        self.assertEqual('bert', saved.model_name_or_path)
+        self.assertEqual('fine-tuned', classifier.model)
+
+    def test_train_frozen_loads_saved_model_once(self):
+        splits = [Dataset.from_dict({'input_ids': [[i, 2, 3], [4, i, 6]],
+                                     'label': [0, 1]}) for i in [7, 8, 9]]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            classifier = Classifier(tmp_dir)
+            train_frozen(classifier, tmp_dir, *splits, epochs=1)
+            self.assertEqual(['bert'], classifier.loads)
+            classifier.loads.clear()
+            train_frozen(classifier, tmp_dir, *splits, epochs=1)
+            self.assertEqual([], classifier.loads)  # embeddings are cached
@@ -0,0 +1,58 @@
+"""Tests for polyai_dataset.intent_dataset."""
+import csv
+import json
+from pathlib import Path
+import tempfile
+import unittest
+
+from polyai_dataset.banking77 import Banking77
+from polyai_dataset.intent_dataset import resolve_files
+
+
+class TestIntentDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self.tmp_dir.name).joinpath('data')
+        self.cache_dir = Path(self.tmp_dir.name).joinpath('cache')
+        self.data_dir.mkdir()
+        self.classes = ['a', 'b', 'c']
+        with open(self.data_dir.joinpath('categories.json'), 'w') as fp:
+            json.dump(self.classes, fp)
+        files = ['train_0.csv', 'train_1.csv', 'test.csv']
+        for i, name in enumerate(files):
+            with open(self.data_dir.joinpath(name), 'w', newline='') as fp:
+                writer = csv.writer(fp)
+                writer.writerow(['text', 'category'])
+                for j in range(30):
+                    writer.writerow([f'text, {i} {j}', self.classes[j % 3]])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def load(self, **kwargs):
+        return Banking77.load(
+            self.data_dir, cache_dir=str(self.cache_dir),
+            split_files={'train': 'train_*.csv', 'test': 'test.csv'}, **kwargs)
+
+    def test_resolve_files_invalid_pattern(self):
+        """Raises FileNotFoundError."""
+        with self.assertRaises(FileNotFoundError):
+            resolve_files(self.data_dir, ['train_*.csv', 'val*.csv'])
+
+    def test_load_reads_shards_in_order(self):
+        data = self.load(num_workers=2)
+        self.assertEqual(48, len(data['train']))
+        self.assertEqual(12, len(data['validation']))
+        self.assertEqual(30, len(data['test']))
+        self.assertEqual('text, 0 0', data['validation'][0]['text'])
+        self.assertEqual('text, 1 29', data['train'][-1]['text'])
+        self.assertEqual(self.classes, data['train'].features['label'].names)
+
+    def test_load_uses_prepared_dataset(self):
+        data = self.load()
+        prepared = list(self.cache_dir.joinpath('prepared').iterdir())
+        self.assertEqual(1, len(prepared))
+        self.assertEqual(data['train'][:], self.load()['train'][:])
+        self.load(val_strategy='random', seed=1)
+        prepared = list(self.cache_dir.joinpath('prepared').iterdir())
+        self.assertEqual(2, len(prepared))
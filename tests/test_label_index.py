@@ -0,0 +1,58 @@
+"""Tests for label_index."""
+from pathlib import Path
+import tempfile
+import unittest
+
+import numpy as np
+
+from label_index import CentroidIndex, class_centroids, normalise
+
+
+class TestCentroidIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.centroids = normalise(rng.randn(400, 16).astype(np.float32))
+        self.queries = normalise(
+            self.centroids[rng.randint(400, size=200)]
+            + 0.05 * rng.randn(200, 16).astype(np.float32))
+        self.exact = np.argsort(-(self.queries @ self.centroids.T), axis=1)
+
+    def test_exhaustive_search_matches_brute_force(self):
+        index = CentroidIndex(self.centroids, num_lists=20, num_probe=20)
+        ids, scores = index.search(self.queries, top_k=5)
+        self.assertEqual(self.exact[:, :5].tolist(), ids.tolist())
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+    def test_approximate_search_finds_nearest_class(self):
+        index = CentroidIndex(self.centroids, num_probe=4)
+        self.assertEqual(20, len(index.list_centres))
+        ids, _ = index.search(self.queries)
+        recall = np.mean(ids[:, 0] == self.exact[:, 0])
+        self.assertGreater(recall, 0.9)
+
+    def test_save_and_load(self):
+        index = CentroidIndex(self.centroids)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath('index.npz')
+            index.save(path)
+            loaded = CentroidIndex.load(path)
+        for expected, result in zip(index.search(self.queries, 3),
+                                    loaded.search(self.queries, 3)):
+            np.testing.assert_array_equal(expected, result)
+
+    def test_class_centroids(self):
+        embeddings = np.array([[1, 0], [0, 1], [3, 0]], dtype=np.float32)
+        centroids = class_centroids(embeddings, np.array([0, 0, 2]), 3)
+        np.testing.assert_allclose(
+            [[2 ** -0.5, 2 ** -0.5], [0, 0], [1, 0]], centroids, rtol=1e-6)
+
+    def test_search_probes_more_lists_for_top_k(self):
+        index = CentroidIndex(self.centroids, num_lists=100, num_probe=1)
+        ids, scores = index.search(self.queries, top_k=30)
+        self.assertTrue(np.all(ids >= 0))
+        self.assertTrue(np.all(np.isfinite(scores)))
+        for row in ids:
+            self.assertEqual(30, len(set(row.tolist())))
+        ids, _ = index.search(self.queries[:3], top_k=400)
+        self.assertEqual([list(range(400))] * 3,
+                         np.sort(ids, axis=1).tolist())
@@ -0,0 +1,84 @@
+"""Tests for length_sampler."""
+import random
+import tempfile
+import time
+import unittest
+
+import torch
+from transformers import (BertConfig, BertForSequenceClassification,
+                          TrainingArguments)
+
+from length_sampler import BucketedTrainer, LengthGroupedBatchSampler
+
+
+class TestLengthGroupedBatchSampler(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.lengths = [rng.randint(3, 60) for _ in range(1000)]
+
+    def test_batches_cover_all_samples_once(self):
+        for max_tokens in [None, 512]:
+            with self.subTest(max_tokens=max_tokens):
+                sampler = LengthGroupedBatchSampler(
+                    self.lengths, 32, max_tokens, mega_batch=4)
+                indices = [i for batch in sampler for i in batch]
+                self.assertEqual(list(range(len(self.lengths))),
+                                 sorted(indices))
+
+    def test_len_is_number_of_batches(self):
+        for max_tokens in [None, 512]:
+            with self.subTest(max_tokens=max_tokens):
+                sampler = LengthGroupedBatchSampler(
+                    self.lengths, 32, max_tokens)
+                self.assertEqual(len(sampler), len(list(sampler)))
+
+    def test_max_tokens_limits_padded_tokens(self):
+        sampler = LengthGroupedBatchSampler(self.lengths, 32, max_tokens=512)
+        for batch in sampler:
+            longest = max(self.lengths[i] for i in batch)
+            self.assertLessEqual(len(batch) * longest, 512)
+
+    def test_grouping_reduces_padding(self):
+        def padding(batches):
+            return sum(len(batch) * max(self.lengths[i] for i in batch)
+                       - sum(self.lengths[i] for i in batch)
+                       for batch in batches)
+        sampler = LengthGroupedBatchSampler(self.lengths, 32, mega_batch=8)
+        indices = list(range(len(self.lengths)))
+        random.Random(0).shuffle(indices)
+        shuffled = [indices[i:i + 32] for i in range(0, len(indices), 32)]
+        self.assertLess(padding(sampler), padding(shuffled))
+
+    def test_epochs_are_shuffled_differently(self):
+        sampler = LengthGroupedBatchSampler(self.lengths, 32)
+        self.assertNotEqual(list(sampler), list(sampler))
+
+
+class TestBucketedTrainer(unittest.TestCase):
+    def test_throughput_excludes_evaluation(self):
+        torch.manual_seed(0)
+        model = BertForSequenceClassification(BertConfig(
+            vocab_size=50, hidden_size=16, num_hidden_layers=1,
+            num_attention_heads=2, intermediate_size=32, num_labels=2))
+        dataset = [{'input_ids': [2, i % 40 + 5, 3], 'labels': i % 2}
+                   for i in range(32)]
+
+        def compute_metrics(predictions):
+            time.sleep(0.5)
+            return {'accuracy': 0.0}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            args = TrainingArguments(
+                output_dir=tmp_dir, num_train_epochs=2, no_cuda=True,
+                per_device_train_batch_size=8, evaluation_strategy='epoch',
+                disable_tqdm=True)
+            trainer = BucketedTrainer(
+                model=model, args=args, train_dataset=dataset,
+                eval_dataset=dataset[:4], compute_metrics=compute_metrics)
+            start = time.perf_counter()
+            trainer.train()
+            elapsed = time.perf_counter() - start
+        stats = trainer.state.log_history[-1]
+        self.assertGreaterEqual(trainer.eval_seconds, 1.0)
+        self.assertEqual(64, trainer.padding_stats.samples)
+        self.assertGreater(stats['train_samples_per_second'],
+                           1.5 * 64 / elapsed)
@@ -0,0 +1,71 @@
+"""Tests for model_registry."""
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification
+
+from model_registry import ModelRegistry, config_hash, model_bytes
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        for name, num_labels in [('a', 2), ('b', 3)]:
+            config = BertConfig(vocab_size=50, hidden_size=16,
+                                num_hidden_layers=1, num_attention_heads=2,
+                                intermediate_size=32, num_labels=num_labels)
+            BertForSequenceClassification(config).save_pretrained(
+                str(self.root.joinpath(name)))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_index_and_find(self):
+        registry = ModelRegistry(self.root)
+        entries = registry.index()
+        self.assertEqual({str(self.root.joinpath(name)) for name in 'ab'},
+                         set(entries))
+        self.assertEqual([str(self.root.joinpath('b'))],
+                         registry.find(num_labels=3))
+        digest = config_hash(self.root.joinpath('a'))
+        self.assertEqual([str(self.root.joinpath('a'))],
+                         registry.find(config_hash=digest))
+
+    def test_warm_model_is_reused(self):
+        registry = ModelRegistry(self.root)
+        path = self.root.joinpath('a')
+        model = registry.get(path)
+        self.assertIs(model, registry.get(path))
+        self.assertEqual(['cold', 'warm'],
+                         [kind for _, kind, _ in registry.load_times])
+
+    def test_least_recently_used_model_is_evicted(self):
+        registry = ModelRegistry(self.root)
+        size = model_bytes(registry.get(self.root.joinpath('a')))
+        registry.max_memory = int(size * 1.5)
+        registry.get(self.root.joinpath('b'))
+        self.assertEqual(1, registry.evictions)
+        self.assertEqual(1, len(registry.pool))
+
+    def test_loaded_model_has_saved_weights(self):
+        path = self.root.joinpath('a')
+        saved = BertForSequenceClassification.from_pretrained(str(path))
+        loaded = ModelRegistry(self.root).get(path)
+        expected = saved.state_dict()
+        for name, tensor in loaded.state_dict().items():
+            self.assertTrue(torch.equal(expected[name], tensor), name)
+
+    def test_pooled_model_is_copied_to_cpu(self):
+        from sentence_classifier import SentenceClassifier
+        registry = ModelRegistry(self.root)
+        pooled = registry.get(self.root.joinpath('a'))
+        # Pretends the pooled model is on a GPU
+        pooled.parameters = lambda: iter([torch.zeros(1, device='meta')])
+        classifier = SentenceClassifier.__new__(SentenceClassifier)
+        classifier.model, classifier.registry = pooled, registry
+        self.assertIsNot(pooled, classifier._cpu_model())
+        classifier.registry = None
+        self.assertIs(pooled, classifier._cpu_model())
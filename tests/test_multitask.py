@@ -0,0 +1,100 @@
+"""Tests for multitask."""
+import os
+import tempfile
+import unittest
+
+from datasets import Dataset
+import torch
+import torch.nn.functional as F
+from transformers import AutoTokenizer, BertConfig, BertModel
+
+from benchmarks.run_benchmarks import write_tiny_model
+from multitask import (MultiTaskClassifier, MultiTaskModel, MultiTaskTrainer,
+                       TASK_ID, confusion_matrices, predict_and_measure,
+                       task_dataset)
+
+
+class TestMultiTask(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size=50, hidden_size=16, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=32)
+        self.model = MultiTaskModel(
+            BertModel(config), {'a': ['x', 'y'], 'b': ['x', 'y', 'z']}).eval()
+
+    def test_task_dataset_concatenates_tasks(self):
+        splits = {'b': Dataset.from_dict({'input_ids': [[1, 2], [3]],
+                                          'label': [2, 0], 'text': ['', '']}),
+                  'a': Dataset.from_dict({'input_ids': [[4]], 'label': [1]})}
+        dataset = task_dataset(splits, ['a', 'b'])
+        self.assertEqual({'input_ids': [[1, 2], [3], [4]], 'label': [2, 0, 1],
+                          TASK_ID: [1, 1, 0]}, dataset[:])
+
+    def test_loss_uses_head_of_each_sample(self):
+        inputs = {'input_ids': torch.randint(50, (4, 5)),
+                  'attention_mask': torch.ones(4, 5, dtype=torch.long)}
+        labels = torch.tensor([1, 2, 0, 0])
+        task_ids = torch.tensor([0, 1, 1, 0])
+        trainer = MultiTaskTrainer.__new__(MultiTaskTrainer)
+        loss = trainer.compute_loss(self.model, {
+            **inputs, 'labels': labels, TASK_ID: task_ids})
+        with torch.no_grad():
+            logits = self.model(**inputs)
+        expected = torch.cat([
+            F.cross_entropy(logits['a'][[0, 3]], labels[[0, 3]],
+                            reduction='none'),
+            F.cross_entropy(logits['b'][[1, 2]], labels[[1, 2]],
+                            reduction='none')]).mean()
+        self.assertAlmostEqual(expected.item(), loss.item(), places=5)
+        matrices = confusion_matrices(self.model, [
+            {**inputs, 'labels': labels, TASK_ID: task_ids}])
+        self.assertEqual({'a': 2, 'b': 2},
+                         {task: int(matrix.matrix.sum())
+                          for task, matrix in matrices.items()})
+
+    def test_unknown_task(self):
+        inputs = {'input_ids': torch.randint(50, (1, 5)),
+                  'attention_mask': torch.ones(1, 5, dtype=torch.long)}
+        with self.assertRaisesRegex(ValueError, "no head for task 'c'"):
+            self.model('c', **inputs)
+
+    def test_predict_truncates_as_in_training(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            write_tiny_model(model_dir)
+            tokeniser = AutoTokenizer.from_pretrained(model_dir)
+        classifier = MultiTaskClassifier.__new__(MultiTaskClassifier)
+        classifier.tokeniser = tokeniser
+        classifier.model = self.model
+        classifier.max_length = 4
+        lengths = []
+        forward = self.model.forward
+
+        def record(**inputs):
+            lengths.append(inputs['input_ids'].shape[1])
+            return forward(**inputs)
+        self.model.forward = record
+        labels, _ = classifier.predict(['w1 w2 w3 w4 w5', 'w1'])['b']
+        self.assertEqual((2, 1), labels.shape)
+        self.assertEqual([4], lengths)
+
+    def test_all_heads_from_one_pass(self):
+        model = self.model
+        inputs = {'input_ids': torch.randint(50, (3, 5)),
+                  'attention_mask': torch.ones(3, 5, dtype=torch.long)}
+        with torch.no_grad():
+            logits = model(**inputs)
+            self.assertEqual({'a': (3, 2), 'b': (3, 3)},
+                             {k: tuple(v.shape) for k, v in logits.items()})
+            self.assertTrue(torch.allclose(logits['b'],
+                                           model('b', **inputs)))
+
+    @unittest.skipIf(torch.cuda.is_available()
+                     or not os.path.exists('/proc/self/clear_refs'),
+                     'peak RSS cannot be reset')
+    def test_predict_and_measure_peak_memory(self):
+        output, seconds, peak = predict_and_measure(
+            lambda n: len(b'x' * n), 64 * 2**20)
+        self.assertEqual(64 * 2**20, output)
+        self.assertGreaterEqual(seconds, 0.0)
+        self.assertGreater(peak, 48)
+        self.assertLess(predict_and_measure(len, [])[2], 48)
@@ -0,0 +1,68 @@
+"""Tests for profiles."""
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+from profiles import PROFILES, apply_profile, autocast
+
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.classifier = SimpleNamespace(
+            args=SimpleNamespace(fp16=False, per_device_train_batch_size=128,
+                                 gradient_accumulation_steps=1),
+            data={'train': {'input_ids': [[1, 2, 3], [1, 2, 3, 4, 5]]}},
+            model_name_or_path='model', _load_model=None, bf16=False,
+            gradient_checkpointing=False)
+
+    def test_autocast_invalid_precision(self):
+        """Raises ValueError."""
+        with self.assertRaises(ValueError):
+            with autocast('fp8'):
+                pass
+
+    def test_apply_profile_invalid_name(self):
+        """Raises ValueError."""
+        with self.assertRaises(ValueError):
+            apply_profile(self.classifier, 'fastest')
+
+    @mock.patch('torch.cuda.is_available', return_value=True)
+    def test_apply_profile_accumulates_gradients(self, _):
+        with mock.patch('profiles.cached_batch_size',
+                        return_value=48) as probe:
+            apply_profile(self.classifier, 'low-memory')
+        self.assertEqual(5, probe.call_args[0][2])  # longest sample
+        args = self.classifier.args
+        self.assertTrue(args.fp16)
+        self.assertTrue(self.classifier.gradient_checkpointing)
+        self.assertEqual(32, args.per_device_train_batch_size)
+        self.assertEqual(4, args.gradient_accumulation_steps)
+
+    @mock.patch('torch.cuda.is_available', return_value=True)
+    def test_apply_profile_keeps_effective_batch(self, _):
+        for fitting in [1, 7, 48, 64, 127, 128, 500]:
+            with self.subTest(fitting=fitting):
+                self.setUp()
+                with mock.patch('profiles.cached_batch_size',
+                                return_value=fitting):
+                    apply_profile(self.classifier, 'fp16-accumulate')
+                args = self.classifier.args
+                self.assertLessEqual(args.per_device_train_batch_size,
+                                     fitting)
+                self.assertEqual(128, args.per_device_train_batch_size
+                                 * args.gradient_accumulation_steps)
+
+    @mock.patch('torch.cuda.is_available', return_value=True)
+    def test_apply_profile_rejects_batch_without_close_divisor(self, _):
+        """Raises ValueError instead of accumulating single samples."""
+        self.classifier.args.per_device_train_batch_size = 127
+        with mock.patch('profiles.cached_batch_size', return_value=64):
+            with self.assertRaisesRegex(ValueError, r'\[64, 128\]'):
+                apply_profile(self.classifier, 'fp16-accumulate')
+
+    @mock.patch('torch.cuda.is_available', return_value=False)
+    def test_apply_profile_on_cpu_keeps_fp32(self, _):
+        apply_profile(self.classifier, PROFILES['fp16-accumulate'])
+        self.assertFalse(self.classifier.args.fp16)
+        self.assertEqual(128, self.classifier.args.per_device_train_batch_size)
+        self.assertEqual(1, self.classifier.args.gradient_accumulation_steps)
@@ -0,0 +1,46 @@
+"""Tests for prune."""
+import tempfile
+import unittest
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification
+
+from prune import heads_to_prune, num_parameters, pareto_optimal, prune_model
+
+
+class TestPrune(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = BertForSequenceClassification(BertConfig(
+            vocab_size=50, hidden_size=16, num_hidden_layers=2,
+            num_attention_heads=4, intermediate_size=32, num_labels=3))
+
+    def test_heads_to_prune_keeps_one_head_per_layer(self):
+        importance = torch.tensor([[0.1, 0.2, 0.3, 0.4],
+                                   [0.9, 0.8, 0.7, 0.6]])
+        self.assertEqual({0: [0, 1]}, heads_to_prune(importance, 0.25))
+        heads = heads_to_prune(importance, 0.9)
+        self.assertEqual({0: [0, 1, 2], 1: [1, 2, 3]}, heads)
+
+    def test_pruned_model_loads_with_from_pretrained(self):
+        heads = torch.rand(2, 4)
+        neurons = torch.rand(2, 32)
+        size = num_parameters(self.model)
+        prune_model(self.model, heads, neurons, 0.5).eval()
+        self.assertLess(num_parameters(self.model), size)
+        self.assertEqual(16, self.model.config.intermediate_size)
+        input_ids = torch.randint(5, 50, (2, 7))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.model.save_pretrained(tmp_dir)
+            loaded = BertForSequenceClassification.from_pretrained(
+                tmp_dir).eval()
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(self.model(input_ids)[0],
+                                           loaded(input_ids)[0]))
+
+    def test_pareto_optimal(self):
+        rows = [{'accuracy': 0.9, 'latency_ms': 10, 'parameters': 100},
+                {'accuracy': 0.9, 'latency_ms': 8, 'parameters': 80},
+                {'accuracy': 0.8, 'latency_ms': 5, 'parameters': 60},
+                {'accuracy': 0.7, 'latency_ms': 6, 'parameters': 60}]
+        self.assertEqual([False, True, True, False], pareto_optimal(rows))
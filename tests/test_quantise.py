@@ -0,0 +1,48 @@
+"""Tests for quantise."""
+from pathlib import Path
+import tempfile
+import unittest
+
+import torch
+from transformers import (BertConfig, BertForSequenceClassification,
+                          BertTokenizerFast)
+
+from quantise import (load_quantised, model_size, quantise_classifier,
+                      quantise_dynamic, save_quantised)
+
+
+class TestQuantise(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = BertForSequenceClassification(BertConfig(
+            vocab_size=50, hidden_size=16, num_hidden_layers=2,
+            num_attention_heads=4, intermediate_size=32,
+            num_labels=3)).eval()
+        self.input_ids = torch.randint(5, 50, (2, 7))
+
+    def test_quantise_dynamic_copies_model(self):
+        int8 = quantise_dynamic(self.model)
+        self.assertIsInstance(
+            self.model.bert.encoder.layer[0].output.dense, torch.nn.Linear)
+        self.assertLess(model_size(int8), model_size(self.model))
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(self.model(self.input_ids)[0],
+                                           int8(self.input_ids)[0],
+                                           atol=0.1))
+
+    def test_save_and_load_quantised(self):
+        int8 = quantise_dynamic(self.model)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vocab_file = Path(tmp_dir).joinpath('vocab.txt')
+            vocab_file.write_text('[PAD]\n[UNK]\n[CLS]\n[SEP]\n')
+            tokeniser = BertTokenizerFast(str(vocab_file))
+            save_quantised(int8, tokeniser, tmp_dir)
+            loaded = load_quantised(tmp_dir)
+        with torch.no_grad():
+            self.assertTrue(torch.equal(int8(self.input_ids)[0],
+                                        loaded(self.input_ids)[0]))
+
+    def test_quantise_classifier_rejects_onnx_export(self):
+        """Raises ValueError instead of exporting the FP32 model."""
+        with self.assertRaises(ValueError):
+            quantise_classifier(None, None, export_format='onnx')
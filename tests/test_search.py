@@ -0,0 +1,44 @@
+"""Tests for search."""
+import threading
+from types import SimpleNamespace
+import unittest
+
+from transformers import TrainerControl
+
+from search import (HalvingCallback, SuccessiveHalving, grid_configs,
+                    rung_epochs, sample_configs, SEARCH_SPACE)
+
+
+class TestSearch(unittest.TestCase):
+    def test_rung_epochs(self):
+        self.assertEqual([1, 3, 9], rung_epochs(1, 10, 3))
+        self.assertEqual([2, 4], rung_epochs(2, 8, 2))
+
+    def test_sample_configs_are_in_search_space(self):
+        configs = sample_configs(50, seed=1)
+        self.assertEqual(configs, sample_configs(50, seed=1))
+        for config in configs:
+            self.assertTrue(1e-5 <= config['lr'] <= 3e-4)
+            self.assertIn(config['batch'], SEARCH_SPACE['batch'])
+            self.assertTrue(0 <= config['warmup'] <= 0.2)
+            self.assertIn(config['weight_decay'],
+                          SEARCH_SPACE['weight_decay'])
+        self.assertEqual(6, len(grid_configs()))
+
+    def test_successive_halving_keeps_top_trials(self):
+        scheduler = SuccessiveHalving([1, 3], 3, {}, threading.Lock())
+        self.assertTrue(scheduler.report(1, 0.5))  # first at rung
+        self.assertTrue(scheduler.report(2, 0.1))  # not a rung
+        self.assertFalse(scheduler.report(1, 0.4))
+        self.assertTrue(scheduler.report(1, 0.6))
+        self.assertEqual({1: [0.5, 0.4, 0.6]}, scheduler.records)
+
+    def test_callback_stops_training(self):
+        scheduler = SuccessiveHalving([1], 2, {1: [0.9]}, threading.Lock())
+        callback = HalvingCallback(scheduler)
+        control = TrainerControl()
+        callback.on_evaluate(None, SimpleNamespace(epoch=1.0), control,
+                             metrics={'eval_accuracy': 0.5})
+        self.assertTrue(control.should_training_stop)
+        self.assertTrue(callback.stopped)
+        self.assertEqual({1: 0.5}, callback.accuracies)
@@ -0,0 +1,85 @@
+"""Tests for serve."""
+from http.server import ThreadingHTTPServer
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from benchmarks.run_benchmarks import write_tiny_model
+from serve import BatchPredictor, make_handler
+
+
+class TestServe(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        write_tiny_model(cls.tmp_dir.name, num_labels=3)
+        cls.predictor = BatchPredictor(cls.tmp_dir.name, ['a', 'b', 'c'],
+                                       top_k=2, max_batch=4,
+                                       max_latency=200)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                         make_handler(cls.predictor))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.tmp_dir.cleanup()
+
+    def post(self, body, path='/predict'):
+        url = f'http://127.0.0.1:{self.server.server_port}{path}'
+        try:
+            with urlopen(url, json.dumps(body).encode()) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_predict(self):
+        code, body = self.post({'texts': ['w1 w2', 'w3']})
+        self.assertEqual(200, code)
+        self.assertEqual(2, len(body['predictions']))
+        for prediction in body['predictions']:
+            self.assertIn(prediction['label'], ['a', 'b', 'c'])
+            self.assertEqual(2, len(prediction['top_k']))
+            self.assertEqual([prediction['label'], prediction['probability']],
+                             prediction['top_k'][0])
+        code, body = self.post({'text': 'w1'})
+        self.assertEqual((200, 1), (code, len(body['predictions'])))
+
+    def test_invalid_requests(self):
+        for request in [{'texts': 'abc'}, {'texts': [1]}, {'text': None},
+                        {}, [], 'w1']:
+            with self.subTest(request=request):
+                code, body = self.post(request)
+                self.assertEqual(400, code)
+                self.assertIn('invalid request', body['error'])
+        self.assertEqual(404, self.post({'text': 'w1'}, '/other')[0])
+
+    def test_prediction_error(self):
+        with mock.patch.object(self.predictor, 'predict',
+                               side_effect=RuntimeError('model failed')):
+            code, body = self.post({'texts': ['w1', 'w2']})
+        self.assertEqual(500, code)
+        self.assertIn('model failed', body['error'])
+        self.assertEqual(200, self.post({'text': 'w1'})[0])
+
+    def test_requests_are_batched(self):
+        predictor = BatchPredictor(self.tmp_dir.name, max_batch=4,
+                                   max_latency=500)
+        predict, batches = predictor.predict, []
+
+        def record(texts):
+            batches.append(len(texts))
+            return predict(texts)
+        predictor.predict = record
+        futures = [predictor.submit(f'w{i}') for i in range(10)]
+        results = [future.result() for future in futures]
+        self.assertEqual([4, 4, 2], batches)
+        expected = predict([f'w{i}' for i in range(10)])
+        for row, result in zip(expected, results):
+            self.assertEqual([label for label, _ in row],
+                             [label for label, _ in result])
@@ -0,0 +1,66 @@
+"""Tests for polyai_dataset.stratified_split."""
+from collections import Counter
+import csv
+from pathlib import Path
+import tempfile
+import unittest
+
+import numpy as np
+
+from polyai_dataset.stratified_split import (
+    read_column, read_split, validation_mask
+)
+
+
+class TestStratifiedSplit(unittest.TestCase):
+    def setUp(self):
+        self.labels = ['a', 'b', 'a', 'c', 'a', 'b', 'a', 'a'] * 5
+
+    def test_validation_mask_first_matches_first_per_class(self):
+        expected = []
+        for label, count in Counter(self.labels).items():
+            expected.extend([i for i, c in enumerate(self.labels)
+                             if c == label][:count // 5])
+        mask = validation_mask(self.labels)
+        self.assertEqual(sorted(expected),
+                         [i for i, m in enumerate(mask) if m])
+
+    def test_validation_mask_random_is_balanced(self):
+        mask = validation_mask(self.labels, strategy='random', seed=1)
+        selected = Counter(c for c, m in zip(self.labels, mask) if m)
+        expected = {c: n // 5 for c, n in Counter(self.labels).items()}
+        self.assertEqual(expected, dict(selected))
+
+    def test_validation_mask_random_is_seeded(self):
+        first = validation_mask(self.labels, strategy='random', seed=3)
+        second = validation_mask(self.labels, strategy='random', seed=3)
+        self.assertEqual(first, second)
+
+    def test_validation_mask_of_label_ids_matches_labels(self):
+        ids = np.array(['cba'.index(c) for c in self.labels], dtype=np.int64)
+        for strategy in ['first', 'random']:
+            with self.subTest(strategy=strategy):
+                self.assertEqual(
+                    validation_mask(self.labels, strategy=strategy, seed=2),
+                    validation_mask(ids, strategy=strategy, seed=2))
+
+    def test_validation_mask_invalid_strategy(self):
+        """Raises ValueError."""
+        with self.assertRaises(ValueError):
+            validation_mask(self.labels, strategy='last')
+
+    def test_read_split_partitions_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = Path(tmp_dir).joinpath('train.csv')
+            with open(filepath, 'w', newline='') as fp:
+                writer = csv.writer(fp)
+                writer.writerow(['text', 'category'])
+                for i, label in enumerate(self.labels):
+                    writer.writerow([f'text, {i}', label])
+            self.assertEqual(self.labels, list(read_column(filepath)))
+            mask = validation_mask(read_column(filepath))
+            train = list(read_split(filepath, mask, 0))
+            val = list(read_split(filepath, mask, 1))
+        self.assertEqual(len(self.labels), len(train) + len(val))
+        self.assertEqual(sum(mask), len(val))
+        self.assertEqual('text, 0', val[0]['text'])
@@ -0,0 +1,60 @@
+"""Tests for telemetry."""
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from telemetry import Telemetry, stage, timed_iter
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_stage_writes_jsonl_records(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp).joinpath('logs', 'telemetry.jsonl')
+            telemetry = Telemetry(path)
+            with telemetry.stage('outer', samples=10):
+                with telemetry.stage('inner') as record:
+                    record['tokens'] = 100
+            records = [json.loads(line)
+                       for line in path.read_text().splitlines()]
+        self.assertEqual(['inner', 'outer'],
+                         [record['stage'] for record in records])
+        self.assertEqual(records, telemetry.records)
+        self.assertGreater(records[0]['tokens_per_second'], 0)
+        self.assertEqual(10, records[1]['samples'])
+        self.assertGreaterEqual(records[1]['seconds'], records[0]['seconds'])
+        self.assertGreaterEqual(records[1]['peak_rss_mb'],
+                                records[0]['peak_rss_mb'])
+
+    @unittest.skipUnless(Path('/proc/self/clear_refs').exists(),
+                         'peak RSS is only reset on Linux')
+    def test_stage_peak_rss_is_per_stage(self):
+        telemetry = Telemetry()
+        with telemetry.stage('large'):
+            data = np.ones(2**25)  # 256 MB
+            del data
+        with telemetry.stage('small'):
+            pass
+        large, small = (r['peak_rss_mb'] for r in telemetry.records)
+        self.assertGreater(large - small, 200)
+
+    def test_timed_iter_counts_stall(self):
+        def slow():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+        record = {}
+        self.assertEqual([0, 1, 2], list(timed_iter(slow(), record)))
+        self.assertGreaterEqual(record['stall_seconds'], 0.03)
+
+    def test_stage_without_telemetry(self):
+        with stage(None, 'eval', samples=1) as record:
+            record['tokens'] = 2
+        self.assertEqual({'samples': 1, 'tokens': 2}, record)
+
+    def test_trace_file_next_to_telemetry_file(self):
+        telemetry = Telemetry('logs/run.jsonl', trace_steps=(1, 2))
+        self.assertEqual(Path('logs/run-trace.json'), telemetry.trace_file)
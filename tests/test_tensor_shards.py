@@ -0,0 +1,59 @@
+"""Tests for tensor_shards."""
+import random
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from datasets import Dataset
+
+from tensor_shards import ShardBatches, ShardLoader, export_split
+
+
+class TestTensorShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rng = random.Random(0)
+        self.input_ids = [[rng.randint(5, 99)] * rng.randint(2, 30)
+                          for _ in range(200)]
+        self.dataset = Dataset.from_dict({
+            'input_ids': self.input_ids,
+            'label': [i % 7 for i in range(200)]})
+        self.tokeniser = SimpleNamespace(pad_token_id=1, pad_token_type_id=0,
+                                         padding_side='right')
+        self.shards = export_split(self.tokeniser, self.dataset,
+                                   self.tmp_dir.name, bucket_width=8,
+                                   shard_size=16)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_batches_cover_all_samples_once(self):
+        batches = ShardBatches(self.shards, 10, shuffle=True,
+                               with_index=True)
+        indices = [i for batch in batches for i in batch['index'].tolist()]
+        self.assertEqual(list(range(200)), sorted(indices))
+        self.assertEqual(len(batches), len(list(batches)))
+
+    def test_batches_are_padded_samples(self):
+        for batch in ShardBatches(self.shards, 10, with_index=True):
+            length = batch['input_ids'].shape[1]
+            self.assertEqual(0, length % 8)
+            for row, i in enumerate(batch['index'].tolist()):
+                ids = self.input_ids[i]
+                self.assertEqual(ids + [1] * (length - len(ids)),
+                                 batch['input_ids'][row].tolist())
+                self.assertEqual(len(ids),
+                                 int(batch['attention_mask'][row].sum()))
+                self.assertEqual(i % 7, int(batch['labels'][row]))
+
+    def test_loader_workers_keep_order_and_shuffle_epochs(self):
+        loader = ShardLoader(ShardBatches(self.shards, 10, shuffle=True,
+                                          with_index=True), num_workers=2)
+        epochs = [[batch['index'].tolist() for batch in loader]
+                  for _ in range(2)]
+        batches = ShardBatches(self.shards, 10, shuffle=True,
+                               with_index=True)
+        self.assertEqual([batch['index'].tolist() for batch in batches],
+                         epochs[0])
+        self.assertNotEqual(epochs[0], epochs[1])
+        self.assertGreaterEqual(loader.stats['stall_seconds'], 0.0)
@@ -0,0 +1,55 @@
+"""Tests for tokenise_cache."""
+import tempfile
+import unittest
+from unittest import mock
+
+from datasets import Dataset, DatasetDict
+from transformers import AutoTokenizer
+
+from tokenise_cache import TokenisedCache
+
+
+class TestTokenisedCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokeniser = AutoTokenizer.from_pretrained(
+            'roberta-base', use_fast=True, add_prefix_space=True)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data = DatasetDict({
+            'train': Dataset.from_dict(
+                {'text': ['foo bar', 'aa bb c def'], 'label': [0, 3]}),
+            'test': Dataset.from_dict({'text': ['Foo'], 'label': [1]})
+        })
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_tokenise_second_call_is_hit(self):
+        cache = TokenisedCache(self.tmp_dir.name)
+        cold = cache.tokenise(TestTokenisedCache.tokeniser, self.data)
+        warm = cache.tokenise(TestTokenisedCache.tokeniser, self.data)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.assertEqual(cold['train']['input_ids'],
+                         warm['train']['input_ids'])
+
+    def test_key_depends_on_uncased(self):
+        cache = TokenisedCache(self.tmp_dir.name)
+        tokeniser = TestTokenisedCache.tokeniser
+        self.assertNotEqual(cache.key(tokeniser, self.data),
+                            cache.key(tokeniser, self.data, uncased=True))
+
+    def test_key_depends_on_tokenise_version(self):
+        cache = TokenisedCache(self.tmp_dir.name)
+        tokeniser = TestTokenisedCache.tokeniser
+        key = cache.key(tokeniser, self.data)
+        with mock.patch('tokenise_cache.TOKENISE_VERSION', 0):
+            self.assertNotEqual(key, cache.key(tokeniser, self.data))
+
+    def test_evict_keeps_cache_within_max_size(self):
+        cache = TokenisedCache(self.tmp_dir.name, max_size=1)
+        cache.tokenise(TestTokenisedCache.tokeniser, self.data)
+        cache.tokenise(TestTokenisedCache.tokeniser, self.data, uncased=True)
+        # Only the most recently added entry is kept
+        self.assertEqual(1, len(cache.entries()))
@@ -1,10 +1,16 @@
 """Tests for tokenise_data."""
+import os
+import tempfile
 import unittest
+from unittest import mock
 
-from datasets import Dataset
+from datasets import Dataset, DatasetDict
 from transformers import AutoTokenizer
 
-from tokenise_data import tokenise_data
+from tokenise_data import (attention_flops, length_percentiles,
+                           load_truncation_length, save_truncation_length,
+                           token_lengths, tokenisation_plan, tokenise_data,
+                           truncate_data, truncation_length)
 
 
 class TestTokeniseData(unittest.TestCase):
@@ -51,3 +57,65 @@ class TestTokeniseData(unittest.TestCase):
         converted = tokeniser.decode(
             tokenised['input_ids'][0], skip_special_tokens=True).strip()
         self.assertEqual(mixed_case.lower(), converted)
+
+    def test_tokenise_data_preserves_dataset_dict_splits(self):
+        data = DatasetDict({'train': self.data, 'test': self.data})
+        tokenised = tokenise_data(TestTokeniseData.tokeniser, data)
+        self.assertEqual(['train', 'test'], list(tokenised))
+        self.assertEqual(tokenised['train']['input_ids'],
+                         tokenised['test']['input_ids'])
+
+    def test_tokenisation_plan_single_cpu(self):
+        with mock.patch('os.cpu_count', return_value=1):
+            plan = tokenisation_plan(TestTokeniseData.tokeniser, 10**7)
+        self.assertIsNone(plan['num_proc'])
+
+    def test_tokenisation_plan_small_split_in_process(self):
+        plan = tokenisation_plan(TestTokeniseData.tokeniser, 2)
+        self.assertIsNone(plan['num_proc'])
+        self.assertEqual(2, plan['batch_size'])
+
+    def test_tokenisation_plan_at_most_one_process_per_cpu(self):
+        plan = tokenisation_plan(TestTokeniseData.tokeniser, 10**9)
+        self.assertLessEqual(plan['num_proc'] or 1, os.cpu_count())
+
+    def test_length_percentiles_are_sample_lengths(self):
+        percentiles = length_percentiles(list(range(1, 101)), [50, 99, 100])
+        self.assertEqual({'p50': 50, 'p99': 99, 'p100': 100}, percentiles)
+
+    def test_truncation_length_policies(self):
+        tokeniser = TestTokeniseData.tokeniser
+        lengths = list(range(3, 103))
+        self.assertEqual(64, truncation_length(tokeniser, lengths, 64))
+        self.assertEqual(52, truncation_length(tokeniser, lengths, 'p50'))
+        self.assertEqual(tokeniser.model_max_length,
+                         truncation_length(tokeniser, lengths, 'model'))
+        self.assertEqual(tokeniser.model_max_length,
+                         truncation_length(tokeniser, lengths, 10**6))
+        for policy in ['p0', 'max', 2]:
+            with self.assertRaises(ValueError):
+                truncation_length(tokeniser, lengths, policy)
+
+    def test_truncate_data_equals_tokenising_with_max_length(self):
+        tokeniser = TestTokeniseData.tokeniser
+        data = DatasetDict({'train': self.data, 'test': self.data})
+        truncated = truncate_data(tokeniser,
+                                  tokenise_data(tokeniser, data), 4)
+        expected = tokeniser(self.data['text'], truncation=True, max_length=4)
+        for split in truncated.values():
+            self.assertEqual(expected['input_ids'], split['input_ids'])
+            self.assertEqual(expected['attention_mask'],
+                             split['attention_mask'])
+        self.assertEqual([4, 4], token_lengths(truncated)['test'].tolist())
+
+    def test_truncation_length_is_saved_with_model(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            self.assertIsNone(load_truncation_length(model_dir))
+            save_truncation_length(model_dir, 64)
+            self.assertEqual(64, load_truncation_length(model_dir))
+
+    def test_attention_flops_pads_batches(self):
+        self.assertEqual(2 * (8 * 3 + 4 * 9),
+                         attention_flops([3, 1], 1, 1, batch_size=2))
+        self.assertEqual(8 * 3 + 4 * 9 + 8 * 1 + 4 * 1,
+                         attention_flops([3, 1], 1, 1, batch_size=1))
@@ -0,0 +1,64 @@
+"""Tests for train command line interface."""
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import train
+
+
+class TestTrainCli(unittest.TestCase):
+    def test_parse_does_not_import_heavy_modules(self):
+        code = ('import sys, train\n'
+                'train.build_parser().parse_args(["eval", "model", "bank"])\n'
+                'print([m for m in ["torch", "transformers", "datasets", '
+                '"polyai_dataset.banking77"] if m in sys.modules])')
+        output = subprocess.run([sys.executable, '-c', code],
+                                stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True).stdout
+        self.assertEqual('[]', output.strip())
+
+    def test_subcommands(self):
+        parser = train.build_parser()
+        args = parser.parse_args(['predict', 'model', 'clinc', 'hi', 'bye',
+                                  '--top_k', '3'])
+        self.assertIs(train.run_predict, args.run)
+        self.assertEqual(['hi', 'bye'], args.texts)
+        self.assertEqual(3, args.top_k)
+        args = parser.parse_args(['export', 'model', '--format', 'onnx'])
+        self.assertIs(train.run_export, args.run)
+
+    def test_unknown_dataset(self):
+        """Exits with argparse error."""
+        with self.assertRaises(SystemExit):
+            train.build_parser().parse_args(['eval', 'model', 'unknown'])
+
+    def test_shards_reject_max_tokens(self):
+        with self.assertRaises(SystemExit):
+            train.main(['train', 'model', 'bank', '--shards', 'shards',
+                        '--max_tokens', '4096'])
+
+    def test_eval_results_do_not_overwrite_training_results(self):
+        from sentence_classifier import SentenceClassifier
+        with tempfile.TemporaryDirectory() as model_dir, \
+                mock.patch.object(train, 'DATASETS', {'bank': mock.Mock()}), \
+                mock.patch.object(SentenceClassifier, 'create') as create:
+            model = create.return_value
+            model.args.output_dir = None
+            model.eval.return_value = {'eval_loss': 0.0}
+            for split in ['train', 'validation', 'test']:
+                train.main(['eval', model_dir, 'bank', '--split', split])
+                self.assertEqual(f'-eval-{split}',
+                                 model.eval.call_args[1]['suffix'])
+
+    def test_datasets_are_lazy(self):
+        self.assertEqual(['bank', 'clinc', 'hwu'], list(train.DATASETS))
+        with self.assertRaises(KeyError):
+            train.DATASETS['unknown']
+
+    def test_choices_match_modules(self):
+        from profiles import PROFILES
+        from quantise import EXPORTS
+        self.assertEqual(list(PROFILES), train.PROFILE_NAMES)
+        self.assertEqual(EXPORTS, train.EXPORTS)
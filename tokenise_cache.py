@@ -0,0 +1,145 @@
+"""On-disk cache of tokenised datasets."""
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+from datasets import DatasetDict, load_from_disk
+
+from tokenise_data import TOKENISE_VERSION, tokenise_data
+
+
+def tokeniser_fingerprint(tokeniser) -> str:
+    """Returns hash of tokeniser vocabulary and configuration.
+
+    Fast tokenisers are hashed from their serialised backend (vocabulary,
+    normaliser, pre-tokeniser and post-processor), other tokenisers from the
+    files written by `save_pretrained`.
+    """
+    hasher = hashlib.sha256(type(tokeniser).__name__.encode())
+    if getattr(tokeniser, 'is_fast', False):
+        hasher.update(tokeniser.backend_tokenizer.to_str().encode())
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tokeniser.save_pretrained(tmp_dir)
+            for path in sorted(Path(tmp_dir).iterdir()):
+                hasher.update(path.name.encode())
+                hasher.update(path.read_bytes())
+    return hasher.hexdigest()
+
+
+def data_fingerprint(data) -> str:
+    """Returns fingerprint of Dataset or combined fingerprint of DatasetDict."""
+    if isinstance(data, DatasetDict):
+        return json.dumps({name: split._fingerprint
+                           for name, split in sorted(data.items())})
+    return data._fingerprint
+
+
+class TokenisedCache():
+    """Content-addressed cache of tokenised datasets with LRU eviction.
+
+    Each entry is a dataset saved with `save_to_disk` in a folder named after
+    the hash of tokeniser, data, tokenisation options and version of
+    `tokenise_data` output (`TOKENISE_VERSION`). Cached entries are
+    loaded with `load_from_disk`, which memory-maps the Arrow tables.
+    """
+    def __init__(self, cache_dir, max_size: int=None):
+        """Constructor.
+
+        Args:
+            cache_dir: folder for cached datasets
+            max_size: maximum total size of cached datasets in bytes, least
+            recently used entries are removed when exceeded (no limit if None)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, tokeniser, data, **kwargs) -> str:
+        """Returns cache key of data tokenised with given options.
+
+        Args:
+            tokeniser: tokeniser instance
+            data: Dataset or DatasetDict
+            kwargs: options passed to `tokenise_data` (eg. `uncased`)
+        """
+        content = json.dumps({'tokeniser': tokeniser_fingerprint(tokeniser),
+                              'data': data_fingerprint(data),
+                              'options': kwargs,
+                              'version': TOKENISE_VERSION}, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+    def tokenise(self, tokeniser, data, **kwargs):
+        """Returns tokenised data from cache, tokenising it on a cache miss.
+
+        Args:
+            tokeniser: tokeniser instance
+            data: Dataset or DatasetDict with 'text' and 'label' fields
+            kwargs: options passed to `tokenise_data` (eg. `uncased`)
+
+        Returns:
+            Same container as data with additional fields from `tokenise_data`.
+        """
+        key = self.key(tokeniser, data, **kwargs)
+        entry = self.cache_dir.joinpath(key)
+        if entry.exists():
+            self.hits += 1
+            print(f'tokenised data cache hit: {entry}')
+            os.utime(entry)  # marks entry as recently used
+            return load_from_disk(str(entry))
+        self.misses += 1
+        print(f'tokenised data cache miss: {entry}')
+        tokenised = tokenise_data(tokeniser, data, **kwargs)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Save into temporary folder first so that concurrent runs never see
+        # a partially written entry
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{key}-', dir=self.cache_dir))
+        try:
+            tokenised.save_to_disk(str(tmp_dir))
+            os.replace(tmp_dir, entry)
+        except OSError:
+            if not entry.exists():
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=key)
+        return load_from_disk(str(entry))
+
+    def entries(self) -> list:
+        """Returns [(last used time, size in bytes, path)] of cached entries,
+        least recently used first."""
+        if not self.cache_dir.exists():
+            return []
+        entries = []
+        for entry in self.cache_dir.iterdir():
+            if entry.is_dir() and not entry.name.startswith('.'):
+                size = sum(f.stat().st_size for f in entry.rglob('*')
+                           if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry))
+        return sorted(entries)
+
+    def evict(self, keep: str=None):
+        """Removes least recently used entries until cache fits in max_size.
+
+        Args:
+            keep: key of entry that is never removed
+        """
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            if entry.name != keep:
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+    def report(self) -> str:
+        """Returns summary of cache hits and misses."""
+        return (f'tokenised data cache: {self.hits} hits, {self.misses} misses'
+                f' ({self.cache_dir})')
@@ -1,17 +1,70 @@
 """Function for tokenising NER dataset."""
+import json
+import math
 import os
+from pathlib import Path
 
 from datasets.dataset_dict import DatasetDict
+import numpy as np
 
 
-def tokenise_data(tokeniser, data, uncased=False):
+# Samples per worker process below which starting processes and pickling the
+# tokeniser costs more than it saves (see benchmarks/bench_tokenise.py). Fast
+# (Rust) tokenisers already encode each batch with multiple threads.
+MIN_SAMPLES_PER_PROC = {'fast': 200000, 'slow': 10000}
+MAX_BATCH_SIZE = 10000
+PERCENTILES = [50, 90, 95, 99, 100]
+# Version of `tokenise_data` output, part of tokenised cache keys (see
+# tokenise_cache.py). Increase it whenever the output changes, so that stale
+# cache entries are not reused (2: sequences truncated to the model limit).
+TOKENISE_VERSION = 2
+# Truncation length saved next to model config (see
+# `save_truncation_length`)
+TRUNCATION_FILE = 'truncation.json'
+
+
+def tokenisation_plan(tokeniser, num_samples: int, num_proc: int=None,
+                      batch_size: int=None) -> dict:
+    """Returns `Dataset.map` arguments for tokenising a split.
+
+    Small splits are tokenised in-process with large batches, which fast
+    tokenisers encode with multiple threads. Splits large enough to keep every
+    worker busy are tokenised by a process pool of at most one process per CPU.
+
+    Args:
+        tokeniser: tokeniser instance
+        num_samples: number of samples in split
+        num_proc: number of processes (chosen from split size if None)
+        batch_size: samples per batch (chosen from split size if None)
+
+    Returns:
+        {'num_proc', 'batch_size', 'writer_batch_size'}
+    """
+    if num_proc is None:
+        kind = 'fast' if getattr(tokeniser, 'is_fast', False) else 'slow'
+        num_proc = min(num_samples // MIN_SAMPLES_PER_PROC[kind],
+                       os.cpu_count() or 1)
+    num_proc = max(1, min(num_proc, num_samples))
+    if batch_size is None:
+        batch_size = max(1, min(MAX_BATCH_SIZE, -(-num_samples // num_proc)))
+    return {'num_proc': num_proc if num_proc > 1 else None,
+            'batch_size': batch_size, 'writer_batch_size': batch_size}
+
+
+def tokenise_data(tokeniser, data, uncased=False, num_proc: int=None,
+                  batch_size: int=None):
     """Adds 'input_ids' field to dataset.
 
+    Sequences longer than the limit of the model (`model_max_length` of
+    tokeniser) are truncated, see `truncate_data` for shorter limits.
+
     Args:
         tokeniser: tokeniser instance
         data: Dataset or DatasetDict with 'text' index containing strings, and
         'label' index containing integers
         uncased: converts all text to lowercase before tokenising
+        num_proc: number of processes per split (see `tokenisation_plan`)
+        batch_size: samples per batch (see `tokenisation_plan`)
 
     Returns:
         Same container as data with additional fields 'input_ids' and optional
@@ -26,11 +79,165 @@ def tokenise_data(tokeniser, data, uncased=False):
         else:
             text = examples['text']
         examples['label']  # raises KeyError if 'label' field is missing
-        return tokeniser(text)
-    # Number of processes is half of CPUs or size of smallest (sub)set
+        return tokeniser(text, truncation=True)
+
+    def tokenise_split(split):
+        plan = tokenisation_plan(tokeniser, len(split), num_proc, batch_size)
+        return split.map(tokenise, batched=True, **plan)
     if isinstance(data, DatasetDict):
-        min_samples = min([len(split) for split in data])
+        return DatasetDict({name: tokenise_split(split)
+                            for name, split in data.items()})
+    return tokenise_split(data)
+
+
+def token_lengths(data):
+    """Returns token lengths of tokenised Dataset, or dict of them per split.
+    """
+    if isinstance(data, DatasetDict):
+        return {name: token_lengths(split) for name, split in data.items()}
+    return np.array([len(ids) for ids in data['input_ids']], dtype=np.int64)
+
+
+def length_percentiles(lengths, percentiles=PERCENTILES) -> dict:
+    """Returns {'p<percentile>': token length} of length distribution."""
+    ordered = np.sort(lengths)
+    # Nearest-rank percentiles are always lengths of actual samples
+    return {f'p{p:g}': int(ordered[max(math.ceil(p / 100 * len(ordered)) - 1,
+                                       0)]) if len(ordered) else 0
+            for p in percentiles}
+
+
+def truncation_length(tokeniser, lengths, policy) -> int:
+    """Returns maximum sequence length of truncation policy.
+
+    Args:
+        tokeniser: tokeniser instance
+        lengths: token lengths of training split (see `token_lengths`)
+        policy: int or digit string for a fixed maximum length,
+        'p<percentile>' (eg. 'p99') for a percentile of training lengths, or
+        'model' for the limit of the model
+
+    Returns:
+        Maximum length, at most the limit of the model.
+
+    Raises:
+        ValueError if policy is invalid.
+    """
+    limit = tokeniser.model_max_length
+    policy = str(policy)
+    if policy == 'model':
+        return limit
+    if policy.isdigit():
+        length = int(policy)
+    elif policy.startswith('p'):
+        try:
+            percentile = float(policy[1:])
+        except ValueError:
+            percentile = -1
+        if not 0 < percentile <= 100:
+            raise ValueError(f'invalid percentile in truncation policy '
+                             f'{policy!r}')
+        length = next(iter(length_percentiles(lengths,
+                                              [percentile]).values()))
     else:
-        min_samples = len(data)
-    num_proc = min(os.cpu_count() // 2, min_samples)
-    return data.map(tokenise, batched=True, num_proc=num_proc)
+        raise ValueError(f'unknown truncation policy {policy!r}, use a '
+                         f"length, 'p<percentile>' or 'model'")
+    special = tokeniser.num_special_tokens_to_add()
+    if length <= special:
+        raise ValueError(f'truncation length {length} leaves no tokens after '
+                         f'{special} special tokens')
+    return min(length, limit)
+
+
+def save_truncation_length(model_dir, max_length: int):
+    """Saves truncation length with model, so that evaluation and prediction
+    with the saved model truncate sentences as in training."""
+    with open(Path(model_dir).joinpath(TRUNCATION_FILE), 'w') as fp:
+        json.dump({'max_length': int(max_length)}, fp)
+
+
+def load_truncation_length(model_dir) -> int:
+    """Returns truncation length saved with model, or None."""
+    path = Path(model_dir).joinpath(TRUNCATION_FILE)
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text())['max_length']
+
+
+def truncate_data(tokeniser, data, max_length: int, num_proc: int=None):
+    """Truncates tokenised sequences to max_length tokens.
+
+    Trailing special tokens (eg. [SEP]) are kept, so the result equals
+    tokenising with `max_length`. The token length distribution, fraction of
+    truncated sequences and reduction of attention cost (sum of squared
+    lengths) are printed per split.
+
+    Args:
+        tokeniser: tokeniser instance
+        data: Dataset or DatasetDict tokenised by `tokenise_data`
+        max_length: maximum number of tokens including special tokens
+        num_proc: number of processes per split
+
+    Returns:
+        Same container as data with truncated 'input_ids' and other token
+        fields.
+    """
+    def truncate(examples):
+        fields = [key for key in ['input_ids', 'attention_mask',
+                                  'token_type_ids'] if key in examples]
+        for i, ids in enumerate(examples['input_ids']):
+            if len(ids) <= max_length:
+                continue
+            mask = tokeniser.get_special_tokens_mask(
+                ids, already_has_special_tokens=True)
+            # Number of trailing special tokens
+            suffix = len(mask) - len(np.trim_zeros(1 - np.array(mask), 'b'))
+            for key in fields:
+                values = examples[key][i]
+                examples[key][i] = (values[:max_length - suffix]
+                                    + values[len(values) - suffix:])
+        return examples
+
+    def truncate_split(name, split):
+        lengths = token_lengths(split)
+        truncated = lengths > max_length
+        squares = float(np.sum(lengths.astype(np.float64) ** 2))
+        after = float(np.sum(np.minimum(lengths, max_length)
+                             .astype(np.float64) ** 2))
+        percentiles = ', '.join(f'{k} = {v}' for k, v
+                                in length_percentiles(lengths).items())
+        print(f'{name} token lengths: {percentiles}; '
+              f'{truncated.mean() if len(lengths) else 0:.2%} truncated to '
+              f'{max_length}, attention cost '
+              f'-{1 - after / squares if squares else 0:.1%}')
+        if not truncated.any():
+            return split
+        plan = tokenisation_plan(tokeniser, len(split), num_proc)
+        return split.map(truncate, batched=True, **plan)
+    if isinstance(data, DatasetDict):
+        return DatasetDict({name: truncate_split(name, split)
+                            for name, split in data.items()})
+    return truncate_split('dataset', data)
+
+
+def attention_flops(lengths, hidden_size: int, num_layers: int,
+                    batch_size: int=1) -> float:
+    """Returns FLOPs of self-attention over samples padded per batch.
+
+    Counts the query, key, value and output projections (8 * n * d^2) and
+    the attention scores and weighted sum (4 * n^2 * d) of each layer, where
+    n is the padded length of the batch.
+
+    Args:
+        lengths: token lengths of samples in batching order
+        hidden_size: hidden size d of model
+        num_layers: number of encoder layers
+        batch_size: samples per batch, padded to longest sample
+    """
+    flops = 0.0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        n = float(max(batch))
+        flops += len(batch) * (8 * n * hidden_size**2
+                               + 4 * n * n * hidden_size)
+    return flops * num_layers
@@ -1,30 +1,99 @@
-"""Model training script."""
-from polyai_dataset.banking77 import Banking77
-from polyai_dataset.clinc150 import Clinc150
-from polyai_dataset.hwu64_sub import Hwu64Sub
-from sentence_classifier import SentenceClassifier
+"""Command line interface for training, evaluation, prediction and export.
 
+Heavy modules (torch, transformers, datasets) and dataset builders are only
+imported after arguments are parsed, and only those the subcommand needs, so
+that --help and argument errors return immediately (see
+benchmarks/bench_startup.py).
 
-DATASETS = {'bank': Banking77, 'clinc': Clinc150, 'hwu': Hwu64Sub}
+Examples:
+    python train.py train bert bank --epochs 10
+    python train.py eval models/bert-base-uncased_bank_10epochs bank
+    python train.py predict models/bert-base-uncased_bank_10epochs bank \
+        'I still have not received my new card'
+    python train.py export models/bert-base-uncased_bank_10epochs \
+        --format onnx
 
-if __name__ == '__main__':
-    import argparse
-
-    parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('model', type=str, help='Huggingface pretrained model '
-                        'or path to saved model on disk')
-    parser.add_argument('dataset', type=str,
-                        help=f'dataset to use {list(DATASETS)}')
-    parser.add_argument('--out_dir', type=str, help='directory to save model')
-    parser.add_argument('--batch', default=128,  # for 16 GB GPU RAM
-                        help='per GPU training batch size')
-    parser.add_argument('--lr', default=1e-4, help='learning rate')
-    parser.add_argument('--epochs', default=10, help='training epochs')
-    args = parser.parse_args()
-    # Run
+Without a subcommand, arguments are passed to 'train'.
+"""
+import argparse
+from collections.abc import Mapping
+import importlib
+from pathlib import Path
+import sys
+
+
+COMMANDS = ['train', 'eval', 'predict', 'export']
+# Names of training profiles (see profiles.PROFILES)
+PROFILE_NAMES = ['fp32', 'fp16', 'bf16', 'fp16-accumulate', 'bf16-accumulate',
+                 'low-memory']
+EXPORTS = ['torchscript', 'onnx']  # see quantise.EXPORTS
+
+
+class LazyBuilders(Mapping):
+    """Mapping of dataset names to builder classes imported on first use."""
+    def __init__(self, builders: dict):
+        """Constructor.
+
+        Args:
+            builders: {dataset name: 'module.Class' of builder}
+        """
+        self._builders = builders
+        self._classes = {}
+
+    def __getitem__(self, name):
+        if name not in self._classes:
+            module, _, cls = self._builders[name].rpartition('.')
+            self._classes[name] = getattr(importlib.import_module(module),
+                                          cls)
+        return self._classes[name]
+
+    def __iter__(self):
+        return iter(self._builders)
+
+    def __len__(self):
+        return len(self._builders)
+
+
+DATASETS = LazyBuilders({'bank': 'polyai_dataset.banking77.Banking77',
+                         'clinc': 'polyai_dataset.clinc150.Clinc150',
+                         'hwu': 'polyai_dataset.hwu64_sub.Hwu64Sub'})
+
+
+def create_cache(args):
+    """Returns TokenisedCache of --cache_dir, or None."""
+    if not args.cache_dir:
+        return None
+    from tokenise_cache import TokenisedCache
+    max_size = int(args.cache_size * 2**30) if args.cache_size else None
+    return TokenisedCache(args.cache_dir, max_size)
+
+
+def create_telemetry(args):
+    """Returns Telemetry of --telemetry and --trace_steps, or None."""
+    if not (args.telemetry or getattr(args, 'trace_steps', None)):
+        return None
+    from telemetry import Telemetry
+    return Telemetry(args.telemetry, getattr(args, 'trace_steps', None))
+
+
+def run_train(args):
+    """Fine-tunes model, and distils teacher if given."""
+    from distil import report_tradeoff, teacher_logits
+    from profiles import apply_profile
+    from sentence_classifier import SentenceClassifier
+
+    cache = create_cache(args)
+    dataset = DATASETS[args.dataset].load()
     model = SentenceClassifier.create(
-        args.model, DATASETS[args.dataset].load(), int(args.batch))
+        args.model, dataset, int(args.batch), cache=cache,
+        group_by_length=args.group_by_length, max_tokens=args.max_tokens,
+        max_length=args.max_length, telemetry=create_telemetry(args))
+    teacher, logits = None, None
+    if args.teacher:
+        teacher = SentenceClassifier.create(args.teacher, dataset, cache=cache)
+        logits = teacher_logits(teacher, teacher.data['train'])
+    if cache:
+        print(cache.report())
     if args.out_dir:
         model.args.output_dir = args.out_dir
     else:
@@ -32,4 +101,204 @@ if __name__ == '__main__':
         model.args.output_dir = f'{model.args.output_dir}_{suffix}'
     model.args.num_train_epochs = int(args.epochs)
     model.args.learning_rate = float(args.lr)
-    model.train(test_dataset=model.data['test'])
+    apply_profile(model, args.profile)
+    splits = model.use_shards(args.shards) if args.shards else model.data
+    model.train(test_dataset=splits['test'], teacher_logits=logits,
+                alpha=args.alpha, temperature=args.temperature)
+    if teacher:
+        results = report_tradeoff(teacher, model, model.data['test'],
+                                  teacher.data['test'])
+        for name in ['teacher', 'student']:
+            print(f'{name}: accuracy = {results[f"{name}_accuracy"]:.3f}, '
+                  f'latency = {results[f"{name}_latency_ms"]:.1f} ms/batch')
+
+
+def run_eval(args):
+    """Evaluates saved model on a split of dataset, saving results into
+    'test_results-eval-<split>.txt'."""
+    from sentence_classifier import SentenceClassifier
+
+    cache = create_cache(args)
+    model = SentenceClassifier.create(
+        args.model, DATASETS[args.dataset].load(), cache=cache,
+        max_length=args.max_length, telemetry=create_telemetry(args))
+    model.args.output_dir = args.out_dir or args.model
+    if args.batch:
+        model.args.per_device_eval_batch_size = args.batch
+    Path(model.args.output_dir).mkdir(parents=True, exist_ok=True)
+    # Distinct from 'test_results-train.txt' of training (read by
+    # run_experiments.py)
+    suffix = f'-eval-{args.split}'
+    splits = model.use_shards(args.shards) if args.shards else model.data
+    metrics = model.eval(splits[args.split], suffix=suffix,
+                         save_predictions=args.save_predictions)
+    print(f'loss = {metrics["eval_loss"]:.4f}')
+
+
+def run_predict(args):
+    """Prints most probable classes of sentences, tab separated."""
+    from transformers import AutoTokenizer, TrainingArguments
+
+    from sentence_classifier import SentenceClassifier
+    from tokenise_data import load_truncation_length
+
+    texts = args.texts
+    if args.file:
+        with open(args.file) as reader:
+            texts = [line.rstrip('\n') for line in reader]
+    elif not texts:
+        texts = [line.rstrip('\n') for line in sys.stdin]
+    # Only class names of the dataset are used, so it is not tokenised
+    model = SentenceClassifier(
+        TrainingArguments(output_dir=args.model), args.model,
+        AutoTokenizer.from_pretrained(args.model, use_fast=True),
+        DATASETS[args.dataset].load())
+    model.max_length = args.max_length or load_truncation_length(args.model)
+    labels, scores = model.predict(texts, args.batch, args.top_k)
+    for text, row_labels, row_scores in zip(texts, labels, scores):
+        predictions = '\t'.join(f'{label}\t{score:.3f}'
+                                for label, score in zip(row_labels,
+                                                        row_scores))
+        print(f'{text}\t{predictions}')
+
+
+def run_export(args):
+    """Exports saved model for inference without transformers."""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    from quantise import export
+
+    suffix = '.pt' if args.format == 'torchscript' else '.onnx'
+    path = args.out or str(Path(args.model).joinpath(f'model{suffix}'))
+    export(AutoModelForSequenceClassification.from_pretrained(args.model),
+           AutoTokenizer.from_pretrained(args.model, use_fast=True), path,
+           args.format)
+    print(f'exported model to {path}')
+
+
+def add_data_arguments(parser):
+    """Adds tokenisation and telemetry arguments shared by subcommands."""
+    parser.add_argument('--cache_dir', type=str,
+                        help='directory to cache tokenised datasets')
+    parser.add_argument('--cache_size', type=float,
+                        help='maximum size of tokenised dataset cache in GB')
+    parser.add_argument('--max_length', type=str,
+                        help="truncation policy: fixed length (eg. 64), "
+                        "percentile of training lengths (eg. 'p99') or "
+                        "'model' limit")
+    parser.add_argument('--telemetry', type=str,
+                        help='JSONL file of stage timings and training logs')
+    parser.add_argument('--shards', type=str,
+                        help='directory of pre-padded tensor shards of '
+                        'tokenised splits (exported if missing). Shard '
+                        'batches are grouped by length and replace '
+                        '--group_by_length, --max_tokens cannot be combined '
+                        'with them, and distillation (--teacher) trains '
+                        'from the tokenised dataset instead')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Returns parser of all subcommands."""
+    formatter = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0],
+                                     formatter_class=formatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    datasets = list(DATASETS)
+
+    train = commands.add_parser('train', help='fine-tune a model',
+                                formatter_class=formatter)
+    train.set_defaults(run=run_train)
+    train.add_argument('model', type=str, help='Huggingface pretrained model '
+                       'or path to saved model on disk')
+    train.add_argument('dataset', choices=datasets, help='dataset to use')
+    train.add_argument('--out_dir', type=str, help='directory to save model')
+    train.add_argument('--batch', default=128,  # for 16 GB GPU RAM
+                       help='per GPU training batch size (effective batch '
+                       'with accumulating profiles)')
+    train.add_argument('--profile', choices=PROFILE_NAMES, default='fp32',
+                       help='training performance profile (see profiles.py)')
+    train.add_argument('--lr', default=1e-4, help='learning rate')
+    train.add_argument('--epochs', default=10, help='training epochs')
+    add_data_arguments(train)
+    train.add_argument('--group_by_length', action='store_true',
+                       help='batch training samples of similar lengths')
+    train.add_argument('--max_tokens', type=int,
+                       help='size training batches by number of padded '
+                       'tokens instead of --batch')
+    train.add_argument('--teacher', type=str, help='directory of trained '
+                       'teacher model to distil into the model')
+    train.add_argument('--alpha', type=float, default=0.5,
+                       help='weight of cross-entropy loss in distillation')
+    train.add_argument('--temperature', type=float, default=2.0,
+                       help='softmax temperature of distillation loss')
+    train.add_argument('--trace_steps', type=int, nargs=2,
+                       metavar=('FIRST', 'LAST'),
+                       help='training steps traced with PyTorch profiler '
+                       '(saved next to --telemetry file)')
+
+    evaluate = commands.add_parser('eval', help='evaluate a saved model',
+                                   formatter_class=formatter)
+    evaluate.set_defaults(run=run_eval)
+    evaluate.add_argument('model', type=str, help='path to saved model')
+    evaluate.add_argument('dataset', choices=datasets, help='dataset to use')
+    evaluate.add_argument('--split', default='test',
+                          choices=['train', 'validation', 'test'],
+                          help='split to evaluate')
+    evaluate.add_argument('--out_dir', type=str, help='directory of results, '
+                          'saved into test_results-eval-<split>.txt (model '
+                          'directory if not set)')
+    evaluate.add_argument('--batch', type=int, help='evaluation batch size')
+    evaluate.add_argument('--save_predictions', action='store_true',
+                          help='save predicted class labels')
+    add_data_arguments(evaluate)
+
+    predict = commands.add_parser(
+        'predict', help='classify sentences with a saved model',
+        formatter_class=formatter)
+    predict.set_defaults(run=run_predict)
+    predict.add_argument('model', type=str, help='path to saved model')
+    predict.add_argument('dataset', choices=datasets,
+                         help='dataset the model was trained on')
+    predict.add_argument('texts', nargs='*', help='sentences to classify '
+                         '(read from --file or standard input if none)')
+    predict.add_argument('--file', type=str,
+                         help='file of sentences, one per line')
+    predict.add_argument('--top_k', type=int, default=1,
+                         help='most probable classes per sentence')
+    predict.add_argument('--batch', type=int, default=256,
+                         help='sentences per forward pass')
+    predict.add_argument('--max_length', type=int,
+                         help='truncation length (length saved with model '
+                         'if not set)')
+
+    export = commands.add_parser(
+        'export', help='export a saved model to TorchScript or ONNX',
+        formatter_class=formatter)
+    export.set_defaults(run=run_export)
+    export.add_argument('model', type=str, help='path to saved model')
+    export.add_argument('--format', choices=EXPORTS, default='torchscript',
+                        help='export format')
+    export.add_argument('--out', type=str, help='output file (model.pt or '
+                        'model.onnx in model directory if not set)')
+    return parser
+
+
+def main(argv: list=None):
+    """Parses arguments and runs subcommand.
+
+    Args:
+        argv: command line arguments (sys.argv[1:] if None)
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] not in COMMANDS and not argv[0].startswith('-'):
+        argv = ['train'] + argv  # arguments of previous CLI
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'shards', None) and getattr(args, 'max_tokens', None):
+        parser.error('--max_tokens cannot be combined with --shards, whose '
+                     'batches have a fixed number of samples')
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()